@@ -5,30 +5,43 @@ The goal of this module is to provide some thin abstraction between
 the chosen database engine and ORM and the IEPY core and tools.
 """
 
-from collections import defaultdict, namedtuple
-from functools import lru_cache
+from collections import defaultdict, namedtuple, OrderedDict
+from functools import lru_cache, reduce
+from itertools import groupby
+from operator import attrgetter, or_
 from random import shuffle
 import logging
 
 import iepy
 iepy.setup()
 
+from django.db.models import Q
+
+from iepy.data import minhash
 from iepy.data.models import (
-    IEDocument, IEDocumentMetadata,
+    IEDocument, IEDocumentMetadata, MinHashBand,
     TextSegment, Relation,
     Entity, EntityKind, EntityOccurrence,
-    EvidenceLabel, EvidenceCandidate
+    EvidenceLabel, EvidenceCandidate, QUERY_PARAMS_CHUNK_SIZE
 )
 
 from iepy.preprocess import segmenter
+from iepy.utils import chunks
 from iepy.preprocess.pipeline import PreProcessSteps
 
 
 IEPYDBConnector = namedtuple('IEPYDBConnector', 'segments documents')
+# The fields of an EvidenceLabel needed for computing the labels of evidences
+LabelInfo = namedtuple('LabelInfo', 'evidence_candidate_id label judge modification_date')
 
 # Number of entities that will be cached on get_entity function.
 ENTITY_CACHE_SIZE = 20  # reasonable compromise
 
+# Number of documents fetched per query when loading candidate evidences.
+DOCUMENTS_BATCH_SIZE = 100
+# Number of segments per page when streaming candidate evidences.
+SEGMENTS_PAGE_SIZE = 1000
+
 logger = logging.getLogger(__name__)
 
 
@@ -41,7 +54,8 @@ class DocumentManager(object):
     def __init__(self, base_queryset=None):
         self.base_queryset = base_queryset
 
-    def create_document(self, identifier, text, metadata=None, update_mode=False):
+    def create_document(self, identifier, text, metadata=None, update_mode=False,
+                        link_duplicates=False):
         """Creates a new Document with text ready to be inserted on the
         information extraction pipeline (ie, ready to be tokenized, POS Tagged,
         etc).
@@ -56,6 +70,11 @@ class DocumentManager(object):
         provided identifier, it's updated (be warn that if some preprocess
         result exist will be preserved untouched, delegating the responsability
         of deciding what to do to the caller of this method).
+
+        With link_duplicates enabled, if the text is nearly the same as the one
+        of a document created before (also with link_duplicates), the new
+        document metadata is linked to it as duplicate_of (so preprocessing it
+        can be skipped).
         """
         if metadata is None:
             metadata = {}
@@ -65,16 +84,64 @@ class DocumentManager(object):
             mtd_obj = IEDocumentMetadata.objects.create(items=metadata)
             doc = IEDocument.objects.create(human_identifier=identifier, text=text,
                                             metadata=mtd_obj)
+            if link_duplicates:
+                self.link_near_duplicate(doc)
         else:
             doc = filter_query.get()
-        if update_mode:
-            doc.text = text
-            doc.metadata.items = metadata
-            doc.metadata.save()
-            doc.save()
+            if update_mode:
+                text_changed = doc.text != text
+                doc.text = text
+                doc.metadata.items = metadata
+                doc.metadata.save()
+                doc.save()
+                if link_duplicates and (text_changed or not doc.metadata.minhash):
+                    self.link_near_duplicate(doc)
 
         return doc
 
+    def link_near_duplicate(self, doc):
+        """Stores the MinHash signature of the document text on its metadata,
+        and links it to the document it's a near-duplicate of, if any.
+        Otherwise, indexes it so later documents can be found to be its
+        near-duplicates."""
+        signature = minhash.signature(doc.text)
+        MinHashBand.objects.filter(document=doc).delete()
+        original = self.find_near_duplicate(signature, exclude=doc)
+        metadata = doc.metadata
+        metadata.minhash = signature
+        metadata.duplicate_of = original
+        metadata.save()
+        if original is None:
+            MinHashBand.objects.bulk_create([
+                MinHashBand(document=doc, band=band, bucket=bucket)
+                for band, bucket in minhash.band_hashes(signature)
+            ])
+        return original
+
+    def find_near_duplicate(self, signature, exclude=None):
+        """Returns the indexed document with the text most similar to the one
+        with the given MinHash signature, if they are near-duplicates, or None.
+        """
+        query = reduce(or_, (Q(band=band, bucket=bucket)
+                             for band, bucket in minhash.band_hashes(signature)))
+        candidates = MinHashBand.objects.filter(query)
+        if exclude is not None:
+            candidates = candidates.exclude(document=exclude)
+        candidate_ids = set(candidates.values_list('document_id', flat=True))
+        # values_list gives the signatures as stored, not as lists
+        to_list = IEDocumentMetadata._meta.get_field('minhash').to_python
+        best, best_similarity = None, 0
+        for ids in chunks(sorted(candidate_ids), QUERY_PARAMS_CHUNK_SIZE):
+            signatures = IEDocument.objects.filter(id__in=ids).order_by('id').values_list(
+                'id', 'metadata__minhash')
+            for doc_id, doc_signature in signatures:
+                similarity = minhash.similarity(signature, to_list(doc_signature))
+                if similarity > best_similarity:
+                    best, best_similarity = doc_id, similarity
+        if best_similarity < minhash.NEAR_DUPLICATE_THRESHOLD:
+            return None
+        return IEDocument.objects.get(id=best)
+
     def _docs(self):
         if self.base_queryset:
             docs = self.base_queryset
@@ -85,16 +152,26 @@ class DocumentManager(object):
     def __iter__(self):
         return iter(self._docs())
 
+    def get_documents(self, fields=None):
+        """Returns the documents. If fields are given, only those are loaded
+        at first (the rest, when accessed)."""
+        docs = self._docs()
+        if fields is not None:
+            docs = docs.only(*fields)
+        return docs
+
     def get_raw_documents(self):
         """returns an interator of documents that lack the text field, or it's
         empty.
         """
         return self._docs().filter(text='')
 
-    def get_documents_lacking_preprocess(self, step_or_steps):
+    def get_documents_lacking_preprocess(self, step_or_steps, fields=None,
+                                         skip_duplicates=False):
         """Returns an iterator of documents that shall be processed on the given
-        step."""
-        from django.db.models import Q
+        step. If fields are given, only those are loaded at first (the rest,
+        when accessed). With skip_duplicates, documents linked as near-duplicates
+        of another one are left out."""
         if not isinstance(step_or_steps, (list, tuple)):
             steps = [step_or_steps]
         else:
@@ -109,7 +186,10 @@ class DocumentManager(object):
                 else:
                     query = query | q
         if query is not None:
-            return self._docs().filter(query).order_by('id')
+            docs = self.get_documents(fields).filter(query)
+            if skip_duplicates:
+                docs = docs.filter(metadata__duplicate_of__isnull=True)
+            return docs.order_by('id')
         else:
             return IEDocument.objects.none()
 
@@ -185,12 +265,98 @@ class CandidateEvidenceManager(object):
         ev.all_eos = ev.segment.get_entity_occurrences()
         return ev
 
+    @classmethod
+    def documents_in_batches(cls, doc_ids, batch_size=DOCUMENTS_BATCH_SIZE,
+                             defer_fields=()):
+        """Iterates over lists of documents with the given ids, fetching each
+        list from database with a single query of batch_size documents.
+        The fields listed on defer_fields are not loaded."""
+        for chunk in chunks(list(doc_ids), batch_size):
+            documents = IEDocument.objects.filter(id__in=chunk)
+            if defer_fields:
+                documents = documents.defer(*defer_fields)
+            yield list(documents)
+
+    @classmethod
+    def prefetch_entity_occurrences(cls, segments):
+        """Loads (in bulk) the entity occurrences of each of the given segments,
+        leaving them cached on the segments as get_entity_occurrences does."""
+        Through = EntityOccurrence.segments.through
+        eos_per_segment = defaultdict(list)
+        for chunk in chunks([s.pk for s in segments], QUERY_PARAMS_CHUNK_SIZE):
+            links = Through.objects.filter(textsegment_id__in=chunk).select_related(
+                'entityoccurrence__entity__kind')
+            for link in links:
+                eos_per_segment[link.textsegment_id].append(link.entityoccurrence)
+        for segment in segments:
+            eos = sorted(eos_per_segment[segment.pk], key=lambda eo: eo.offset)
+            segment._hydrated_eos = [eo.hydrate_for_segment(segment) for eo in eos]
+
+    @classmethod
+    def construct_missing_candidates(cls, relation, segments, existent_ec_per_segment):
+        """For the given segments, creates (in bulk) the evidence candidates
+        that are missing for the relation.
+        Returns a dict with the evidence candidates of each segment, in the same
+        order that segment.get_evidences_for_relation would yield them."""
+        lkind = relation.left_entity_kind
+        rkind = relation.right_entity_kind
+        cls.prefetch_entity_occurrences(segments)
+
+        pairs_per_segment = {}
+        to_create = []
+        for segment in segments:
+            existent = set(
+                (ec.left_entity_occurrence_id, ec.right_entity_occurrence_id)
+                for ec in existent_ec_per_segment[segment.pk]
+            )
+            pairs = [(l_eo.pk, r_eo.pk)
+                     for l_eo, r_eo in segment.kind_occurrence_pairs(lkind, rkind)]
+            pairs_per_segment[segment.pk] = pairs
+            for l_eo_id, r_eo_id in pairs:
+                if (l_eo_id, r_eo_id) not in existent:
+                    to_create.append(EvidenceCandidate(
+                        left_entity_occurrence_id=l_eo_id,
+                        right_entity_occurrence_id=r_eo_id,
+                        segment_id=segment.pk,
+                    ))
+
+        if not to_create:
+            ecs_per_segment = existent_ec_per_segment
+        else:
+            logger.info("Creating %s missing candidate evidences", len(to_create))
+            EvidenceCandidate.objects.bulk_create(to_create)
+            # Ids are not set by bulk_create, so all of them are read again
+            ecs_per_segment = defaultdict(list)
+            for chunk in chunks([s.pk for s in segments], QUERY_PARAMS_CHUNK_SIZE):
+                ecs = EvidenceCandidate.objects.filter(
+                    left_entity_occurrence__entity__kind=lkind,
+                    right_entity_occurrence__entity__kind=rkind,
+                    segment__in=chunk
+                ).select_related('left_entity_occurrence', 'right_entity_occurrence')
+                for ec in ecs:
+                    ecs_per_segment[ec.segment_id].append(ec)
+
+        result = {}
+        for segment in segments:
+            by_pair = {}
+            for ec in ecs_per_segment[segment.pk]:
+                ec.segment = segment
+                by_pair[ec.left_entity_occurrence_id, ec.right_entity_occurrence_id] = ec
+            result[segment.pk] = [by_pair[pair] for pair in pairs_per_segment[segment.pk]]
+        return result
+
     @classmethod
     def candidates_for_relation(cls, relation, construct_missing_candidates=True,
-                                seg_limit=-1, shuffle_segs=False):
+                                seg_limit=-1, shuffle_segs=False,
+                                documents_batch_size=DOCUMENTS_BATCH_SIZE,
+                                defer_document_fields=()):
         # Wraps the actual database lookup of evidence, hydrating them so
         # in theory, no extra db access shall be done
         # The idea here is simple, but with some tricks for improving performance
+        # Documents are loaded in batches of documents_batch_size, skipping the
+        # fields listed on defer_document_fields (for instance, if
+        # "syntactic_sentences" is deferred, segments are hydrated without trees).
+        # Missing candidates are created in bulk for each batch of documents.
         logger.info("Loading candidate evidence from database...")
         hydrate = cls.hydrate
         segments_per_document = defaultdict(list)
@@ -220,19 +386,77 @@ class CandidateEvidenceManager(object):
         for ec in existent_ec:
             existent_ec_per_segment[ec.segment_id].append(ec)
 
-        _doc_ids = list(doc_ids)
-        while _doc_ids:
-            _id = _doc_ids.pop()
-            document = IEDocument.objects.get(id=_id)
-            for segment in segments_per_document[document.id]:
-                _existent = existent_ec_per_segment[segment.pk]
-                if construct_missing_candidates:
-                    seg_ecs = segment.get_evidences_for_relation(relation, _existent)
-                else:
-                    seg_ecs = _existent
+        batches = cls.documents_in_batches(
+            doc_ids, documents_batch_size, defer_document_fields)
+        for documents in batches:
+            if construct_missing_candidates:
+                batch_segments = [s for d in documents for s in segments_per_document[d.id]]
+                ecs_per_segment = cls.construct_missing_candidates(
+                    relation, batch_segments, existent_ec_per_segment)
+            else:
+                ecs_per_segment = existent_ec_per_segment
 
-                for evidence in seg_ecs:
-                    yield hydrate(evidence, document)
+            for document in documents:
+                for segment in segments_per_document[document.id]:
+                    for evidence in ecs_per_segment[segment.pk]:
+                        yield hydrate(evidence, document)
+
+    @classmethod
+    def candidate_pages_for_relation(cls, relation, construct_missing_candidates=True,
+                                     page_size=SEGMENTS_PAGE_SIZE,
+                                     start_after_segment=None,
+                                     defer_document_fields=()):
+        """Streaming version of candidates_for_relation.
+        Walks the matching segments in id order, page_size segments at a time,
+        and yields for each page a tuple (hydrated_evidences, last_segment_id).
+
+        Only one page is kept on memory. The last_segment_id works as a cursor:
+        passing it as start_after_segment resumes the walk after that page.
+        """
+        hydrate = cls.hydrate
+        lkind = relation.left_entity_kind
+        rkind = relation.right_entity_kind
+        segments = relation._matching_text_segments().order_by('id')
+        last_segment_id = start_after_segment
+        while True:
+            page = segments
+            if last_segment_id is not None:
+                page = page.filter(id__gt=last_segment_id)
+            page = list(page[:page_size])
+            if not page:
+                break
+            last_segment_id = page[-1].id
+
+            segments_per_document = OrderedDict()
+            for segment in page:
+                segments_per_document.setdefault(segment.document_id, []).append(segment)
+
+            existent_ec_per_segment = defaultdict(list)
+            for chunk in chunks([s.id for s in page], QUERY_PARAMS_CHUNK_SIZE):
+                existent_ec = EvidenceCandidate.objects.filter(
+                    left_entity_occurrence__entity__kind=lkind,
+                    right_entity_occurrence__entity__kind=rkind,
+                    segment__in=chunk
+                ).select_related('left_entity_occurrence', 'right_entity_occurrence')
+                for ec in existent_ec:
+                    existent_ec_per_segment[ec.segment_id].append(ec)
+
+            if construct_missing_candidates:
+                ecs_per_segment = cls.construct_missing_candidates(
+                    relation, page, existent_ec_per_segment)
+            else:
+                ecs_per_segment = existent_ec_per_segment
+
+            evidences = []
+            batches = cls.documents_in_batches(
+                segments_per_document.keys(), defer_fields=defer_document_fields)
+            for documents in batches:
+                for document in documents:
+                    for segment in segments_per_document[document.id]:
+                        for evidence in ecs_per_segment[segment.pk]:
+                            evidence.segment = segment
+                            evidences.append(hydrate(evidence, document))
+            yield evidences, last_segment_id
 
     @classmethod
     def value_labeled_candidates_count_for_relation(cls, relation):
@@ -246,33 +470,30 @@ class CandidateEvidenceManager(object):
         return labels.count()
 
     @classmethod
-    def labels_for(cls, relation, evidences, conflict_solver=None):
-        """Returns a dict with the form evidence->[True|False|None]"""
-        # Given a relation and a sequence of candidate-evidences, compute its
-        # labels
-        candidates = {e: None for e in evidences}
-
+    def labels_by_evidence_id(cls, relation, conflict_solver=None):
+        """Returns a dict with the form evidence_id->[True|False] with the
+        informative human labels of the given relation. Evidences without labels,
+        with unsolvable conflicts or labeled as nonsense are not included.
+        """
         logger.info("Getting labels from DB")
         labels = EvidenceLabel.objects.filter(
             relation=relation,
             label__in=[EvidenceLabel.NORELATION, EvidenceLabel.YESRELATION,
                        EvidenceLabel.NONSENSE],
             labeled_by_machine=False
+        ).order_by('evidence_candidate_id', '-modification_date', 'id').values_list(
+            *LabelInfo._fields
         )
-        logger.info("Sorting labels them by evidence")
-        labels_per_ev = defaultdict(list)
-        for l in labels:
-            labels_per_ev[l.evidence_candidate].append(l)
 
         logger.info("Labels conflict solving")
-        for e in candidates:
-            answers = labels_per_ev[e]
-            if not answers:
-                continue
-            if len(answers) == 1:
-                lbl = answers[0].label
-            elif len(set([a.label for a in answers])) == 1:
-                # several answers, all the same. Just pick the first one
+        result = {}
+        # Sorted by evidence, so all the answers for an evidence come together
+        # (and newest first)
+        rows = map(LabelInfo._make, labels.iterator())
+        for evidence_id, answers in groupby(rows, key=attrgetter('evidence_candidate_id')):
+            answers = list(answers)
+            if len(answers) == 1 or len(set(a.label for a in answers)) == 1:
+                # one answer, or several all the same. Just pick the first one
                 lbl = answers[0].label
             elif conflict_solver:
                 preferred = conflict_solver(answers)
@@ -283,29 +504,55 @@ class CandidateEvidenceManager(object):
             else:
                 continue
             # Ok, we have a choosen answer. Lets see if it's informative
-            if lbl == EvidenceLabel.NONSENSE:
-                # too bad, not informative
-                continue
-            elif lbl == EvidenceLabel.NORELATION:
-                candidates[e] = False
+            if lbl == EvidenceLabel.NORELATION:
+                result[evidence_id] = False
             elif lbl == EvidenceLabel.YESRELATION:
-                candidates[e] = True
-        return candidates
+                result[evidence_id] = True
+        return result
+
+    @classmethod
+    def labeled_evidences(cls, relation, labels, defer_document_fields=()):
+        """Returns a dict evidence->label for the evidences with the given
+        ids (a dict evidence_id->label, like the one of labels_by_evidence_id),
+        hydrated. Only those evidences (and their documents) are loaded."""
+        ecs_per_document = defaultdict(list)
+        for chunk in chunks(sorted(labels), QUERY_PARAMS_CHUNK_SIZE):
+            ecs = EvidenceCandidate.objects.filter(id__in=chunk).select_related(
+                'left_entity_occurrence', 'right_entity_occurrence', 'segment')
+            for ec in ecs:
+                ecs_per_document[ec.segment.document_id].append(ec)
+        result = {}
+        batches = cls.documents_in_batches(
+            ecs_per_document.keys(), defer_fields=defer_document_fields)
+        for documents in batches:
+            for document in documents:
+                for evidence in ecs_per_document[document.id]:
+                    result[cls.hydrate(evidence, document)] = labels[evidence.pk]
+        return result
+
+    @classmethod
+    def labels_for(cls, relation, evidences, conflict_solver=None):
+        """Returns a dict with the form evidence->[True|False|None]"""
+        # Given a relation and a sequence of candidate-evidences, compute its
+        # labels
+        labels = cls.labels_by_evidence_id(relation, conflict_solver)
+        return {e: labels.get(e.pk) for e in evidences}
 
     @classmethod
     def conflict_resolution_by_judge_name(cls, judges_order):
         # Only consider answers for the given judges, prefering those of the judge listed
         # first. Returns None if not found.
+        judges_rank = {judge: i for i, judge in reversed(list(enumerate(judges_order)))}
+
         def solver(ev_labels):
             # expects to be called only when len(ev_labels) > 1
-            ev_labels = [el for el in ev_labels if el.judge in judges_order]
+            ev_labels = [el for el in ev_labels if el.judge in judges_rank]
             if ev_labels:
-                ev_labels.sort(key=lambda el: judges_order.index(el.judge))
-                return ev_labels[0]
+                return min(ev_labels, key=lambda el: judges_rank[el.judge])
             return None
         return solver
 
     @classmethod
     def conflict_resolution_newest_wins(cls, ev_labels):
         # expects to be called only when len(ev_labels) > 1
-        return sorted(ev_labels[:], key=lambda el: el.modification_date, reverse=True)[0]
+        return max(ev_labels, key=lambda el: el.modification_date)
@@ -0,0 +1,62 @@
+"""
+MinHash signatures of document texts, for finding near-duplicates.
+
+The signature of a text keeps, for each of PERMUTATIONS hash functions, the
+minimum hash of its word shingles. The fraction of positions where two
+signatures agree estimates the Jaccard similarity of their shingle sets.
+To find candidates without comparing against every document, signatures are
+split in BANDS bands (locality sensitive hashing): texts sharing the hash of
+any band are likely to be similar, and are then compared.
+"""
+import hashlib
+import re
+import zlib
+
+import numpy
+
+PERMUTATIONS = 128
+BANDS = 16
+ROWS = PERMUTATIONS // BANDS
+# Words on each shingle
+SHINGLE_SIZE = 4
+# Estimated Jaccard similarity from which texts are near-duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_PRIME = (1 << 31) - 1  # hashes fit the compact 4 bytes int lists
+_random = numpy.random.RandomState(42)  # same permutations on every run
+_A = _random.randint(1, _PRIME, size=PERMUTATIONS).astype(numpy.int64)
+_B = _random.randint(0, _PRIME, size=PERMUTATIONS).astype(numpy.int64)
+_WORD_RE = re.compile(r"\w+")
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Set of the sequences of size consecutive words (lowercased) of the text"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def signature(text):
+    """MinHash signature of the text, as a list of PERMUTATIONS ints"""
+    hashes = numpy.array(
+        [zlib.crc32(s.encode("utf8")) % _PRIME for s in shingles(text)], dtype=numpy.int64)
+    # (a * x + b) mod p for every permutation (rows) and shingle (columns)
+    permuted = (numpy.outer(_A, hashes) + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).tolist()
+
+
+def band_hashes(signature):
+    """Returns a list of (band number, hash of the band) of the signature"""
+    result = []
+    for band in range(BANDS):
+        values = signature[band * ROWS:(band + 1) * ROWS]
+        digest = hashlib.sha1(" ".join(map(str, values)).encode("ascii")).digest()
+        result.append((band, int.from_bytes(digest[:8], "big", signed=True)))
+    return result
+
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the texts with the given signatures"""
+    equal = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return equal / PERMUTATIONS
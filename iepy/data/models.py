@@ -5,20 +5,47 @@ from datetime import datetime
 import itertools
 import logging
 from operator import attrgetter
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 
-from iepy.utils import unzip
-from corpus.fields import ListField, ListSyntacticTreeField
+from iepy.utils import unzip, chunks
+from corpus.fields import (
+    IntListField, StringListField, ListSyntacticTreeField, select_trees
+)
 import jsonfield
 
 CHAR_MAX_LENGHT = 256
+# Max amount of ids used on a single "__in" query (sqlite supports up to 999 params)
+QUERY_PARAMS_CHUNK_SIZE = 900
 
 logger = logging.getLogger(__name__)
 RichToken = namedtuple("RichToken", "token lemma pos eo_ids eo_kinds offset")
 
 
+def occurrences_by_token(eos, tokens_count, span=attrgetter('offset', 'offset_end')):
+    """Returns a list with, for each token offset in range(tokens_count), the list
+    of entity occurrences covering it (sorted by the start of the occurrence).
+    The span function must return the (start, end) token offsets of an occurrence.
+
+    Built with a single sweep over the occurrences sorted by start, instead of
+    checking every occurrence for every token.
+    """
+    eos = sorted(((span(eo), eo) for eo in eos), key=lambda x: x[0][0])
+    result = []
+    active = []  # occurrences covering the current token, as (end, eo)
+    i = 0
+    for tkn_offset in range(tokens_count):
+        while i < len(eos) and eos[i][0][0] <= tkn_offset:
+            (start, end), eo = eos[i]
+            active.append((end, eo))
+            i += 1
+        if active:
+            active = [(end, eo) for end, eo in active if end > tkn_offset]
+        result.append([eo for end, eo in active])
+    return result
+
+
 class BaseModel(models.Model):
     class Meta:
         abstract = True
@@ -59,6 +86,13 @@ class IEDocumentMetadata(BaseModel):
     title = models.CharField(max_length=CHAR_MAX_LENGHT, blank=True)
     url = models.URLField(blank=True)
     items = jsonfield.JSONField(blank=True)
+    # MinHash signature of the document text (see iepy.data.minhash), and the
+    # document it was found to be a near-duplicate of, if any
+    minhash = IntListField(blank=True, editable=False)
+    duplicate_of = models.ForeignKey(
+        'IEDocument', related_name='near_duplicates',
+        on_delete=models.SET_NULL, blank=True, null=True
+    )
 
     def __str__(self):
         try:
@@ -79,13 +113,13 @@ class IEDocument(BaseModel):
     creation_date = models.DateTimeField(auto_now_add=True)
 
     # The following 3 lists have 1 item per token
-    tokens = ListField(blank=True)  # strings
-    lemmas = ListField(blank=True)  # strings
-    postags = ListField(blank=True)  # strings
-    offsets_to_text = ListField(blank=True)  # ints, character offset for tokens, lemmas and postags
+    tokens = StringListField(blank=True)  # strings
+    lemmas = StringListField(blank=True)  # strings
+    postags = StringListField(blank=True)  # strings
+    offsets_to_text = IntListField(blank=True)  # ints, character offset for tokens, lemmas and postags
     syntactic_sentences = ListSyntacticTreeField(blank=True, editable=False)
 
-    sentences = ListField(blank=True)  # ints, it's a list of token-offsets
+    sentences = IntListField(blank=True)  # ints, it's a list of token-offsets
 
     # Reversed fields:
     # entity_occurrences = Reversed ForeignKey of EntityOccurrence
@@ -114,7 +148,8 @@ class IEDocument(BaseModel):
         postags = self.postags
         sentences = self.sentences
         start = 0
-        eos = list(self.get_entity_occurrences())
+        if enriched:
+            eos_by_token = occurrences_by_token(self.get_entity_occurrences(), len(tokens))
         tkn_offset = 0
         for i, end in enumerate(sentences[1:]):
             if enriched:
@@ -122,7 +157,7 @@ class IEDocument(BaseModel):
                 for i, (token, lemma, postag) in enumerate(zip(
                     tokens[start:end], lemmas[start:end], postags[start:end]
                 )):
-                    tkn_eos = [eo for eo in eos if eo.offset <= tkn_offset < eo.offset_end]
+                    tkn_eos = eos_by_token[tkn_offset]
                     rich_tokens.append(RichToken(
                         token=token,
                         lemma=lemma,
@@ -210,7 +245,13 @@ class IEDocument(BaseModel):
         self.syntactic_parsing_done_at = datetime.now()
         return self
 
-    def set_ner_result(self, value):
+    def set_ner_result(self, value, lookups=None):
+        """Stores the found entities as EntityOccurrences of the document,
+        skipping those clashing with an existent occurrence (same offsets, and
+        same kind or created by a gazette).
+        When storing NER results for several documents, pass the same
+        EntityLookupCache as lookups, so kinds and gazette items are fetched once.
+        """
         # Before even doing anything, basic offset validation
         def feo_has_issues(feo):
             return (feo.offset < 0 or feo.offset >= feo.offset_end
@@ -219,51 +260,51 @@ class IEDocument(BaseModel):
         if invalids:
             raise ValueError('Invalid FoundEvidences: {}'.format(invalids))
 
+        if lookups is None:
+            lookups = EntityLookupCache()
+
+        # For each (offset, offset_end), the (kind name, is from gazette) of the
+        # occurrences already there
         existents = defaultdict(list)
-        eo_clash_key = lambda x: (x.offset, x.offset_end)
-        for eo in self.entity_occurrences.all():
-            existents[eo_clash_key(eo)].append(eo)
+        for eo in self.entity_occurrences.all().select_related('entity__kind'):
+            existents[eo.offset, eo.offset_end].append(
+                (eo.entity.kind.name, eo.entity.gazette_id is not None))
 
-        # No issue, let's create them
+        entities = lookups.existent_entities(set(fe.key for fe in value))
+        gazette_keys = set(fe.key for fe in value if fe.from_gazette)
+        if gazette_keys:
+            lookups.prefetch_gazette_items(gazette_keys)
+
+        new_entities = OrderedDict()
+        new_occurrences = []  # as (entity, offset, offset_end, alias)
         for found_entity in value:
             key, kind_name, alias, offset, offset_end, from_gazette = found_entity
-            if (offset, offset_end) in existents.keys():
-                skip = False
-                for existent in existents[offset, offset_end]:
-                    is_from_gazette = existent.entity.gazette is not None
-                    is_same_kind = existent.entity.kind.name == kind_name
-
-                    if is_from_gazette or is_same_kind:
-                        skip = True
-                        break
-
-                if skip:
-                    continue
-
-            kind, _ = EntityKind.objects.get_or_create(name=kind_name)
-            if from_gazette:
-                gazette_item = GazetteItem.objects.get(text=key, kind=kind)
-                entity, created = Entity.objects.get_or_create(
-                    key=key, kind=kind,
-                    gazette=gazette_item
-                )
-            else:
-                entity, created = Entity.objects.get_or_create(key=key, kind=kind)
+            if any(is_from_gazette or existent_kind == kind_name
+                   for existent_kind, is_from_gazette in existents[offset, offset_end]):
+                continue
+
+            kind = lookups.get_kind(kind_name)
+            entity = entities.get((key, kind_name))
+            if entity is None:
+                gazette_item = lookups.get_gazette_item(key, kind) if from_gazette else None
+                entity = Entity(key=key, kind=kind, gazette=gazette_item)
+                entities[key, kind_name] = new_entities[key, kind_name] = entity
 
             if len(alias) > CHAR_MAX_LENGHT:
                 alias_ = alias[:CHAR_MAX_LENGHT]
                 print('Alias "%s" reduced to "%s"' % (alias, alias_))
                 alias = alias_
 
-            obj, created = EntityOccurrence.objects.get_or_create(
-                document=self,
-                entity=entity,
-                offset=offset,
-                offset_end=offset_end,
-                alias=alias
-            )
-            if created:
-                existents[eo_clash_key(obj)].append(obj)
+            new_occurrences.append((entity, offset, offset_end, alias))
+            existents[offset, offset_end].append((kind_name, entity.gazette_id is not None))
+
+        with transaction.atomic():
+            lookups.create_entities(list(new_entities.values()))
+            EntityOccurrence.objects.bulk_create([
+                EntityOccurrence(document=self, entity=entity, offset=offset,
+                                 offset_end=offset_end, alias=alias)
+                for entity, offset, offset_end, alias in new_occurrences
+            ])
 
         self.ner_done_at = datetime.now()
         return self
@@ -339,6 +380,19 @@ class EntityOccurrence(BaseModel):
         return self
 
 
+class MinHashBand(BaseModel):
+    """Hash of one band of the MinHash signature of a document, to find the
+    documents with similar texts (only documents that aren't near-duplicates
+    of another one are indexed)"""
+    document = models.ForeignKey('IEDocument', related_name='minhash_bands',
+                                 on_delete=models.CASCADE)
+    band = models.IntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta(BaseModel.Meta):
+        index_together = (('band', 'bucket'), )
+
+
 class TextSegment(BaseModel):
     document = models.ForeignKey('IEDocument', related_name='segments', db_index=True)
 
@@ -385,7 +439,12 @@ class TextSegment(BaseModel):
             self.text = ""
         self.sentences = [i - self.offset for i in doc.sentences
                           if i >= self.offset and i < self.offset_end]
-        self.syntactic_sentences = [doc.syntactic_sentences[s] for s in self.sentences]
+        if 'syntactic_sentences' in doc.get_deferred_fields():
+            # Document was loaded without its trees, on purpose
+            self.syntactic_sentences = None
+        else:
+            self.syntactic_sentences = select_trees(doc.syntactic_sentences,
+                                                    self.sentences)
         self._hydrated = True
         return self
 
@@ -398,6 +457,13 @@ class TextSegment(BaseModel):
             self._hydrated_eos = eos
         return eos
 
+    def get_entity_occurrences_by_token(self):
+        """Returns a list with the EntityOccurrences covering each token of the
+        segment"""
+        return occurrences_by_token(
+            self.get_entity_occurrences(), len(self.tokens),
+            span=attrgetter('segment_offset', 'segment_offset_end'))
+
     def get_evidences_for_relation(self, relation, existent=None):
         # Gets or creates Labeled Evidences (when creating, label is empty)
         lkind = relation.left_entity_kind
@@ -438,10 +504,9 @@ class TextSegment(BaseModel):
     def get_enriched_tokens(self):
         translation_dict = {'-LRB-': '(',
                             '-RRB-': ')'}
-        eos = list(self.get_entity_occurrences())
+        eos_by_token = self.get_entity_occurrences_by_token()
         for tkn_offset, (tkn, lemma, postag) in enumerate(zip(self.tokens, self.lemmas, self.postags)):
-            tkn_eos = [eo for eo in eos
-                       if eo.segment_offset <= tkn_offset < eo.segment_offset_end]
+            tkn_eos = eos_by_token[tkn_offset]
             yield RichToken(
                 token=translation_dict.get(tkn, tkn),
                 lemma=lemma,
@@ -723,3 +788,90 @@ class GazetteItem(BaseModel):
 
     def __str__(self):
         return "'{}' ({})".format(self.text, self.kind.name)
+
+
+class EntityLookupCache:
+    """Entity kinds, gazette items and entities needed when storing NER results.
+    Kinds and gazette items are kept for the whole run (they are not expected to
+    change while preprocessing), so each of them is queried only once.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forgets everything fetched or created. Needed when a transaction
+        where some of them were created is rolled back."""
+        self.kinds = {}
+        self.gazette_items = {}  # by text
+        self._fetched_gazette_texts = set()
+        self._respaced_gazette_items = {}  # by (text, kind id), None if not found
+
+    def get_kind(self, name):
+        kind = self.kinds.get(name)
+        if kind is None:
+            kind, _ = EntityKind.objects.get_or_create(name=name)
+            self.kinds[name] = kind
+        return kind
+
+    def prefetch_gazette_items(self, texts):
+        missing = list(set(texts) - self._fetched_gazette_texts)
+        for chunk in chunks(missing, QUERY_PARAMS_CHUNK_SIZE):
+            for item in GazetteItem.objects.filter(text__in=chunk):
+                self.gazette_items[item.text] = item
+        self._fetched_gazette_texts.update(missing)
+
+    def get_gazette_item(self, text, kind):
+        """Returns the GazetteItem of the kind with the given text (its tokens
+        joined by single spaces), or None if there's no such item"""
+        self.prefetch_gazette_items([text])
+        item = self.gazette_items.get(text)
+        if item is None or item.kind_id != kind.pk:
+            item = self._get_respaced_gazette_item(text, kind)
+        return item
+
+    def _get_respaced_gazette_item(self, text, kind):
+        # Gazettes are matched by the tokens of the items, so the item text may
+        # have other spacing than the one found
+        key = (text, kind.pk)
+        if key not in self._respaced_gazette_items:
+            query = GazetteItem.objects.filter(kind=kind, text__contains=text.split(" ")[0])
+            item = next((x for x in query if " ".join(x.text.split()) == text), None)
+            if item is None:
+                logger.warning("GazetteItem %r of kind %s does not exist, "
+                               "storing it as a plain entity", text, kind)
+            self._respaced_gazette_items[key] = item
+        return self._respaced_gazette_items[key]
+
+    def existent_entities(self, keys):
+        """Returns a dict (key, kind name) -> Entity with the existent entities
+        having any of the given keys"""
+        result = {}
+        for chunk in chunks(list(keys), QUERY_PARAMS_CHUNK_SIZE):
+            for entity in Entity.objects.filter(key__in=chunk).select_related('kind'):
+                result[entity.key, entity.kind.name] = entity
+        return result
+
+    def create_entities(self, entities):
+        """Inserts the given (unsaved) entities, setting their primary keys"""
+        if not entities:
+            return
+        try:
+            with transaction.atomic():
+                Entity.objects.bulk_create(entities)
+        except IntegrityError:
+            # Some of them were created meanwhile (by another process, probably).
+            for entity in entities:
+                existent, _ = Entity.objects.get_or_create(
+                    key=entity.key, kind=entity.kind,
+                    defaults={'gazette': entity.gazette})
+                entity.pk = existent.pk
+            return
+        # bulk_create does not set primary keys, so they need to be read back
+        created = {}
+        for chunk in chunks([e.key for e in entities], QUERY_PARAMS_CHUNK_SIZE):
+            query = Entity.objects.filter(key__in=chunk).values_list('key', 'kind_id', 'pk')
+            for key, kind_id, pk in query:
+                created[key, kind_id] = pk
+        for entity in entities:
+            entity.pk = created[entity.key, entity.kind_id]
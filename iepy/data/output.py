@@ -24,8 +24,13 @@ def dump_runner_output_to_csv(results, filepath):
             csv_writer.writerow([prediction_id, value])
 
 
-def dump_predictions_to_database(relation, predictions):
-    judge = "iepy-run on {}".format(datetime.now().strftime("%Y-%m-%d %H:%M"))
+def predictions_judge():
+    return "iepy-run on {}".format(datetime.now().strftime("%Y-%m-%d %H:%M"))
+
+
+def dump_predictions_to_database(relation, predictions, judge=None):
+    if judge is None:
+        judge = predictions_judge()
     for evidence, relation_is_present in predictions.items():
         label = EvidenceLabel.YESRELATION if relation_is_present else EvidenceLabel.NORELATION
         evidence.set_label(relation, label, judge, labeled_by_machine=True)
@@ -142,8 +142,9 @@ class ActiveLearningCore:
         """
         Using the internal trained classifier, all candidate evicence are automatically
         labeled.
-        Returns a dict {evidence: True/False}, where the boolean label indicates if
-        the relation is present on that evidence or not.
+        Returns a dict {evidence: True/False} for each of the candidates, where
+        the boolean label indicates if the relation is present on that evidence
+        or not.
         """
         if not self.classifier:
             logger.info("There is no trained classifier. Can't predict")
@@ -151,15 +152,18 @@ class ActiveLearningCore:
 
         # for every already labeled candidate, instead of asking the classifier we'll use
         # the actual label
-        knowns = copy(self.labeled_evidence)
+        knowns = self.labeled_evidence
+        candidates = list(candidates)
         to_predict = [c for c in candidates if c not in knowns]
-        if self.threshold is None:
+        if not to_predict:
+            labels = []
+        elif self.threshold is None:
             labels = self.classifier.predict(to_predict)
         else:
             scores = self.classifier.decision_function(to_predict)
             labels = scores >= self.threshold
         prediction = dict(zip(to_predict, map(bool, labels)))
-        prediction.update(knowns)
+        prediction.update((c, knowns[c]) for c in candidates if c in knowns)
         return prediction
 
     def estimate_threshold(self):
@@ -2,7 +2,7 @@
 IEPY database loader from csv file
 
 Usage:
-    csv_to_iepy.py <filename>
+    csv_to_iepy.py [--link-duplicates] <filename>
     csv_to_iepy.py -h | --help
 
 The <filename> argument can be a .csv file or a .csv.gz file containing the
@@ -11,6 +11,7 @@ corpus in two columns: 'freebase_mid' and 'description'.
 Options:
   -h --help             Show this screen
   --version             Version number
+  --link-duplicates     Link documents with nearly the same text than a previous one as its duplicates
 """
 
 import logging
@@ -25,4 +26,4 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format='%(message)s')
     opts = docopt(__doc__, version=iepy.__version__)
     filepath = opts["<filename>"]
-    csv_to_iepy(filepath)
+    csv_to_iepy(filepath, link_duplicates=opts["--link-duplicates"])
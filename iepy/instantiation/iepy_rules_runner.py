@@ -44,8 +44,9 @@ def run_from_command_line():
     # Load rules
     rules = load_rules()
 
-    # Load evidences
-    evidences = CandidateEvidenceManager.candidates_for_relation(relation)
+    # Load evidences. Rules don't use syntactic trees, so there's no need to load them
+    evidences = CandidateEvidenceManager.candidates_for_relation(
+        relation, defer_document_fields=['syntactic_sentences'])
 
     # Run the pipeline
     iextractor = RuleBasedCore(relation, rules)
@@ -15,6 +15,12 @@ Options:
   --tune-for=<tune-for>                    Predictions tuning. Options are high-prec
                                            or high-recall [default: high-prec]
   --extractor-config=<config.json>         Sets the extractor config
+  --checkpoint=<checkpoint_file>           Predicts and stores on the database page by
+                                           page, saving the progress on the given
+                                           file. If the file exists, the predictions
+                                           are resumed from there. Requires --db-store.
+                                           Questions are chosen among the candidates
+                                           of the first page having unlabeled ones
   --version                                Version number
   -h --help                                Show this screen
 """
@@ -109,17 +115,83 @@ def _construct_extractor(opts, relation, labeled_evidences, tuning_mode):
     return iextractor
 
 
+def _read_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as filehandler:
+        content = filehandler.read().strip()
+    try:
+        return int(content)
+    except ValueError:
+        print("Error: invalid checkpoint file {}".format(checkpoint_path))
+        exit(1)
+
+
+def _write_checkpoint(checkpoint_path, last_segment_id):
+    # Written aside and then renamed, so a crash never leaves a broken checkpoint
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as filehandler:
+        filehandler.write("{}\n".format(last_segment_id))
+    os.replace(tmp_path, checkpoint_path)
+
+
+def predict_with_checkpoints(iextractor, relation, checkpoint_path):
+    """Predicts and stores on the database the candidates of the relation, one
+    page of segments at a time. After each page, the cursor (last segment id)
+    is saved on checkpoint_path, so an interrupted run can be resumed.
+    Returns the number of predictions stored.
+    """
+    last_segment_id = _read_checkpoint(checkpoint_path)
+    if last_segment_id is not None:
+        print("Resuming predictions after segment {}".format(last_segment_id))
+    judge = output.predictions_judge()
+    pages = CandidateEvidenceManager.candidate_pages_for_relation(
+        relation, start_after_segment=last_segment_id)
+    stored = 0
+    for candidates, last_segment_id in pages:
+        predictions = iextractor.predict(candidates)
+        output.dump_predictions_to_database(relation, predictions, judge)
+        _write_checkpoint(checkpoint_path, last_segment_id)
+        stored += len(predictions)
+        print("Stored {} predictions (up to segment {})".format(stored, last_segment_id))
+    return stored
+
+
+def load_evidences_by_pages(relation):
+    """Same as load_labeled_evidences for all the candidates of the relation,
+    without loading all of them: the labeled evidences are fetched by id, and
+    the unlabeled ones (that questions are chosen from) are those of the first
+    page of candidates having some."""
+    CEM = CandidateEvidenceManager  # shorcut
+    labels = CEM.labels_by_evidence_id(relation, CEM.conflict_resolution_newest_wins)
+    evidences = CEM.labeled_evidences(relation, labels)
+    for candidates, _ in CEM.candidate_pages_for_relation(relation):
+        unlabeled = [c for c in candidates if c.pk not in labels]
+        if unlabeled:
+            evidences.update((c, None) for c in unlabeled)
+            break
+    return evidences
+
+
 def run_from_command_line():
     opts = docopt(__doc__, version=iepy.__version__)
 
     logging.basicConfig(level=logging.INFO, format='%(message)s')
     logging.getLogger("featureforge").setLevel(logging.WARN)
 
+    checkpoint_path = opts.get("--checkpoint")
+    if checkpoint_path and (not opts.get("--db-store") or opts.get("<output>")):
+        print("Error: --checkpoint can only be used with --db-store and no output file")
+        exit(1)
+
     tuning_mode = _get_tuning_mode(opts)
     relation = _get_relation(opts)
 
-    candidates = CandidateEvidenceManager.candidates_for_relation(relation)
-    labeled_evidences = load_labeled_evidences(relation, candidates)
+    if checkpoint_path:
+        labeled_evidences = load_evidences_by_pages(relation)
+    else:
+        candidates = CandidateEvidenceManager.candidates_for_relation(relation)
+        labeled_evidences = load_labeled_evidences(relation, candidates)
 
     if opts.get('--trained-extractor'):
         iextractor = _load_extractor(opts, relation, labeled_evidences)
@@ -133,6 +205,16 @@ def run_from_command_line():
     if not opts.get("--no-questions", False):
         questions_loop(iextractor, relation, was_ever_trained)
 
+    if checkpoint_path:
+        stored = predict_with_checkpoints(iextractor, relation, checkpoint_path)
+        if not stored and not os.path.exists(checkpoint_path):
+            print("Nothing was predicted")
+            exit(1)
+        classifier_output = opts.get("--store-extractor")
+        if classifier_output:
+            iextractor.save(classifier_output)
+        return
+
     # Candidates generator was consumed when generating labeled_evidences, so we'll
     # define it fresh again
     candidates = CandidateEvidenceManager.candidates_for_relation(relation)
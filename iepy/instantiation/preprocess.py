@@ -10,9 +10,15 @@ Usage:
 Options:
   -h --help                      Show this screen
   --multiple-cores=<num-cores>   Number of cores (use all to use every processor)
+  --chunk-size=<num-docs>        Documents handed together to each core [default: 20]
   --increment-ner                Re run NER and Gazetter for every document. If a document lacked any of the previous steps, will be preprocessed entirely.
+  --timings=<filepath>           Write as json the time spent on each step and document (single core only)
+  --commit-every=<num-docs>      Commit changes to the database once every that many documents (single core only)
+  --by-document                  Run all the steps on each document before going to the next one, saving it once (single core only)
+  --skip-duplicates              Don't preprocess documents linked as near-duplicates of another one
   --version                      Version number
 """
+from functools import partial
 import logging
 
 from docopt import docopt
@@ -21,6 +27,7 @@ import iepy
 import multiprocessing
 iepy.setup(__file__)
 from iepy.data.db import DocumentManager
+from iepy.preprocess.parallel import ParallelPreprocess
 from iepy.preprocess.stanford_preprocess import StanfordPreprocess
 from iepy.preprocess.pipeline import PreProcessPipeline, PreProcessSteps
 from iepy.preprocess.segmenter import SyntacticSegmenterRunner
@@ -34,12 +41,22 @@ class ParallelDocManager(DocumentManager):
         clause = 'id %%%% %s = %s' % (K, N)
         return qset.extra(where=[clause])
 
-def start_preprocess(docs, increment_ner):
-    pipeline = PreProcessPipeline([
+def make_runners(increment_ner):
+    return [
         StanfordPreprocess(increment_ner),
         SyntacticSegmenterRunner(increment=True)
-    ], docs)
-    pipeline.process_everything()
+    ]
+
+
+def start_preprocess(docs, increment_ner, timings_filepath=None, commit_every=None,
+                     by_document=False):
+    pipeline = PreProcessPipeline(make_runners(increment_ner), docs,
+                                  commit_every=commit_every)
+    if by_document:
+        pipeline.walk_everything(timings_filepath)
+    else:
+        pipeline.process_everything(timings_filepath)
+
 
 if __name__ == '__main__':
     logger = logging.getLogger(u'preprocess')
@@ -50,9 +67,17 @@ if __name__ == '__main__':
 
     dm = ParallelDocManager()
     all_docs = dm.get_documents_lacking_preprocess(
-        [PreProcessSteps.segmentation, PreProcessSteps.syntactic_parsing])
+        [PreProcessSteps.segmentation, PreProcessSteps.syntactic_parsing],
+        skip_duplicates=opts['--skip-duplicates'])
 
     multiple_cores = opts.get('--multiple-cores')
+    commit_every = opts.get('--commit-every')
+    if commit_every:
+        try:
+            commit_every = int(commit_every)
+        except ValueError:
+            logger.error("Invalid number of documents to commit")
+            exit(1)
     split_in = opts.get("--split-in")
     run_part = opts.get("--run-part")
 
@@ -61,15 +86,17 @@ if __name__ == '__main__':
             multiple_cores = multiprocessing.cpu_count()
         try:
             multiple_cores = int(multiple_cores)
+            chunk_size = int(opts['--chunk-size'])
         except ValueError:
-            logger.error("Invalid number of cores")
+            logger.error("Invalid number of cores or chunk size")
             exit(1)
 
-        for i in range(multiple_cores):
-            process = multiprocessing.Process(
-                target=start_preprocess, args=(dm.mines_of(all_docs, multiple_cores, i), increment_ner)
-            )
-            process.start()
+        parallel = ParallelPreprocess(partial(make_runners, increment_ner),
+                                      workers=multiple_cores, chunk_size=chunk_size)
+        failed = parallel.run(all_docs.values_list('id', flat=True))
+        if failed:
+            logger.error("Preprocess failed for documents with ids %s", failed)
+            exit(1)
     elif split_in:
         try:
             split_in = int(split_in)
@@ -83,6 +110,8 @@ if __name__ == '__main__':
             exit(1)
 
         docs = dm.mines_of(all_docs, split_in, run_part)
-        start_preprocess(docs, increment_ner)
+        start_preprocess(docs, increment_ner, opts['--timings'], commit_every,
+                         opts['--by-document'])
     else:
-        start_preprocess(all_docs, increment_ner)
+        start_preprocess(all_docs, increment_ner, opts['--timings'], commit_every,
+                         opts['--by-document'])
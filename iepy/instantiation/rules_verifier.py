@@ -70,7 +70,8 @@ def run_from_command_line():
     if EvidenceCandidate.objects.all().count() == 0:
         create_evidences = True
     evidences = CandidateEvidenceManager.candidates_for_relation(
-        relation, create_evidences, seg_limit=limit, shuffle_segs=shuffle
+        relation, create_evidences, seg_limit=limit, shuffle_segs=shuffle,
+        defer_document_fields=['syntactic_sentences']
     )
     conflict_solver = CandidateEvidenceManager.conflict_resolution_newest_wins
     answers = CandidateEvidenceManager.labels_for(
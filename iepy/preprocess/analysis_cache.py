@@ -0,0 +1,148 @@
+"""
+On-disk cache of CoreNLP analyses.
+
+Analyses are stored compressed on a sqlite database, keyed by a hash of the
+analysed text and of everything else that changes the result (the CoreNLP
+command line: version, annotators, models, options). So documents with the
+same text, or preprocessed again, don't need to go through CoreNLP. Gazettes
+are left out of the cached analyses, and tagged on top of them (see
+iepy.preprocess.corenlp_gazettes).
+When the cache grows over its maximum size, the analyses used least recently
+are removed.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+
+from iepy.utils import batches
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisCache:
+    """Compressed analyses on a sqlite file, up to max_size bytes"""
+
+    # When full, analyses are removed until this fraction of max_size is used
+    EVICT_TO = 0.9
+
+    def __init__(self, filepath, max_size):
+        self.filepath = filepath
+        self.max_size = max_size
+        self._connection = None
+        self._pid = None
+        self._size = None
+
+    @property
+    def connection(self):
+        # Connections can't be shared with forked processes, each one opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.filepath, timeout=60)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                " key TEXT PRIMARY KEY, data BLOB, size INTEGER, used REAL)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS analysis_used ON analysis (used)")
+            self._pid = os.getpid()
+            self._size = None
+        return self._connection
+
+    @staticmethod
+    def key(text, fingerprint):
+        return hashlib.sha1(
+            "{}\n{}".format(fingerprint, text).encode("utf8")).hexdigest()
+
+    def get(self, key):
+        """Returns the analysis stored with key, or None"""
+        with self.connection as connection:
+            row = connection.execute(
+                "SELECT data FROM analysis WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE analysis SET used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key, analysis):
+        data = zlib.compress(pickle.dumps(analysis, pickle.HIGHEST_PROTOCOL))
+        size = self.size()
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO analysis (key, data, size, used) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()))
+        self._size = size + len(data)
+        if self._size > self.max_size:
+            self.evict()
+
+    def size(self):
+        """Bytes used by the stored analyses (as last counted by this process)"""
+        if self._size is None:
+            self._size = self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM analysis").fetchone()[0]
+        return self._size
+
+    def evict(self):
+        """Removes the least recently used analyses, until the cache is
+        under its maximum size"""
+        with self.connection as connection:
+            size = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM analysis").fetchone()[0]
+            target = self.max_size * self.EVICT_TO
+            removed = []
+            for key, item_size in connection.execute(
+                    "SELECT key, size FROM analysis ORDER BY used"):
+                if size <= target:
+                    break
+                removed.append((key,))
+                size -= item_size
+            connection.executemany("DELETE FROM analysis WHERE key = ?", removed)
+        logger.info("Removed %s analyses from the CoreNLP cache", len(removed))
+        self._size = size
+
+
+class CachedAnalyser:
+    """Wraps a CoreNLP analyser (or a pool of them), answering from the cache
+    the texts it analysed before with the same fingerprint."""
+
+    # Items looked up on the cache together on analyse_many
+    CHUNK_SIZE = 100
+
+    def __init__(self, analyser, cache, fingerprint):
+        self.analyser = analyser
+        self.cache = cache
+        self.fingerprint = fingerprint
+
+    def analyse(self, text):
+        key = self.cache.key(text, self.fingerprint)
+        analysis = self.cache.get(key)
+        if analysis is None:
+            analysis = self.analyser.analyse(text)
+            self.cache.put(key, analysis)
+        return analysis
+
+    def analyse_many(self, items, text_of=str):
+        """Yields (item, analysis) for each of the items, in the same order.
+        Only the ones not found on the cache are sent to the analyser, and
+        repeated texts of a chunk only once."""
+        for chunk in batches(items, self.CHUNK_SIZE):
+            keys = [self.cache.key(text_of(item), self.fingerprint) for item in chunk]
+            found = {}
+            missing = []
+            for item, key in zip(chunk, keys):
+                if key in found:
+                    continue
+                found[key] = self.cache.get(key)
+                if found[key] is None:
+                    missing.append((item, key))
+            analysed = iter(self.analyser.analyse_many(missing, lambda pair: text_of(pair[0])))
+            for item, key in zip(chunk, keys):
+                if found[key] is None:
+                    _, found[key] = next(analysed)
+                    self.cache.put(key, found[key])
+                yield item, found[key]
+
+    def quit(self):
+        self.analyser.quit()
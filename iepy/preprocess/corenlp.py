@@ -1,12 +1,20 @@
 import subprocess
-import xmltodict
 import os
 import sys
 import logging
 import stat
+import threading
 from functools import lru_cache
 
 import iepy
+from iepy.preprocess.corenlp_output import (
+    iter_segments, parse_json_output, parse_xml_output
+)
+from iepy.preprocess.analysis_cache import AnalysisCache, CachedAnalyser
+from iepy.preprocess.corenlp_gazettes import GazettedAnalyser
+from iepy.preprocess.corenlp_pool import AnalyserPool, analyse_many
+from iepy.preprocess.corenlp_split import SplittingAnalyser
+from iepy.preprocess.timing import ANALYSER, PARSING, timed
 from iepy.utils import DIRS, unzip_from_url
 
 
@@ -50,22 +58,128 @@ _FOLDER_PATH = os.path.join(DIRS.user_data_dir, _CORENLP_VERSION)
 COMMAND_PATH = os.path.join(_FOLDER_PATH, "corenlp.sh")
 
 
-@lru_cache(maxsize=1)
+@lru_cache(maxsize=None)
 def get_analizer(*args, **kwargs):
-    logger.info("Loading StanfordCoreNLP...")
-    return StanfordCoreNLP(*args, **kwargs)
+    """Returns the CoreNLP analyser start_analizer gives for the arguments, a
+    single one for each combination of them (kept running until the end)."""
+    return start_analizer(*args, **kwargs)
+
+
+def start_analizer(*args, workers=None, batch_size=None, **kwargs):
+    """Starts a new CoreNLP analyser, which the caller has to quit once it's
+    not needed (see get_analizer for sharing them). If more than one worker is requested
+    (by argument, or with the CORENLP_WORKERS instance setting), it's a pool
+    of that many CoreNLP processes.
+    When analysing many documents, they are sent in batches of batch_size (by
+    argument, or with the CORENLP_BATCH_SIZE instance setting).
+    The CoreNLP output format ("xml" or "json") can be chosen with the
+    CORENLP_OUTPUT_FORMAT instance setting, and the annotators to run (if not
+    given) with CORENLP_ANNOTATORS.
+    If the CORENLP_CACHE_SIZE instance setting is given (in megabytes), analyses
+    are kept on an on-disk cache of that size, and texts found there are not
+    sent to CoreNLP. Then, gazettes are tagged on top of the analyses instead of
+    by CoreNLP, so they can change without emptying the cache.
+    Texts longer than the CORENLP_MAX_TEXT_SIZE instance setting (in characters)
+    are analysed in pieces, merged back into a single analysis.
+    """
+    settings = iepy.instance.settings
+    if workers is None:
+        workers = getattr(settings, 'CORENLP_WORKERS', 1)
+    if batch_size is None:
+        batch_size = getattr(settings, 'CORENLP_BATCH_SIZE', 1)
+    kwargs.setdefault('output_format', getattr(settings, 'CORENLP_OUTPUT_FORMAT', 'xml'))
+    if kwargs.get('annotators') is None:
+        kwargs['annotators'] = configured_annotators()
+    cache = analysis_cache()
+    gazettes_filepath = None
+    if cache is not None and "ner" in kwargs['annotators']:
+        # Kept out of the cached analyses (and of their fingerprint)
+        gazettes_filepath = kwargs.pop('gazettes_filepath', None)
+    if workers <= 1:
+        logger.info("Loading StanfordCoreNLP...")
+        analyser = first = StanfordCoreNLP(*args, batch_size=batch_size, **kwargs)
+    else:
+        logger.info("Loading %s StanfordCoreNLP processes...", workers)
+        analyser = AnalyserPool((StanfordCoreNLP(*args, **kwargs) for _ in range(workers)),
+                                batch_size=batch_size)
+        first = analyser.analysers[0]
+    if cache is not None:
+        analyser = CachedAnalyser(analyser, cache, first.fingerprint())
+    if gazettes_filepath:
+        analyser = GazettedAnalyser(analyser, gazettes_filepath)
+    max_text_size = getattr(settings, 'CORENLP_MAX_TEXT_SIZE', None)
+    if max_text_size:
+        analyser = SplittingAnalyser(analyser, max_text_size)
+    return analyser
+
+
+@lru_cache(maxsize=None)
+def analysis_cache():
+    """Returns the cache of CoreNLP analyses, if the CORENLP_CACHE_SIZE instance
+    setting enables it (the CORENLP_CACHE_FILEPATH setting can choose where)"""
+    settings = iepy.instance.settings
+    size = getattr(settings, 'CORENLP_CACHE_SIZE', None)
+    if not size:
+        return None
+    filepath = getattr(settings, 'CORENLP_CACHE_FILEPATH',
+                       os.path.join(DIRS.user_data_dir, 'corenlp_cache.sqlite3'))
+    return AnalysisCache(filepath, size * 1024 * 1024)
+
+
+def configured_annotators():
+    """Returns the CoreNLP annotators chosen with the CORENLP_ANNOTATORS instance
+    setting (all of them, if not set)"""
+    annotators = getattr(iepy.instance.settings, 'CORENLP_ANNOTATORS', None)
+    if annotators is None:
+        return StanfordCoreNLP.ANNOTATORS
+    return StanfordCoreNLP.check_annotators(annotators)
 
 
 class StanfordCoreNLP:
-    CMD_ARGS = "-outputFormat xml -threads 4"
+    CMD_ARGS = "-threads 4"
+    # All the annotators, in the order they have to be run
+    ANNOTATORS = ("tokenize", "ssplit", "pos", "lemma", "ner", "parse", "dcoref")
+    # Annotators that each of them needs to be run before
+    REQUIREMENTS = {
+        "tokenize": (),
+        "ssplit": ("tokenize",),
+        "pos": ("tokenize", "ssplit"),
+        "lemma": ("tokenize", "ssplit", "pos"),
+        "ner": ("tokenize", "ssplit", "pos", "lemma"),
+        "parse": ("tokenize", "ssplit", "pos"),  # the shift-reduce parser needs pos
+        "dcoref": ("tokenize", "ssplit", "pos", "lemma", "ner", "parse"),
+    }
     PROMPT = b"\nNLP> "
-
-    def __init__(self, tokenize_with_whitespace=False, gazettes_filepath=None):
+    READ_SIZE = 64 * 1024
+    OUTPUT_PARSERS = {
+        "xml": parse_xml_output,
+        "json": parse_json_output,  # available since CoreNLP 3.5 (needs Java 8)
+    }
+
+    def __init__(self, tokenize_with_whitespace=False, gazettes_filepath=None,
+                 batch_size=1, output_format="xml", annotators=None):
+        if output_format not in self.OUTPUT_PARSERS:
+            raise ValueError("Invalid CoreNLP output format {!r}".format(output_format))
+        if output_format == "json" and JAVA_VERSION < 8:
+            raise ValueError("CoreNLP json output is not available for Java < 8")
+        self.batch_size = batch_size
+        self.output_format = output_format
+        self.parse_output = self.OUTPUT_PARSERS[output_format]
+        if annotators is None:
+            annotators = self.ANNOTATORS
+        self.annotators = self.check_annotators(annotators)
         cmd_args = self.command_args(tokenize_with_whitespace, gazettes_filepath)
         os.chdir(_FOLDER_PATH)
         self.corenlp_cmd = [COMMAND_PATH] + cmd_args
         self._start_proc()
 
+    def fingerprint(self):
+        """Identifies the analyses this process gives, for caching them: the
+        CoreNLP version and the command line (annotators, gazettes, models,
+        options). get_analizer leaves gazettes out when caching."""
+        return "{} {} {}".format(
+            _CORENLP_VERSION, self.output_format, " ".join(self.corenlp_cmd))
+
     def _start_proc(self):
         self.proc = subprocess.Popen(
             self.corenlp_cmd,
@@ -77,13 +191,28 @@ class StanfordCoreNLP:
         self.output = self.iter_output_segments()
         self.receive()  # Wait until the prompt is ready
 
+    @classmethod
+    def check_annotators(cls, annotators):
+        """Returns the given annotators in the order they have to be run.
+        Raises ValueError if any of them is unknown, or needs some other that's
+        not there."""
+        unknown = set(annotators) - set(cls.ANNOTATORS)
+        if unknown:
+            raise ValueError("Unknown CoreNLP annotators {}".format(sorted(unknown)))
+        for annotator in annotators:
+            missing = set(cls.REQUIREMENTS[annotator]) - set(annotators)
+            if missing:
+                raise ValueError("CoreNLP annotator {} needs {}".format(
+                    annotator, ",".join(a for a in cls.ANNOTATORS if a in missing)))
+        return tuple(a for a in cls.ANNOTATORS if a in annotators)
+
     def command_args(self, tokenize_with_whitespace, gazettes_filepath):
-        annotators = ["tokenize", "ssplit", "pos", "lemma", "ner", "parse", "dcoref"]
-        cmd_args = self.CMD_ARGS[:]
+        annotators = list(self.annotators)
+        cmd_args = "-outputFormat {} ".format(self.output_format) + self.CMD_ARGS
         if tokenize_with_whitespace:
             cmd_args += " -tokenize.whitespace=true"
 
-        if gazettes_filepath:
+        if gazettes_filepath and "ner" in annotators:
             annotators.insert(annotators.index("ner") + 1, "regexner")
             cmd_args += " -regexner.mapping {}".format(gazettes_filepath)
 
@@ -91,21 +220,30 @@ class StanfordCoreNLP:
         if tkn_opts:
             cmd_args += " " + tkn_opts
 
-        lang = iepy.instance.settings.IEPY_LANG
+        settings = iepy.instance.settings
+        lang = settings.IEPY_LANG
         edu_mods = "edu/stanford/nlp/models"
+        if lang in ('es', 'de') and 'dcoref' in annotators:
+            # not supported for spanish nor german on Stanford 3.4.1
+            annotators.remove('dcoref')
         if lang == 'es':
-            annotators.remove('dcoref')  # not supported for spanish on Stanford 3.4.1
             cmd_args += " -tokenize.language es"
             cmd_args += " -pos.model %s/pos-tagger/spanish/spanish-distsim.tagger" % edu_mods
             cmd_args += " -ner.model %s/ner/spanish.ancora.distsim.s512.crf.ser.gz" % edu_mods
             cmd_args += " -parse.model %s/lexparser/spanishPCFG.ser.gz" % edu_mods
         if lang == 'de':
-            annotators.remove('dcoref')  # not supported for german on Stanford 3.4.1
             cmd_args += " -tokenize.language de"
             cmd_args += " -pos.model %s/pos-tagger/german/german-dewac.tagger" % edu_mods
             cmd_args += " -ner.model %s/ner/german.dewac_175m_600.crf.ser.gz" % edu_mods
             cmd_args += " -parse.model %s/lexparser/germanPCFG.ser.gz" % edu_mods
 
+        # For instance, the faster shift-reduce parser:
+        # edu/stanford/nlp/models/srparser/englishSR.ser.gz
+        parse_model = getattr(settings, 'CORENLP_PARSE_MODEL', None)
+        if parse_model and "parse" in annotators:
+            # Overrides the one of the language, if any
+            cmd_args += " -parse.model {}".format(parse_model)
+
         cmd_args += " -annotators {}".format(",".join(annotators))
         return cmd_args.split()
 
@@ -153,18 +291,15 @@ class StanfordCoreNLP:
             return '-tokenize.options "{}"'.format(','.join(opts))
 
     def iter_output_segments(self):
-        while True:
-            buf = b""
-            while self.PROMPT not in buf:
-                buf += self.proc.stdout.read1(1024)
-
-                if self.proc.poll() == 1:
-                    logger.error("Error running '{}'".format(" ".join(self.corenlp_cmd)))
-                    logger.error("Output was: '{}'".format(buf))
-                    sys.exit(1)
+        return iter_segments(self._read_output, self.PROMPT)
 
-            segment, _, buf = buf.partition(self.PROMPT)
-            yield segment.decode("utf8")
+    def _read_output(self):
+        data = self.proc.stdout.read1(self.READ_SIZE)
+        if self.proc.poll() == 1 or (not data and self.proc.poll() is not None):
+            logger.error("Error running '{}'".format(" ".join(self.corenlp_cmd)))
+            logger.error("Last output was: '{}'".format(data))
+            sys.exit(1)
+        return data
 
     def receive(self):
         return next(self.output)
@@ -180,11 +315,39 @@ class StanfordCoreNLP:
 
     @lru_cache(maxsize=1)
     def analyse(self, text):
-        self.send(text)
-        text = self.receive()
-        i = text.index("<?xml version")
-        text = text[i:]
-        return xmltodict.parse(text)["root"]["document"]
+        with timed(ANALYSER):
+            self.send(text)
+            output = self.receive()
+        with timed(PARSING):
+            return self.parse_output(output)
+
+    def analyse_batch(self, texts):
+        """Analyses several texts in a single round trip: all of them are sent
+        without waiting for each answer, and the answers (one per prompt, in the
+        same order) are read meanwhile.
+        """
+        # Written from another thread, otherwise both processes could get blocked
+        # writing to full pipes.
+        writer = threading.Thread(target=self._send_all, args=(texts,))
+        writer.start()
+        try:
+            return [self._receive_analysis() for _ in texts]
+        finally:
+            writer.join()
+
+    def _receive_analysis(self):
+        with timed(ANALYSER):
+            output = self.receive()
+        with timed(PARSING):
+            return self.parse_output(output)
+
+    def _send_all(self, texts):
+        for text in texts:
+            self.send(text)
+
+    def analyse_many(self, items, text_of=str):
+        """Yields (item, analysis) for each of the items, in batches of batch_size"""
+        return analyse_many(self, items, text_of, self.batch_size)
 
 
 def download(lang='en'):
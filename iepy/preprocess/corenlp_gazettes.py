@@ -0,0 +1,77 @@
+"""
+Gazettes tagged on top of CoreNLP analyses.
+
+When analyses are cached, CoreNLP runs without its regexner annotator, and the
+gazette items are tagged afterwards on each analysis (cached or not), the same
+way regexner does: the longest name matching the tokens of a sentence gets
+the kind of its gazette. So the cached analyses don't depend on the gazettes,
+and changing them doesn't need every text to be analysed again.
+
+Coreferences are resolved by CoreNLP before the gazettes are tagged, so the
+gazette items are not taken into account for them.
+"""
+import codecs
+import logging
+import re
+from functools import lru_cache
+
+from iepy.preprocess.corenlp_output import add_entity_occurrences
+from iepy.preprocess.corenlp_split import as_flat_data
+from iepy.preprocess.ner.literal import TokenTrie
+
+logger = logging.getLogger(__name__)
+
+# Tokens of a name, as escaped by GazetteManager.escape_text
+ESCAPED_TOKEN = re.compile(r"\\Q(.*?)\\E")
+
+
+@lru_cache(maxsize=1)
+def read_regexner_mapping(filepath):
+    """Returns a TokenTrie with the names of a CoreNLP regexner mapping file
+    (as written by GazetteManager), labeled with their kinds"""
+    trie = TokenTrie()
+    with codecs.open(filepath, encoding="utf8") as mapping:
+        for line in mapping:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 2:
+                continue
+            tokens = ESCAPED_TOKEN.findall(fields[0]) or fields[0].split()
+            trie.add(tokens, fields[1])
+    logger.info("Loaded %s gazette items from %s", len(trie), filepath)
+    return trie
+
+
+def tag_gazettes(result, trie):
+    """Returns the FlatAnalysisData of a CoreNLP analyser result, with the
+    names of the trie tagged with their labels as NER"""
+    data = as_flat_data(result)
+    boundaries = data.sentence_boundaries
+    data.entity_occurrences = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        for (i, j), kind in trie.matches(data.tokens[start:end]):
+            data.ner[start + i:start + j] = [kind] * (j - i)
+        add_entity_occurrences(data, start, end)
+    return data
+
+
+class GazettedAnalyser:
+    """Wraps a CoreNLP analyser (or a pool, or a cache of them) running
+    without regexner, tagging the gazettes of gazettes_filepath on its
+    analyses."""
+
+    def __init__(self, analyser, gazettes_filepath):
+        self.analyser = analyser
+        self.gazettes_filepath = gazettes_filepath
+        # Read when starting, like CoreNLP does, so the file can be removed later
+        self.trie = read_regexner_mapping(gazettes_filepath)
+
+    def analyse(self, text):
+        return tag_gazettes(self.analyser.analyse(text), self.trie)
+
+    def analyse_many(self, items, text_of=str):
+        """Yields (item, analysis) for each of the items, in the same order"""
+        for item, result in self.analyser.analyse_many(items, text_of):
+            yield item, tag_gazettes(result, self.trie)
+
+    def quit(self):
+        self.analyser.quit()
@@ -0,0 +1,157 @@
+"""
+Reading and parsing the output of Stanford CoreNLP.
+
+The XML output is parsed into nested dicts (walked later by StanfordAnalysis),
+while the JSON output is read in a single pass into flat per-token lists (see
+FlatAnalysisData), which is several times faster for big documents.
+"""
+from itertools import groupby
+import json
+
+import xmltodict
+
+
+def iter_segments(read, separator):
+    """Yields the pieces of a stream that end with separator (separator not
+    included), decoded as utf8. read() must return the next chunk of the stream,
+    or an empty one when it's over.
+
+    Each search for the separator starts where the previous one stopped (and
+    what's left after a separator is kept for the next piece), so the time spent
+    is linear on the size of the stream.
+    """
+    buf = bytearray()
+    search_from = 0
+    while True:
+        i = buf.find(separator, search_from)
+        if i == -1:
+            # The separator may start on the last bytes, and end on the next chunk
+            search_from = max(0, len(buf) - len(separator) + 1)
+            chunk = read()
+            if not chunk:
+                return
+            buf += chunk
+            continue
+        segment = buf[:i].decode("utf8")
+        del buf[:i + len(separator)]
+        search_from = 0
+        yield segment
+
+
+def parse_xml_output(text):
+    i = text.index("<?xml version")
+    text = text[i:]
+    return xmltodict.parse(text)["root"]["document"]
+
+
+class FlatAnalysisData:
+    """CoreNLP analysis of a document, as flat lists.
+    All offsets are in tokens, relative to the start of the document, except
+    token_offsets, which are in characters.
+
+      - tokens, lemmas, postags, ner, token_offsets: one item per token.
+      - sentence_boundaries: offsets where each sentence starts, plus the total
+        number of tokens.
+      - parse_trees: one per sentence.
+      - entity_occurrences: (start, end, kind) for each group of consecutive
+        tokens of a sentence with the same NER tag (other than "O").
+      - coreferences: for each coreference chain, the list of its mentions as
+        (start, end, head).
+    """
+
+    def __init__(self):
+        self.tokens = []
+        self.lemmas = []
+        self.postags = []
+        self.ner = []
+        self.token_offsets = []
+        self.sentence_boundaries = [0]
+        self.parse_trees = []
+        self.entity_occurrences = []
+        self.coreferences = []
+
+
+def parse_json_output(text):
+    i = text.index("{")
+    data = json.loads(text[i:])
+    result = FlatAnalysisData()
+    tokens = result.tokens
+    lemmas = result.lemmas
+    postags = result.postags
+    ner = result.ner
+    token_offsets = result.token_offsets
+    for sentence in data.get("sentences", []):
+        start = len(tokens)
+        for token in sentence["tokens"]:
+            tokens.append(token["word"])
+            lemmas.append(token.get("lemma"))
+            postags.append(token.get("pos"))
+            ner.append(token.get("ner", "O"))
+            token_offsets.append(token["characterOffsetBegin"])
+        result.sentence_boundaries.append(len(tokens))
+        if "parse" in sentence:
+            result.parse_trees.append(sentence["parse"])
+        add_entity_occurrences(result, start)
+
+    boundaries = result.sentence_boundaries
+    for mentions in data.get("corefs", {}).values():
+        chain = []
+        for mention in mentions:
+            # CoreNLP numbers sentences and tokens (within the sentence) from 1
+            offset = boundaries[mention["sentNum"] - 1] - 1
+            chain.append((mention["startIndex"] + offset,
+                          mention["endIndex"] + offset,
+                          mention["headIndex"] + offset))
+        result.coreferences.append(chain)
+    return result
+
+
+def add_entity_occurrences(result, start, end=None):
+    """Adds the entity occurrences of the sentence going from token start to
+    end (the last one, if not given), grouping its NER tags"""
+    offset = start
+    for kind, group in groupby(result.ner[start:end]):
+        size = len(list(group))
+        if kind != "O":
+            result.entity_occurrences.append((offset, offset + size, kind))
+        offset += size
+
+
+def _as_list(x):
+    # xmltodict gives a single child element as is, instead of on a list
+    if x is None:
+        return []
+    if not isinstance(x, list):
+        return [x]
+    return x
+
+
+def flatten_xml_output(document):
+    """Returns the FlatAnalysisData of the document parsed by parse_xml_output"""
+    result = FlatAnalysisData()
+    sentences = (document.get("sentences") or {}).get("sentence")
+    for sentence in _as_list(sentences):
+        start = len(result.tokens)
+        for token in _as_list((sentence.get("tokens") or {}).get("token")):
+            result.tokens.append(token["word"])
+            result.lemmas.append(token.get("lemma"))
+            result.postags.append(token.get("POS"))
+            result.ner.append(token.get("NER", "O"))
+            result.token_offsets.append(int(token["CharacterOffsetBegin"]))
+        result.sentence_boundaries.append(len(result.tokens))
+        if "parse" in sentence:
+            result.parse_trees.append(sentence["parse"])
+        add_entity_occurrences(result, start)
+
+    boundaries = result.sentence_boundaries
+    chains = (document.get("coreference") or {}).get("coreference")
+    for chain_data in _as_list(chains):
+        chain = []
+        for mention in _as_list(chain_data.get("mention")):
+            # CoreNLP numbers sentences and tokens (within the sentence) from 1
+            offset = boundaries[int(mention["sentence"]) - 1] - 1
+            chain.append((int(mention["start"]) + offset,
+                          int(mention["end"]) + offset,
+                          int(mention["head"]) + offset))
+        result.coreferences.append(chain)
+    return result
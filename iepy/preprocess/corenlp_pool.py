@@ -0,0 +1,153 @@
+"""
+Running several CoreNLP analysers at the same time.
+
+Nothing in here depends on Java, so the pool can be used (and benchmarked) with
+the StubAnalyser instead of real CoreNLP processes.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+import logging
+import re
+import time
+
+from iepy.utils import batches
+
+logger = logging.getLogger(__name__)
+
+
+def analyse_batch(analyser, texts):
+    """Returns the list of analysis of the texts, using the batch API of the
+    analyser if it has one"""
+    if hasattr(analyser, 'analyse_batch'):
+        return analyser.analyse_batch(texts)
+    return [analyser.analyse(text) for text in texts]
+
+
+def analyse_many(analyser, items, text_of=str, batch_size=1):
+    """Sequential version of AnalyserPool.analyse_many, for a single analyser"""
+    for batch in batches(items, batch_size):
+        results = analyse_batch(analyser, [text_of(item) for item in batch])
+        yield from zip(batch, results)
+
+
+class AnalyserPool:
+    """Group of analysers (objects with an analyse(text) method, like
+    StanfordCoreNLP) used as a single one: each text is sent to whichever
+    analyser is free.
+    """
+
+    def __init__(self, analysers, batch_size=1):
+        self.analysers = list(analysers)
+        self.batch_size = batch_size
+        if not self.analysers:
+            raise ValueError("AnalyserPool needs at least one analyser")
+        self._free = Queue()
+        for analyser in self.analysers:
+            self._free.put(analyser)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.analysers))
+
+    @property
+    def size(self):
+        return len(self.analysers)
+
+    def _acquire(self):
+        # Blocks until some analyser is free
+        return self._free.get()
+
+    def analyse(self, text):
+        analyser = self._acquire()
+        try:
+            return analyser.analyse(text)
+        finally:
+            self._free.put(analyser)
+
+    def analyse_batch(self, texts):
+        analyser = self._acquire()
+        try:
+            return analyse_batch(analyser, texts)
+        finally:
+            self._free.put(analyser)
+
+    def analyse_many(self, items, text_of=str, max_in_flight=None):
+        """Yields (item, analysis) for each of the items, in the same order they
+        were given, analysing the text of several of them at the same time.
+        Items are sent to the analysers in batches of batch_size.
+
+        Items are consumed lazily: no more than max_in_flight batches (by
+        default, twice the pool size) are waiting for their analysis at any moment.
+        """
+        if max_in_flight is None:
+            max_in_flight = 2 * self.size
+        in_flight = deque()
+        for batch in batches(items, self.batch_size):
+            if len(in_flight) >= max_in_flight:
+                yield from self._results(in_flight.popleft())
+            texts = [text_of(item) for item in batch]
+            in_flight.append((batch, self._executor.submit(self.analyse_batch, texts)))
+        while in_flight:
+            yield from self._results(in_flight.popleft())
+
+    def _results(self, pending):
+        batch, future = pending
+        return zip(batch, future.result())
+
+    def quit(self):
+        self._executor.shutdown()
+        for analyser in self.analysers:
+            analyser.quit()
+
+
+class StubAnalyser:
+    """Stands in for StanfordCoreNLP where Java is not available (tests,
+    benchmarks). Returns the same structure CoreNLP analyses are parsed into,
+    with whitespace tokenization, sentences ending on ".", and no entities.
+
+    If delay is given, each call sleeps for that many seconds, emulating the
+    time spent on the external process (once per batch, for analyse_batch).
+    """
+    _TOKEN_RE = re.compile(r"\S+")
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.analysed = 0
+
+    def analyse(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self._analyse(text)
+
+    def analyse_batch(self, texts):
+        if self.delay:
+            time.sleep(self.delay)
+        return [self._analyse(text) for text in texts]
+
+    def _analyse(self, text):
+        self.analysed += 1
+        sentences = []
+        tokens = []
+        for match in self._TOKEN_RE.finditer(text):
+            word = match.group()
+            tokens.append({
+                "word": word,
+                "lemma": word.lower(),
+                "CharacterOffsetBegin": str(match.start()),
+                "CharacterOffsetEnd": str(match.end()),
+                "POS": "NN",
+                "NER": "O",
+            })
+            if word.endswith("."):
+                sentences.append(tokens)
+                tokens = []
+        if tokens:
+            sentences.append(tokens)
+        return {"sentences": {"sentence": [
+            {
+                "tokens": {"token": sentence},
+                "parse": "(ROOT (S {}))".format(" ".join(
+                    "(NN {})".format(t["word"]) for t in sentence)),
+            } for sentence in sentences
+        ]}}
+
+    def quit(self):
+        pass
@@ -0,0 +1,140 @@
+"""
+Analysis of oversized texts with CoreNLP, in pieces.
+
+The time and memory CoreNLP needs (specially the parser and the coreference
+resolution) grow faster than the size of the text, so a few huge documents can
+stall the whole preprocess. Texts longer than a maximum size are split at safe
+boundaries (paragraphs, lines, sentence ends or, at least, spaces), each piece
+is analysed on its own, and the analyses are merged back into a single one with
+offsets relative to the whole text.
+
+Coreference chains can't cross pieces: mentions on different pieces are never
+found to be coreferent.
+"""
+import logging
+import re
+
+from iepy.preprocess.corenlp_output import FlatAnalysisData, flatten_xml_output
+from iepy.preprocess.timing import PARSING, timed
+
+logger = logging.getLogger(__name__)
+
+# Places where texts can be split, from the most preferred. The split is done
+# after the match, so the whitespace stays with the previous piece.
+SAFE_BOUNDARIES = [
+    re.compile(r"\n\s*\n"),  # paragraphs
+    re.compile(r"\n"),  # lines
+    re.compile(r"[.!?][\"')\]]*\s"),  # sentence ends
+    re.compile(r"\s"),  # words
+]
+
+
+def split_text(text, max_size):
+    """Returns the (start, end) character offsets of the pieces the text is
+    split in, each one of up to max_size characters. Pieces are at least half
+    of that long (except the last one), ending on the most preferred boundary
+    found."""
+    if max_size < 2:
+        raise ValueError("Can't split texts in pieces of {} characters".format(max_size))
+    pieces = []
+    start = 0
+    while len(text) - start > max_size:
+        end = _safe_boundary(text, start + max_size // 2, start + max_size)
+        pieces.append((start, end))
+        start = end
+    pieces.append((start, len(text)))
+    return pieces
+
+
+def _safe_boundary(text, lowest, highest):
+    for boundary in SAFE_BOUNDARIES:
+        last = None
+        for last in boundary.finditer(text, lowest, highest):
+            pass
+        if last is not None:
+            return last.end()
+    # No whitespace at all, a word has to be cut
+    return highest
+
+
+def as_flat_data(result):
+    """Returns the FlatAnalysisData of a CoreNLP analyser result (in xml or
+    json output format)"""
+    if isinstance(result, FlatAnalysisData):
+        return result
+    return flatten_xml_output(result)
+
+
+def merge_analyses(parts):
+    """Merges the analyses of the pieces of a text, given as a list of
+    (character offset where the piece starts, analysis of the piece).
+    Returns the FlatAnalysisData of the whole text."""
+    merged = FlatAnalysisData()
+    for char_offset, result in parts:
+        data = as_flat_data(result)
+        shift = len(merged.tokens)
+        merged.tokens.extend(data.tokens)
+        merged.lemmas.extend(data.lemmas)
+        merged.postags.extend(data.postags)
+        merged.ner.extend(data.ner)
+        merged.token_offsets.extend(o + char_offset for o in data.token_offsets)
+        merged.sentence_boundaries.extend(b + shift for b in data.sentence_boundaries[1:])
+        merged.parse_trees.extend(data.parse_trees)
+        merged.entity_occurrences.extend(
+            (i + shift, j + shift, kind) for i, j, kind in data.entity_occurrences)
+        merged.coreferences.extend(
+            [(i + shift, j + shift, head + shift) for i, j, head in chain]
+            for chain in data.coreferences)
+    return merged
+
+
+class SplittingAnalyser:
+    """Wraps a CoreNLP analyser (or a pool, or a cache of them), sending the
+    texts longer than max_size characters in pieces."""
+
+    def __init__(self, analyser, max_size):
+        self.analyser = analyser
+        self.max_size = max_size
+
+    def pieces(self, text):
+        """Returns the list of (start, piece of text) to analyse for the text"""
+        if len(text) <= self.max_size:
+            return [(0, text)]
+        pieces = split_text(text, self.max_size)
+        logger.info("Analysing text of %s characters in %s pieces", len(text), len(pieces))
+        return [(start, text[start:end]) for start, end in pieces]
+
+    def analyse(self, text):
+        pieces = self.pieces(text)
+        if len(pieces) == 1:
+            return self.analyser.analyse(text)
+        # Analysed as several items, so a pool can work on all of them at once
+        analysed = self.analyser.analyse_many(pieces, lambda piece: piece[1])
+        parts = [(start, result) for (start, _), result in analysed]
+        with timed(PARSING):
+            return merge_analyses(parts)
+
+    def analyse_many(self, items, text_of=str):
+        """Yields (item, analysis) for each of the items, in the same order.
+        The pieces of all of them go together to the analyser."""
+        def all_pieces():
+            for item in items:
+                pieces = self.pieces(text_of(item))
+                for start, piece in pieces:
+                    yield item, len(pieces), start, piece
+
+        parts = []
+        for (item, count, start, _), result in self.analyser.analyse_many(
+                all_pieces(), lambda piece: piece[3]):
+            if count == 1:
+                yield item, result
+                continue
+            parts.append((start, result))
+            if len(parts) == count:
+                with timed(PARSING):
+                    merged = merge_analyses(parts)
+                parts = []
+                yield item, merged
+
+    def quit(self):
+        self.analyser.quit()
@@ -0,0 +1,186 @@
+"""
+Gazettes prepared for the preprocess.
+
+Building the gazettes (the regexner mapping file for CoreNLP, the aliases to
+tell gazette entities apart, and a token trie to find them without CoreNLP) is
+done once for each version of the GazetteItems, and kept on disk for the next
+runs. Versions are told apart by a hash of the items texts and kinds, and the
+files of older versions are removed when a new one is built. They are kept on
+the instance folder (or where the GAZETTES_FOLDER instance setting says), so
+instances on different databases don't remove each other's gazettes.
+"""
+from collections import defaultdict
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+
+import iepy
+from iepy.data.models import GazetteItem
+from iepy.preprocess.ner.literal import TokenTrie
+from iepy.utils import DIRS
+
+logger = logging.getLogger(__name__)
+
+# Change it when the saved gazettes change their format, so they are built again
+FORMAT_VERSION = 1
+
+# Names of the files saved for each version of the gazettes
+_GAZETTES_FILENAME = re.compile(r"^([0-9a-f]{40})\.(tsv|pickle)$")
+
+
+def gazette_items_data():
+    """Iterator of (text, kind name) of all the GazetteItems"""
+    query = GazetteItem.objects.order_by("id").values_list("text", "kind__name")
+    return query.iterator()
+
+
+def gazettes_folder():
+    """Returns the folder where the gazettes are kept: the GAZETTES_FOLDER
+    instance setting if given, else a "gazettes" folder on the instance (or on
+    iepy's data folder, when there's no instance)"""
+    if iepy.instance is None:
+        return os.path.join(DIRS.user_data_dir, "gazettes")
+    folder = getattr(iepy.instance.settings, "GAZETTES_FOLDER", None)
+    if folder is None:
+        folder = os.path.join(os.path.dirname(iepy.instance.__file__), "gazettes")
+    return folder
+
+
+def gazettes_fingerprint(items):
+    """Returns the hash of the given (text, kind name) items, and how many they are"""
+    digest = hashlib.sha1("v{}".format(FORMAT_VERSION).encode("utf8"))
+    count = 0
+    for text, kind_name in items:
+        digest.update("{}\t{}\n".format(text, kind_name).encode("utf8"))
+        count += 1
+    return digest.hexdigest(), count
+
+
+def _write_atomically(filepath, write, mode):
+    # Several preprocess workers may be building the same gazettes at once
+    folder = os.path.dirname(filepath)
+    fd, tmp_filepath = tempfile.mkstemp(dir=folder)
+    try:
+        with open(fd, mode) as tmp_file:
+            write(tmp_file)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
+
+
+class GazetteManager:
+    _PREFIX = "__GAZETTE_"
+
+    # Stanford NER default/native classes
+    NATIVE_CLASSES = [
+        'DATE', 'DURATION', 'LOCATION', 'MISC',
+        'MONEY', 'NUMBER', 'ORDINAL', 'ORGANIZATION',
+        'PERCENT', 'PERSON', 'SET', 'TIME',
+    ]
+
+    def __init__(self, folder=None):
+        """Loads the gazettes built for the current GazetteItems from folder
+        (gazettes_folder() if not given), or builds them (and saves them
+        there) if there are none."""
+        if folder is None:
+            folder = gazettes_folder()
+        self.folder = folder
+        self.fingerprint, self.items_count = gazettes_fingerprint(gazette_items_data())
+        self.stanford_filepath = os.path.join(folder, self.fingerprint + ".tsv")
+        self._data_filepath = os.path.join(folder, self.fingerprint + ".pickle")
+        # Aliases of the gazette items of the native classes, by kind
+        self._cache_per_kind = {}
+        self.trie = TokenTrie()
+        if self.items_count and not self._load():
+            self._build()
+
+    def _load(self):
+        if not (os.path.exists(self._data_filepath) and
+                os.path.exists(self.stanford_filepath)):
+            return False
+        try:
+            with open(self._data_filepath, "rb") as data_file:
+                self._cache_per_kind, self.trie = pickle.load(data_file)
+        except Exception:
+            logger.warning("Gazettes on %s are broken, building them again",
+                           self._data_filepath)
+            return False
+        return True
+
+    def _build(self):
+        logger.info("Building the gazettes of %s items", self.items_count)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        cache_per_kind = defaultdict(set)
+        trie = TokenTrie()
+        overridable_classes = ",".join(self.NATIVE_CLASSES)
+        gazette_format = "{}\t{}\t{}\n"
+
+        def write_stanford_gazettes(gazette_file):
+            for text, kname in gazette_items_data():
+                trie.add(text.split(), kname)
+                if kname in self.NATIVE_CLASSES:
+                    # kind will not be escaped, but tokens will be stored on cache
+                    cache_per_kind[kname].add(text)
+                else:
+                    kname = "{}{}".format(self._PREFIX, kname)
+                text = self.escape_text(text)
+                gazette_file.write(gazette_format.format(text, kname, overridable_classes))
+
+        _write_atomically(self.stanford_filepath, write_stanford_gazettes, "w")
+        self._cache_per_kind, self.trie = dict(cache_per_kind), trie
+        _write_atomically(
+            self._data_filepath,
+            lambda data_file: pickle.dump((self._cache_per_kind, self.trie), data_file,
+                                          pickle.HIGHEST_PROTOCOL),
+            "wb")
+        # Only once the new version is complete, and loaded
+        self._remove_stale()
+
+    def _remove_stale(self):
+        # The files of other versions of the gazettes won't be used again by this
+        # instance (the analysers already started read their gazettes when starting)
+        for filename in os.listdir(self.folder):
+            match = _GAZETTES_FILENAME.match(filename)
+            if match and match.group(1) != self.fingerprint:
+                try:
+                    os.remove(os.path.join(self.folder, filename))
+                except OSError:
+                    # Maybe another preprocess worker removed it first
+                    pass
+
+    def escape_text(self, text):
+        text = " ".join("\Q{}\E".format(x) for x in text.split())
+        return text
+
+    def strip_kind(self, prefixed_kind):
+        return prefixed_kind.split(self._PREFIX, 1)[-1]
+
+    def was_entry_created_by_gazette(self, alias, kind):
+        if kind.startswith(self._PREFIX):
+            return True
+        return alias in self._cache_per_kind.get(kind, ())
+
+    def generate_stanford_gazettes_file(self):
+        """
+        Returns the filepath of the gazettes file for CoreNLP regexner in case
+        gazette items where found, else None. The file is the same while the
+        gazette items don't change.
+
+        Note: the Stanford Coreference annotator, only handles Entities of their
+        native classes. That's why there's some special management of Gazette items
+        of such classes/kinds.
+        """
+        if not self.items_count:
+            return
+        return self.stanford_filepath
+
+    def find_entities(self, tokens):
+        """Returns the gazette items found on the tokens (without CoreNLP), as a
+        list of ((offset, offset_end), kind name). At each position, the longest
+        item found there is taken."""
+        return self.trie.matches(tokens)
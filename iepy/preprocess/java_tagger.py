@@ -0,0 +1,131 @@
+"""
+Long-lived Stanford taggers (POS tagger, NER) running on the JVM.
+
+Tools like nltk's StanfordPOSTagger start a new JVM (and load the model again)
+on each call, which on small documents takes far longer than the tagging.
+Instead, a JavaTaggerProcess is started once, and sentences are streamed
+through its stdin, one per line.
+"""
+import logging
+import subprocess
+import threading
+
+from nltk.internals import find_binary
+
+logger = logging.getLogger(__name__)
+
+
+class TaggerProcessError(Exception):
+    pass
+
+
+class TaggerOutputError(TaggerProcessError):
+    """The tagger answered, but not with the tokens sent. Sending them again
+    would give the same answer."""
+
+
+def java_binary():
+    # Same lookup done by nltk's wrappers of the Stanford tools
+    return find_binary('java', env_vars=['JAVAHOME', 'JAVA_HOME'],
+                       binary_names=['java.exe'])
+
+
+class JavaTaggerProcess:
+    """A tagger process reading whitespace-tokenized sentences (one per line)
+    from its stdin, and writing them back as token<separator>tag pairs.
+
+    All the sentences of a call are sent at once, and the answers read
+    meanwhile. If the process dies, it's started again and the sentences are
+    sent once more (up to max_restarts times in a row). If it answers with
+    other tokens than the ones sent, it's started again (its output is out of
+    step) but the sentences are not sent again.
+    """
+
+    def __init__(self, cmd, separator, max_restarts=2):
+        self.cmd = cmd
+        self.separator = separator
+        self.max_restarts = max_restarts
+        self.lock = threading.Lock()
+        self._start_proc()
+
+    def _start_proc(self):
+        logger.info("Starting %s", " ".join(self.cmd))
+        self.proc = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,  # loading messages
+        )
+
+    def _restart_proc(self):
+        self.proc.kill()
+        self.proc.wait()
+        self._start_proc()
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+    def tag_sents(self, sentences):
+        """Tags the given sentences (each one a list of tokens). Returns a list
+        with a list of (token, tag) for each sentence."""
+        sentences = [list(s) for s in sentences]
+        with self.lock:
+            for restarts in range(self.max_restarts + 1):
+                try:
+                    return self._tag_sents(sentences)
+                except TaggerOutputError:
+                    self._restart_proc()
+                    raise
+                except (BrokenPipeError, TaggerProcessError) as error:
+                    logger.error("Tagger process failed (%s), restarting it", error)
+                    self._restart_proc()
+        raise TaggerProcessError("Tagger process keeps failing: {}".format(" ".join(self.cmd)))
+
+    def _tag_sents(self, sentences):
+        to_tag = [s for s in sentences if s]  # The tagger gives nothing for empty lines
+        # Written from another thread, otherwise both processes could get blocked
+        # writing to full pipes.
+        errors = []
+        writer = threading.Thread(target=self._send_all, args=(to_tag, errors))
+        writer.start()
+        try:
+            tagged = [self._receive(len(s)) for s in to_tag]
+        except BaseException:
+            # Otherwise the writer may wait forever for the process to read
+            self.proc.kill()
+            raise
+        finally:
+            writer.join()
+        if errors:
+            raise errors[0]
+        # Empty sentences are given back in their places
+        tagged.reverse()
+        return [tagged.pop() if s else [] for s in sentences]
+
+    def _send_all(self, sentences, errors):
+        try:
+            for sentence in sentences:
+                line = " ".join(token.replace(" ", "_") for token in sentence) + "\n"
+                self.proc.stdin.write(line.encode("utf8"))
+            self.proc.stdin.flush()
+        except BrokenPipeError as error:
+            errors.append(error)
+
+    def _receive(self, tokens_count):
+        # Taggers may split a sentence in several lines, so output is read
+        # until there are as many tagged tokens as sent
+        result = []
+        while len(result) < tokens_count:
+            line = self.proc.stdout.readline()
+            if not line:
+                raise TaggerProcessError("Tagger process exited with code {}".format(
+                    self.proc.poll()))
+            for pair in line.decode("utf8").split():
+                token, _, tag = pair.rpartition(self.separator)
+                result.append((token, tag))
+        if len(result) != tokens_count:
+            raise TaggerOutputError("Expected {} tagged tokens, got {}".format(
+                tokens_count, len(result)))
+        return result
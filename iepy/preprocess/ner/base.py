@@ -1,5 +1,7 @@
 from collections import namedtuple
+from iepy.data.models import EntityLookupCache
 from iepy.preprocess.pipeline import BasePreProcessStepRunner, PreProcessSteps
+from iepy.preprocess.timing import DATABASE, timed
 
 
 FoundEntity = namedtuple('FoundEntity', 'key kind_name alias offset offset_end from_gazette')
@@ -8,9 +10,12 @@ FoundEntity = namedtuple('FoundEntity', 'key kind_name alias offset offset_end f
 class BaseNERRunner(BasePreProcessStepRunner):
     """Base class for defining NER runners"""
     step = PreProcessSteps.ner
+    reads = ("tokens", "lemmas", "postags", "sentences")
+    writes = ("ner_done_at",)
 
     def __init__(self, override=False):
-        self.override = override
+        super().__init__(override=override)
+        self.entity_lookups = EntityLookupCache()
 
     def ok_for_running(self, doc):
         if not doc.was_preprocess_step_done(PreProcessSteps.sentencer):
@@ -27,8 +32,12 @@ class BaseNERRunner(BasePreProcessStepRunner):
         if not self.ok_for_running(doc):
             return
         entities = self.run_ner(doc)
-        doc.set_ner_result(entities)
-        doc.save()
+        self.store_ner_result(doc, entities)
+
+    def store_ner_result(self, doc, entities):
+        with timed(DATABASE):
+            doc.set_ner_result(entities, lookups=self.entity_lookups)
+            doc.save()
 
     def run_ner(self, doc):
         # Define logic in here
@@ -0,0 +1,32 @@
+from iepy.preprocess.gazettes import GazetteManager
+from iepy.preprocess.ner.base import BaseNERRunner, FoundEntity
+
+
+class GazetteNERRunner(BaseNERRunner):
+    """Tags the occurrences of the gazette items, without running CoreNLP.
+    Found entities are linked to their gazette items, like the ones CoreNLP
+    finds with the gazettes file.
+    """
+
+    def __init__(self, override=False, gazette_manager=None):
+        super(GazetteNERRunner, self).__init__(override=override)
+        if gazette_manager is None:
+            gazette_manager = GazetteManager()
+        self.gazette_manager = gazette_manager
+
+    def run_ner(self, doc):
+        entities = []
+        sent_offset = 0
+        for sent in doc.get_sentences():
+            for (i, j), kind in self.gazette_manager.find_entities(sent):
+                name = ' '.join(sent[i:j])
+                entities.append(FoundEntity(
+                    key=name,
+                    kind_name=kind,
+                    alias=name,
+                    offset=sent_offset + i,
+                    offset_end=sent_offset + j,
+                    from_gazette=True,
+                ))
+            sent_offset += len(sent)
+        return entities
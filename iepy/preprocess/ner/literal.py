@@ -1,8 +1,72 @@
 import codecs
+import os
+import pickle
 
 from iepy.preprocess.ner.base import BaseNERRunner
 
 
+class TokenTrie(object):
+    """Names (as sequences of tokens) with their labels, stored as a trie.
+
+    Nodes are numbered, and edges kept on a single dict keyed by
+    (node, token), so even millions of names take a fraction of the memory of
+    keeping every prefix of every name as a string.
+    """
+    ROOT = 0
+
+    def __init__(self):
+        self.edges = {}
+        self.labels = {}  # label of the nodes ending a name
+        self.nodes_count = 1
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, tokens, label):
+        """Adds the name, replacing the label it had (if any)"""
+        node = self.ROOT
+        for token in tokens:
+            key = (node, token)
+            child = self.edges.get(key)
+            if child is None:
+                child = self.edges[key] = self.nodes_count
+                self.nodes_count += 1
+            node = child
+        if node != self.ROOT:
+            self.labels[node] = label
+
+    def longest_match(self, tokens, start=0):
+        """Returns (end, label) for the longest name starting at tokens[start],
+        or None if no name starts there."""
+        edges = self.edges
+        labels = self.labels
+        node = self.ROOT
+        match = None
+        for i in range(start, len(tokens)):
+            node = edges.get((node, tokens[i]))
+            if node is None:
+                break
+            if node in labels:
+                match = (i + 1, labels[node])
+        return match
+
+    def matches(self, tokens):
+        """Returns the non overlapping names found from left to right (taking
+        the longest one at each position), as a list of ((offset, offset_end), label).
+        """
+        result = []
+        i = 0
+        while i < len(tokens):
+            match = self.longest_match(tokens, i)
+            if match is None:
+                i += 1
+            else:
+                end, label = match
+                result.append(((i, end), label))
+                i = end
+        return result
+
+
 class LiteralNER(object):
     """Trivial Named Entity Recognizer that tags exact matches.
     """
@@ -16,24 +80,49 @@ class LiteralNER(object):
         self.labels = labels
         self.src_filenames = src_filenames
 
-        names = set()
-        names_map = {}
+        self.trie = TokenTrie()
         for label, filename in zip(labels, src_filenames):
-            f = codecs.open(filename, encoding="utf8")
-            namelist = f.read().strip().split('\n')
-            names.update(namelist)
-            for name in namelist:
-                names_map[name] = label
-        self.names = frozenset(names)
-        self.names_map = names_map
-
-        # compute prefix closure
-        prefixes = set()
-        for name in self.names:
-            sname = name.split()
-            prefixes.update([' '.join(sname[:i]) for i in range(1, len(sname) + 1)])
-
-        self.prefixes = frozenset(prefixes)
+            with codecs.open(filename, encoding="utf8") as f:
+                for name in f:
+                    self.trie.add(name.split(), label)
+
+    _DUMPED_ATTRS = ['labels', 'src_filenames', 'trie']
+
+    def save(self, file_path):
+        if os.path.exists(file_path):
+            raise ValueError("Output file path already exists")
+        to_dump = [getattr(self, attr) for attr in self._DUMPED_ATTRS]
+        with open(file_path, 'wb') as filehandler:
+            pickle.dump(to_dump, filehandler, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, file_path):
+        """Loads a tagger saved with save, without reading its source files"""
+        if not os.path.exists(file_path):
+            raise ValueError("File does not exists")
+        with open(file_path, 'rb') as filehandler:
+            data = pickle.load(filehandler)
+        self = cls.__new__(cls)
+        for attr, value in zip(cls._DUMPED_ATTRS, data):
+            setattr(self, attr, value)
+        return self
+
+    @classmethod
+    def cached(cls, labels, src_filenames, file_path):
+        """Loads the tagger saved on file_path, if it was built from the same
+        labels and source files, and after their last change. Otherwise builds
+        it, and saves it there for the next time."""
+        if os.path.exists(file_path):
+            sources_mtime = max(os.path.getmtime(f) for f in src_filenames)
+            if os.path.getmtime(file_path) >= sources_mtime:
+                tagger = cls.load(file_path)
+                if (list(tagger.labels) == list(labels) and
+                        list(tagger.src_filenames) == list(src_filenames)):
+                    return tagger
+            os.remove(file_path)
+        tagger = cls(labels, src_filenames)
+        tagger.save(file_path)
+        return tagger
 
     def tag(self, sent):
         """Tagger with output a la Stanford (no start/end markers).
@@ -57,31 +146,22 @@ class LiteralNER(object):
 
     def entities(self, sent):
         """Return entities as a list of pairs ((offset, offset_end), label).
+        At each position, the longest name found there is taken.
         """
-        result = []
-        i = 0
-        while i < len(sent):
-            j = i + 1
-            prev_segment = segment = ' '.join(sent[i:j])
-            while segment in self.prefixes and j <= len(sent):
-                j += 1
-                prev_segment = segment
-                segment = ' '.join(sent[i:j])
-            if prev_segment in self.names:
-                label = self.names_map[prev_segment]
-                result.append(((i, j - 1), label))
-                i = j - 1
-            else:
-                i += 1
-
-        return result
+        return self.trie.matches(sent)
 
 
 class LiteralNERRunner(BaseNERRunner):
 
-    def __init__(self, labels, src_filenames, override=False):
+    def __init__(self, labels, src_filenames, override=False, tagger_filepath=None):
+        """If tagger_filepath is given, the tagger is saved there, and loaded
+        from there on the next runs (as long as the source files don't change).
+        """
         super(LiteralNERRunner, self).__init__(override=override)
-        self.lit_tagger = LiteralNER(labels, src_filenames)
+        if tagger_filepath is None:
+            self.lit_tagger = LiteralNER(labels, src_filenames)
+        else:
+            self.lit_tagger = LiteralNER.cached(labels, src_filenames, tagger_filepath)
 
     def run_ner(self, doc):
         entities = []
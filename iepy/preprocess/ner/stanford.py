@@ -6,8 +6,10 @@ import logging
 from nltk.tag.stanford import StanfordNERTagger
 import wget
 
+from iepy.preprocess.java_tagger import JavaTaggerProcess, java_binary
 from iepy.preprocess.ner.base import BaseNERRunner
-from iepy.utils import DIRS, unzip_file
+from iepy.preprocess.timing import ANALYSER, timed
+from iepy.utils import DIRS, batches, unzip_file
 
 logger = logging.getLogger(__name__)
 stanford_ner_name = 'stanford-ner-2014-01-04'
@@ -26,17 +28,42 @@ class NonTokenizingNERTagger(StanfordNERTagger):
 class NERRunner(BaseNERRunner):
     """Wrapper to insert a generic callable sentence NER tagger into the pipeline.
     """
-    def __init__(self, ner, override=False):
+    def __init__(self, ner, override=False, batch_size=1):
+        """When processing many documents, the sentences of batch_size of them
+        are given to ner at once."""
         super(NERRunner, self).__init__(override=override)
         self.ner = ner
+        self.batch_size = batch_size
 
     def run_ner(self, doc):
-        entities = []
         # Apply the ner algorithm which takes a list of sentences and returns
         # a list of sentences, each being a list of NER-tokens, each of which is
         # a pairs (tokenstring, class)
-        ner_sentences = self.ner(doc.get_sentences())
-        # Flatten the nested list above into just a list of kinds
+        with timed(ANALYSER):
+            ner_sentences = list(self.ner(list(doc.get_sentences())))
+        return self.found_entities(doc, ner_sentences)
+
+    def process_documents(self, docs):
+        """Same as calling the runner on each of the documents, but giving the
+        sentences of batch_size documents at once to the ner.
+        Yields the documents (in the same order) as they are done.
+        """
+        for batch in batches(docs, self.batch_size):
+            to_tag = [(doc, list(doc.get_sentences())) for doc in batch
+                      if self.ok_for_running(doc)]
+            sentences = [sentence for _, doc_sentences in to_tag for sentence in doc_sentences]
+            if sentences:
+                with timed(ANALYSER):
+                    ner_sentences = iter(list(self.ner(sentences)))
+            for doc, doc_sentences in to_tag:
+                entities = self.found_entities(
+                    doc, [next(ner_sentences) for _ in doc_sentences])
+                self.store_ner_result(doc, entities)
+            yield from batch
+
+    def found_entities(self, doc, ner_sentences):
+        entities = []
+        # Flatten the nested list of sentences into just a list of kinds
         ner_kinds = (k for s in ner_sentences for (_, k) in s)
 
         # We build a large iterator z that goes over tuples like the following:
@@ -80,19 +107,26 @@ class NERRunner(BaseNERRunner):
 
 
 class StanfordNERRunner(NERRunner):
+    """Tags with a single Stanford NER process, kept running for all the
+    documents."""
 
-    def __init__(self, override=False):
+    def __init__(self, override=False, batch_size=50):
         ner_path = os.path.join(DIRS.user_data_dir, stanford_ner_name)
         if not os.path.exists(ner_path):
             raise LookupError("Stanford NER not found. Try running the "
                               "command download_third_party_data.py")
 
-        ner = NonTokenizingNERTagger(
-            os.path.join(ner_path, 'classifiers', 'english.all.3class.distsim.crf.ser.gz'),
-            os.path.join(ner_path, 'stanford-ner.jar'),
-            encoding='utf8')
-
-        super(StanfordNERRunner, self).__init__(ner.tag_sents, override)
+        self.ner_process = JavaTaggerProcess([
+            java_binary(), '-mx1000m',
+            '-cp', os.path.join(ner_path, 'stanford-ner.jar'),
+            'edu.stanford.nlp.ie.crf.CRFClassifier',
+            '-loadClassifier', os.path.join(
+                ner_path, 'classifiers', 'english.all.3class.distsim.crf.ser.gz'),
+            '-readStdin', '-tokenizerFactory', 'edu.stanford.nlp.process.WhitespaceTokenizer',
+            '-outputFormat', 'slashTags', '-encoding', 'utf8',
+        ], separator='/')
+
+        super(StanfordNERRunner, self).__init__(self.ner_process.tag_sents, override, batch_size)
 
 
 def download():
@@ -0,0 +1,174 @@
+"""
+Preprocessing documents with several worker processes.
+
+The coordinator splits the ids of the documents to preprocess in small chunks,
+and hands them to whichever worker is free, so long documents on one of them
+don't leave the others idle. Each worker builds its step runners (and so, its
+CoreNLP process) once, and reuses them for all the chunks it gets.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+import time
+
+from iepy.utils import chunks
+
+logger = logging.getLogger(__name__)
+
+# Step runners of the worker process, built on its first chunk
+_runners = None
+
+
+def preprocess_chunk(make_runners, document_ids):
+    """Runs the preprocess pipeline on the documents with the given ids.
+    Meant to be run on a worker process: the step runners are built by calling
+    make_runners the first time, and reused afterwards.
+    Returns how many documents were given, and the seconds it took.
+    """
+    from iepy.data.models import IEDocument
+    from iepy.preprocess.pipeline import PreProcessPipeline
+    global _runners
+    start = time.time()
+    try:
+        if _runners is None:
+            _runners = make_runners()
+        docs = IEDocument.objects.filter(id__in=document_ids)
+        if docs.exists():
+            PreProcessPipeline(_runners, docs).process_everything()
+    except SystemExit:
+        # The CoreNLP process died, so the runners of this worker are useless.
+        # Killing it makes the coordinator start new workers.
+        logger.error("Worker %s can't go on, stopping it", os.getpid())
+        os._exit(1)
+    return len(document_ids), time.time() - start
+
+
+def _close_db_connections():
+    # Connections can't be shared with the forked workers, each one opens its own
+    from django.db import connections
+    for connection in connections.all():
+        connection.close()
+
+
+class PreprocessProgress:
+    """Keeps count of the preprocessed documents, and logs the throughput"""
+
+    def __init__(self, total, workers):
+        self.total = total
+        self.workers = workers
+        self.done = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.start = time.time()
+
+    def update(self, done, busy_time):
+        self.done += done
+        self.busy_time += busy_time
+        logger.info("Preprocessed %s of %s documents (%s failed), %.2f docs/sec",
+                    self.done, self.total, self.failed, self.docs_per_second())
+
+    def fail(self, count):
+        self.failed += count
+
+    def docs_per_second(self):
+        elapsed = time.time() - self.start
+        return self.done / elapsed if elapsed else 0.0
+
+    def summary(self):
+        per_worker = self.done / self.busy_time if self.busy_time else 0.0
+        logger.info(
+            "Preprocessed %s of %s documents in %.1f secs with %s workers "
+            "(%.2f docs/sec, %.2f docs/sec per worker). %s documents failed.",
+            self.done, self.total, time.time() - self.start, self.workers,
+            self.docs_per_second(), per_worker, self.failed)
+
+
+class ParallelPreprocess:
+    """Coordinates several worker processes preprocessing documents.
+
+    make_runners must be a picklable callable (like a module level function)
+    returning the list of step runners of the pipeline. Each worker calls it once.
+
+    A chunk that fails is split in single documents, which are retried up to
+    max_attempts times. If a worker process dies, all the workers are replaced,
+    and the chunks they were working on are run again one at a time, so the
+    one killing the worker can be told apart and retried the same way.
+    Documents that failed on every attempt are left untouched (so they are
+    still lacking preprocess) and returned by run.
+    """
+
+    def __init__(self, make_runners, workers=None, chunk_size=20, max_attempts=3,
+                 process_chunk=preprocess_chunk):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.make_runners = make_runners
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.process_chunk = process_chunk
+
+    def run(self, document_ids):
+        """Preprocesses the documents with the given ids. Returns the list of
+        ids of the ones that failed."""
+        document_ids = list(document_ids)
+        self.pending = deque((chunk, 0) for chunk in chunks(document_ids, self.chunk_size))
+        # Chunks that were being processed when a worker died
+        self.suspects = deque()
+        self.failed = []
+        self.progress = PreprocessProgress(len(document_ids), self.workers)
+        while self.pending or self.suspects:
+            self._run_pool(self.suspects if self.suspects else self.pending)
+        self.progress.summary()
+        return sorted(self.failed)
+
+    def _run_pool(self, queue):
+        """Runs the chunks of the queue on a pool of workers, until they are all
+        done or some worker dies"""
+        # Suspects are run one at a time, to find out which of them kills the worker
+        isolated = queue is self.suspects
+        workers = 1 if isolated else self.workers
+        _close_db_connections()
+        broken = False
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while in_flight or (queue and not broken):
+                # A couple of chunks per worker are queued at any time, the rest
+                # wait here so they can be retried in order after a failure
+                max_in_flight = 1 if isolated else 2 * workers
+                while queue and not broken and len(in_flight) < max_in_flight:
+                    chunk, attempts = queue.popleft()
+                    future = executor.submit(self.process_chunk, self.make_runners, chunk)
+                    in_flight[future] = (chunk, attempts)
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    chunk, attempts = in_flight.pop(future)
+                    try:
+                        done, busy_time = future.result()
+                    except BrokenProcessPool:
+                        if not broken:
+                            logger.error("A preprocess worker died, restarting them")
+                        broken = True
+                        if isolated:
+                            self._retry(chunk, attempts, self.suspects)
+                        else:
+                            self.suspects.append((chunk, attempts))
+                    except Exception as error:
+                        logger.error("Preprocess failed for documents %s: %r", chunk, error)
+                        self._retry(chunk, attempts, self.pending)
+                    else:
+                        self.progress.update(done, busy_time)
+
+    def _retry(self, chunk, attempts, queue):
+        attempts += 1
+        if len(chunk) > 1:
+            # Isolates the failing document(s) from the rest
+            queue.extend(([doc_id], attempts) for doc_id in chunk)
+        elif attempts < self.max_attempts:
+            queue.append((chunk, attempts))
+        else:
+            logger.error("Giving up preprocessing document %s", chunk[0])
+            self.failed.extend(chunk)
+            self.progress.fail(len(chunk))
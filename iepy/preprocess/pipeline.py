@@ -1,6 +1,11 @@
+from contextlib import contextmanager
 import logging
+import time
 from enum import Enum
 
+from iepy.preprocess.timing import DATABASE, PreprocessTimings, timed
+from iepy.utils import batches
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,27 +20,114 @@ class PreProcessSteps(Enum):
     syntactic_parsing = 7
 
 
+# Document fields with the moment each step was done. Runners check them to decide
+# what to do, so they are always loaded.
+STEP_FLAG_FIELDS = tuple('%s_done_at' % step.name for step in PreProcessSteps)
+
+
 class PreProcessPipeline(object):
     """Coordinates the pre-processing tasks on a set of documents"""
 
-    def __init__(self, step_runners, documents_manager):
+    def __init__(self, step_runners, documents_manager, commit_every=None):
         """Takes a list of callables and a documents-manager.
 
             Step Runners may be any callable. It they have an attribute step,
             then that runner will be treated as the responsible for
             accomplishing such a PreProcessStep.
+
+            If commit_every is given, the changes made by the runners are
+            committed to the database once every that many documents, instead
+            of on each save. If a document fails, only its changes are rolled
+            back, and the documents after it on the batch are retried one by one.
         """
         from iepy.data.db import DocumentManager  # circular imports safety
         self.step_runners = step_runners
         if not isinstance(documents_manager, DocumentManager):
             documents_manager = DocumentManager(documents_manager)
         self.documents = documents_manager
+        self.commit_every = commit_every
+        # Time spent by each runner on each document
+        self.timings = PreprocessTimings()
+
+    def walk_document(self, doc, save=False):
+        """Computes all the missing pre-process steps for the given document.
 
-    def walk_document(self, doc):
-        """Computes all the missing pre-process steps for the given document"""
-        for step in self.step_runners:
-            step(doc)
-        return
+        If save is True, the saves made by the runners are held back, and the
+        document is saved once at the end (only the fields that the runners
+        declare to write, if all of them do).
+        """
+        if not save:
+            for step in self.step_runners:
+                step(doc)
+            return
+        with _deferred_saves(doc) as saves:
+            for step in self.step_runners:
+                start = time.time()
+                step(doc)
+                self.timings.document_done(_runner_name(step), doc, time.time() - start)
+        if saves:
+            start = time.time()
+            with timed(DATABASE):
+                doc.save(update_fields=self._fields_written())
+            self.timings.document_done('Save', doc, time.time() - start)
+
+    def _fields_written(self):
+        """Fields that the runners declare to write, or None if some of them don't"""
+        fields = set()
+        for runner in self.step_runners:
+            writes = getattr(runner, 'writes', None)
+            if writes is None:
+                return None
+            fields.update(writes)
+        return sorted(fields)
+
+    def _fields_used(self):
+        """Fields that the runners declare to read or write (plus the step
+        flags), or None if some of them don't"""
+        writes = self._fields_written()
+        if writes is None:
+            return None
+        fields = set(writes).union(STEP_FLAG_FIELDS)
+        for runner in self.step_runners:
+            reads = getattr(runner, 'reads', None)
+            if reads is None:
+                return None
+            fields.update(reads)
+        return sorted(fields)
+
+    def _documents_to_walk(self, fields):
+        runners = self.step_runners
+        if all(hasattr(r, 'step') and not (r.override or r.increment) for r in runners):
+            steps = [r.step for r in runners]
+            return self.documents.get_documents_lacking_preprocess(steps, fields=fields)
+        if fields is None:
+            return self.documents  # everything
+        return self.documents.get_documents(fields=fields)
+
+    def walk_everything(self, timings_filepath=None):
+        """Document-major alternative to process_everything: each document
+        needing some step is loaded once (only the fields the runners use, if
+        all of them declare it), goes through all the runners, and is saved once.
+        Runners get documents one by one, so they can't send them in batches to
+        their analysers.
+        """
+        docs = self._documents_to_walk(self._fields_used())
+
+        def walk_documents(docs):
+            for doc in docs:
+                self.walk_document(doc, save=True)
+                yield doc
+
+        if self.commit_every:
+            processed = self._in_transactions(walk_documents, docs)
+        else:
+            processed = walk_documents(docs)
+        with self.timings.collecting():
+            for i, doc in enumerate(processed):
+                logger.info('\tDone for %i documents', i + 1)
+        self.timings.log_summary()
+        if timings_filepath:
+            self.timings.export_json(timings_filepath)
 
     def process_step_in_batch(self, runner):
         """Tries to apply the required step to all documents lacking it"""
@@ -44,20 +136,129 @@ class PreProcessPipeline(object):
             docs = self.documents.get_documents_lacking_preprocess(runner.step)
         else:
             docs = self.documents  # everything
-        for i, doc in enumerate(docs):
-            runner(doc)
-            logger.info('\tDone for %i documents', i + 1)
+        if isinstance(runner, BasePreProcessStepRunner):
+            process_documents = runner.process_documents
+        else:
+            # Plain callable
+            process_documents = _one_by_one(runner)
+        if self.commit_every:
+            processed = self._in_transactions(process_documents, docs)
+        else:
+            processed = process_documents(docs)
+        name = _runner_name(runner)
+        with self.timings.collecting():
+            start = time.time()
+            for i, doc in enumerate(processed):
+                now = time.time()
+                self.timings.document_done(name, doc, now - start)
+                start = now
+                logger.info('\tDone for %i documents', i + 1)
 
-    def process_everything(self):
-        """Tries to apply all the steps to all documents"""
+    def _in_transactions(self, process_documents, docs):
+        """Same as process_documents(docs), but on a transaction for each
+        batch of commit_every documents"""
+        from django.db import transaction  # circular imports safety
+        for batch in batches(docs, self.commit_every):
+            with transaction.atomic():
+                yield from self._process_batch(process_documents, batch)
+
+    def _process_batch(self, process_documents, batch):
+        from django.db import transaction  # circular imports safety
+        # Each document is saved while the runner works on it, before yielding
+        # it. So a savepoint around each step of the runner isolates the
+        # changes of the document that fails.
+        processed = process_documents(batch)
+        next_index = 0  # of the first document of the batch not yielded yet
+        while True:
+            try:
+                with transaction.atomic():
+                    doc = next(processed)
+            except StopIteration:
+                return
+            except Exception:
+                logger.exception('Preprocess failed, retrying the rest of the batch '
+                                 'one by one')
+                self._forget_rolled_back()
+                break
+            next_index = _index_of(batch, doc, next_index) + 1
+            yield doc
+
+        for doc in batch[next_index:]:
+            if hasattr(doc, 'refresh_from_db'):
+                # Discards what the failed attempt left on the document
+                doc.refresh_from_db()
+            try:
+                with transaction.atomic():
+                    done = list(process_documents([doc]))
+            except Exception:
+                logger.exception('Preprocess failed for document %s', doc)
+                self._forget_rolled_back()
+                continue
+            yield from done
+
+    def _forget_rolled_back(self):
+        # Kinds or entities the runners cached may have been created on the
+        # savepoint just rolled back
+        for runner in self.step_runners:
+            lookups = getattr(runner, 'entity_lookups', None)
+            if lookups is not None:
+                lookups.clear()
+
+    def process_everything(self, timings_filepath=None):
+        """Tries to apply all the steps to all documents.
+        At the end, logs how the time was spent by each runner, and if
+        timings_filepath is given, writes there the details as json.
+        """
         for runner in self.step_runners:
             self.process_step_in_batch(runner)
+        self.timings.log_summary()
+        if timings_filepath:
+            self.timings.export_json(timings_filepath)
+
+
+@contextmanager
+def _deferred_saves(doc):
+    """Replaces doc.save while in the block, so calling it only gets recorded"""
+    saves = []
+    doc.save = lambda *args, **kwargs: saves.append((args, kwargs))
+    try:
+        yield saves
+    finally:
+        del doc.save
+
+
+def _index_of(batch, doc, start):
+    for i in range(start, len(batch)):
+        if batch[i] is doc:
+            return i
+    return start
+
+
+def _runner_name(runner):
+    if isinstance(runner, BasePreProcessStepRunner):
+        return type(runner).__name__
+    return getattr(runner, '__name__', type(runner).__name__)
+
+
+def _one_by_one(runner):
+    def process_documents(docs):
+        for doc in docs:
+            runner(doc)
+            yield doc
+    return process_documents
 
 
 class BasePreProcessStepRunner(object):
     # If it's for a particular step, you can write
     # step = PreProcessSteps.something
 
+    # Document fields that the runner reads, and writes (including the flags of
+    # the steps it does), as tuples of field names. When the pipeline walks
+    # documents one by one, it uses them to load and save only those fields.
+    # None means they are unknown (all fields will be loaded and saved).
+    reads = None
+    writes = None
+
     def __init__(self, override=False, increment=False):
         self.override = override
         self.increment = increment
@@ -71,3 +272,9 @@ class BasePreProcessStepRunner(object):
         #    - skip
         #    - re-do step.
         raise NotImplementedError
+
+    def process_documents(self, docs):
+        """Runs the step on each of the given documents, yielding them once done.
+        Runners able to work on several documents at the same time can redefine it.
+        """
+        return _one_by_one(self)(docs)
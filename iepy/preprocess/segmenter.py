@@ -1,4 +1,5 @@
 from iepy.preprocess.pipeline import BasePreProcessStepRunner, PreProcessSteps
+from iepy.preprocess.timing import DATABASE, timed
 from collections import namedtuple
 
 # Representation of Segments that a Segmenter found
@@ -8,6 +9,8 @@ RawSegment = namedtuple('RawSegment', 'offset offset_end entity_occurrences')
 class SyntacticSegmenterRunner(BasePreProcessStepRunner):
 
     step = PreProcessSteps.segmentation
+    reads = ("tokens", "sentences")
+    writes = ("segmentation_done_at",)
 
     def __init__(self, override=False, increment=True):
         self.override = override
@@ -20,9 +23,10 @@ class SyntacticSegmenterRunner(BasePreProcessStepRunner):
             return
         if self.increment or self.override or not was_done(self.step):
             segments = self.build_syntactic_segments(doc)
-            doc.set_segmentation_result(
-                segments, override=self.override, increment=self.increment)
-            doc.save()
+            with timed(DATABASE):
+                doc.set_segmentation_result(
+                    segments, override=self.override, increment=self.increment)
+                doc.save()
 
     def build_syntactic_segments(self, doc):
         # Returns a list of RawSegments.
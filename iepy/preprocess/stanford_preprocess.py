@@ -1,12 +1,15 @@
 from collections import defaultdict
 from itertools import chain, groupby
+from operator import itemgetter
 import logging
-import tempfile
 
 from iepy.preprocess import corenlp
+from iepy.preprocess.corenlp_output import FlatAnalysisData
+from iepy.preprocess.gazettes import GazetteManager
 from iepy.preprocess.pipeline import BasePreProcessStepRunner, PreProcessSteps
+from iepy.preprocess.timing import DATABASE, PARSING, timed
 from iepy.preprocess.ner.base import FoundEntity
-from iepy.data.models import EntityOccurrence, GazetteItem
+from iepy.data.models import EntityOccurrence, EntityLookupCache
 
 
 logger = logging.getLogger(__name__)
@@ -16,126 +19,253 @@ class CoreferenceError(Exception):
     pass
 
 
-class GazetteManager:
-    _PREFIX = "__GAZETTE_"
-
-    # Stanford NER default/native classes
-    NATIVE_CLASSES = [
-        'DATE', 'DURATION', 'LOCATION', 'MISC',
-        'MONEY', 'NUMBER', 'ORDINAL', 'ORGANIZATION',
-        'PERCENT', 'PERSON', 'SET', 'TIME',
-    ]
-
-    def __init__(self):
-        self.gazette_items = list(GazetteItem.objects.all())
-        self._cache_per_kind = defaultdict(list)
-
-    def escape_text(self, text):
-        text = " ".join("\Q{}\E".format(x) for x in text.split())
-        return text
-
-    def strip_kind(self, prefixed_kind):
-        return prefixed_kind.split(self._PREFIX, 1)[-1]
-
-    def was_entry_created_by_gazette(self, alias, kind):
-        if kind.startswith(self._PREFIX):
-            return True
-        return alias in self._cache_per_kind[kind]
-
-    def generate_stanford_gazettes_file(self):
-        """
-        Generates the gazettes file if there's any. Returns
-        the filepath in case gazette items where found, else None.
-
-        Note: the Stanford Coreference annotator, only handles Entities of their
-        native classes. That's why there's some special management of Gazette items
-        of such classes/kinds.
-        As a side effect, populates the internal cache with the gazette-items
-        that will be passed to Stanford with any of their Native classes (Entity Kinds)
-        """
-        if not self.gazette_items:
-            return
-
-        overridable_classes = ",".join(self.NATIVE_CLASSES)
-        self._cache_per_kind = defaultdict(list)
-
-        gazette_format = "{}\t{}\t{}\n"
-        _, filepath = tempfile.mkstemp()
-        with open(filepath, "w") as gazette_file:
-            for gazette in self.gazette_items:
-                kname = gazette.kind.name
-                if kname in self.NATIVE_CLASSES:
-                    # kind will not be escaped, but tokens will be stored on cache
-                    self._cache_per_kind[kname].append(gazette.text)
-                else:
-                    kname = "{}{}".format(self._PREFIX, kname)
-                text = self.escape_text(gazette.text)
-                line = gazette_format.format(text, kname, overridable_classes)
-                gazette_file.write(line)
-        return filepath
-
-
 class StanfordPreprocess(BasePreProcessStepRunner):
 
-    def __init__(self, increment_ner=False):
+    # Steps that can be added on their own to already tokenized and sentenced
+    # documents (preprocessed with older versions, or with less annotators
+    # configured), and the CoreNLP annotators each of them needs.
+    INCREMENTAL_STEPS = {
+        PreProcessSteps.tagging: ("tokenize", "ssplit", "pos"),
+        PreProcessSteps.lemmatization: ("tokenize", "ssplit", "pos", "lemma"),
+        PreProcessSteps.ner: ("tokenize", "ssplit", "pos", "lemma", "ner"),
+        PreProcessSteps.syntactic_parsing: ("tokenize", "ssplit", "pos", "parse"),
+    }
+
+    # CoreNLP annotator that computes each of the steps
+    STEP_ANNOTATORS = {
+        PreProcessSteps.tokenization: "tokenize",
+        PreProcessSteps.sentencer: "ssplit",
+        PreProcessSteps.tagging: "pos",
+        PreProcessSteps.lemmatization: "lemma",
+        PreProcessSteps.ner: "ner",
+        PreProcessSteps.syntactic_parsing: "parse",
+    }
+    reads = ("text", "human_identifier", "tokens", "lemmas", "postags", "sentences")
+    writes = ("tokens", "offsets_to_text", "lemmas", "postags", "sentences",
+              "syntactic_sentences") + tuple(
+        "%s_done_at" % step.name for step in STEP_ANNOTATORS)
+
+    def __init__(self, increment_ner=False, corenlp_workers=None, annotators=None):
+        """The annotators CoreNLP runs (by default, the ones of the
+        CORENLP_ANNOTATORS instance setting, or all of them) decide which
+        steps are computed. Only those steps are marked as done on the
+        documents.
+        """
         super().__init__()
+        if annotators is None:
+            annotators = corenlp.configured_annotators()
+        self.annotators = corenlp.StanfordCoreNLP.check_annotators(annotators)
+        if not {"tokenize", "ssplit"}.issubset(self.annotators):
+            raise ValueError("Preprocess needs at least CoreNLP tokenize and ssplit annotators")
+        self.steps = [step for step, annotator in self.STEP_ANNOTATORS.items()
+                      if annotator in self.annotators]
+        if increment_ner and PreProcessSteps.ner not in self.steps:
+            raise ValueError("Can't increment NER without the CoreNLP ner annotator")
         self.gazette_manager = GazetteManager()
         gazettes_filepath = self.gazette_manager.generate_stanford_gazettes_file()
-        self.corenlp = corenlp.get_analizer(gazettes_filepath=gazettes_filepath)
+        self.gazettes_filepath = gazettes_filepath
+        self.corenlp_workers = corenlp_workers
+        self.corenlp = corenlp.get_analizer(gazettes_filepath=gazettes_filepath,
+                                            workers=corenlp_workers,
+                                            annotators=self.annotators)
         self.override = False
         self.increment_ner = increment_ner
+        self.entity_lookups = EntityLookupCache()
+        self.partial_analyser = None  # (annotators, analyser) of the last partial run
+
+    def analyser_for(self, annotators=None):
+        """Returns the CoreNLP analyser running only the given annotators (all
+        of them if not given). Only the last one of the partial runs is kept
+        running, the previous one is quit when another one is needed."""
+        if annotators is None:
+            return self.corenlp
+        annotators = tuple(annotators)
+        if self.partial_analyser is not None and self.partial_analyser[0] == annotators:
+            return self.partial_analyser[1]
+        self.quit_partial_analyser()
+        kwargs = {}
+        if "ner" in annotators:
+            kwargs["gazettes_filepath"] = self.gazettes_filepath
+        analyser = corenlp.start_analizer(workers=self.corenlp_workers,
+                                          annotators=annotators, **kwargs)
+        self.partial_analyser = (annotators, analyser)
+        return analyser
+
+    def quit_partial_analyser(self):
+        if self.partial_analyser is not None:
+            self.partial_analyser[1].quit()
+            self.partial_analyser = None
+
+    def analyse(self, document, annotators=None):
+        analyser = self.analyser_for(annotators)
+        result = analyser.analyse(document.text)
+        with timed(PARSING):
+            return make_analysis(result)
+
+    def missing_steps(self, document):
+        """Returns the incremental steps (among the ones being computed) the
+        document lacks"""
+        return [step for step in self.INCREMENTAL_STEPS
+                if step in self.steps and not document.was_preprocess_step_done(step)]
+
+    def annotators_for(self, steps):
+        annotators = set()
+        for step in steps:
+            annotators.update(self.INCREMENTAL_STEPS[step])
+        return tuple(a for a in corenlp.StanfordCoreNLP.ANNOTATORS if a in annotators)
+
+    def missing_steps_only(self, document, analysis=None):
+        """Adds to a document preprocessed with an older version the steps it
+        lacks, with a single analysis (running only the annotators those steps
+        need) and a single save."""
+        steps = self.missing_steps(document)
+        if analysis is None:
+            analysis = self.analyse(document, self.annotators_for(steps))
+        if PreProcessSteps.tagging in steps:
+            self.tagging_only(document, analysis, save=False)
+        if PreProcessSteps.lemmatization in steps:
+            self.lemmatization_only(document, analysis, save=False)
+        if PreProcessSteps.ner in steps:
+            self.ner_only(document, analysis)
+        if PreProcessSteps.syntactic_parsing in steps:
+            self.syntactic_parsing_only(document, analysis, save=False)
+        with timed(DATABASE):
+            document.save()
+
+    def check_same_tokens(self, document, analysis, what):
+        if document.tokens != analysis.get_tokens():
+            raise ValueError(
+                "Document changed since last tokenization, "
+                "can't add {} to it".format(what)
+            )
+
+    def tagging_only(self, document, analysis=None, save=True):
+        """ Run only the part of speech tagging """
+        # For documents preprocessed without the CoreNLP pos annotator
+        if analysis is None:
+            analysis = self.analyse(
+                document, self.annotators_for([PreProcessSteps.tagging]))
+        self.check_same_tokens(document, analysis, "part of speech tags")
+        document.set_tagging_result(analysis.get_pos())
+        if save:
+            with timed(DATABASE):
+                document.save()
+
+    def ner_only(self, document, analysis=None):
+        """ Run only the NER (without coreference resolution) """
+        # For documents preprocessed without the CoreNLP ner annotator. Entity
+        # occurrences are stored right away, but the document is not saved.
+        if analysis is None:
+            analysis = self.analyse(
+                document, self.annotators_for([PreProcessSteps.ner]))
+        self.check_same_tokens(document, analysis, "entity occurrences")
+        found_entities = analysis.get_found_entities(
+            document.human_identifier, self.gazette_manager
+        )
+        with timed(DATABASE):
+            document.set_ner_result(found_entities, lookups=self.entity_lookups)
 
-    def lemmatization_only(self, document):
+    def lemmatization_only(self, document, analysis=None, save=True):
         """ Run only the lemmatization """
         # Lemmatization was added after the first so we need to support
         # that a document has all the steps done but lemmatization
 
-        analysis = StanfordAnalysis(self.corenlp.analyse(document.text))
-        tokens = analysis.get_tokens()
-        if document.tokens != tokens:
-            raise ValueError(
-                "Document changed since last tokenization, "
-                "can't add lemmas to it"
-            )
+        if analysis is None:
+            analysis = self.analyse(
+                document, self.annotators_for([PreProcessSteps.lemmatization]))
+        self.check_same_tokens(document, analysis, "lemmas")
         document.set_lemmatization_result(analysis.get_lemmas())
-        document.save()
+        if save:
+            with timed(DATABASE):
+                document.save()
 
-    def syntactic_parsing_only(self, document):
+    def syntactic_parsing_only(self, document, analysis=None, save=True):
         """ Run only the syntactic parsing """
         # syntactic parsing was added after the first release, so we need to
         # provide the ability of doing just this on documents that
         # have all the steps done but syntactic parsing
-        analysis = StanfordAnalysis(self.corenlp.analyse(document.text))
+        if analysis is None:
+            analysis = self.analyse(
+                document, self.annotators_for([PreProcessSteps.syntactic_parsing]))
+        if document.sentences != analysis.get_sentence_boundaries():
+            raise ValueError(
+                "Document sentences differ from the ones of the new analysis, "
+                "can't add syntactic parsing to them"
+            )
         parse_trees = analysis.get_parse_trees()
         document.set_syntactic_parsing_result(parse_trees)
-        document.save()
+        if save:
+            with timed(DATABASE):
+                document.save()
 
-    def increment_ner_only(self, document):
+    def increment_ner_only(self, document, analysis=None):
         """
         Runs NER steps (basic NER and also Gazetter), adding the new found NE.
         """
-        analysis = StanfordAnalysis(self.corenlp.analyse(document.text))
+        if analysis is None:
+            analysis = self.analyse(document)
 
         # NER
         found_entities = analysis.get_found_entities(
             document.human_identifier, self.gazette_manager
         )
-        document.set_ner_result(found_entities)
+        with timed(DATABASE):
+            document.set_ner_result(found_entities, lookups=self.entity_lookups)
 
-        # Save progress so far, next step doesn't modify `document`
-        document.save()
+            # Save progress so far, next step doesn't modify `document`
+            document.save()
 
         # Coreference resolution
-        for coref in analysis.get_coreferences():
-            try:
-                apply_coreferences(document, coref)
-            except CoreferenceError as e:
-                logger.warning(e)
+        self.apply_coreferences(document, analysis)
+
+    def apply_coreferences(self, document, analysis):
+        with timed(DATABASE):
+            for coref in analysis.get_coreferences():
+                try:
+                    apply_coreferences(document, coref)
+                except CoreferenceError as e:
+                    logger.warning(e)
 
     def __call__(self, document):
         """Checks state of the document, and based on the preprocess options,
         # decides what needs to be run, and triggers it.
         """
+        for task in self.tasks_for(document):
+            task(document)
+
+    def process_documents(self, documents):
+        """Same as calling the runner on each of the documents, but sending them
+        to CoreNLP in batches, and keeping several of them being analysed at the
+        same time when CoreNLP runs as a pool.
+        Yields the documents as they are done.
+        """
+        pending = ((doc, self.tasks_for(doc)) for doc in documents)
+        pending = ((doc, tasks, self.annotators_needed(doc, tasks))
+                   for doc, tasks in pending if tasks)
+        text_of = lambda item: item[0].text
+        try:
+            # Consecutive documents needing the same annotators go to the same analyser
+            for annotators, group in groupby(pending, key=itemgetter(2)):
+                analyser = self.analyser_for(annotators)
+                for (document, tasks, _), result in analyser.analyse_many(group, text_of):
+                    with timed(PARSING):
+                        analysis = make_analysis(result)
+                    for task in tasks:
+                        task(document, analysis)
+                    yield document
+        finally:
+            self.quit_partial_analyser()
+
+    def annotators_needed(self, document, tasks):
+        """Returns the annotators CoreNLP has to run for the given tasks of the
+        document, or None if all of them are needed"""
+        if tasks == [self.missing_steps_only]:
+            return self.annotators_for(self.missing_steps(document))
+        return None
+
+    def tasks_for(self, document):
+        """Returns the list of methods (each receiving the document, and optionally
+        its analysis) that need to be run for the given document"""
         steps = [
             PreProcessSteps.tokenization,
             PreProcessSteps.sentencer,
@@ -152,25 +282,20 @@ class StanfordPreprocess(BasePreProcessStepRunner):
         if self.override or not steps_done:
             # no matter what's the internal state of the document, or any other option
             # on the StanfordPreprocess, everything need to be run
-            self.run_everything(document)
-        elif steps_done == set(steps):
-            # All steps are already done...
+            return [self.run_everything]
+        elif steps_done.issuperset(self.steps):
+            # All steps (that the configured annotators compute) are already done...
             if self.increment_ner:
-                self.increment_ner_only(document)
+                return [self.increment_ner_only]
+            return []
         else:
             # Dealing with accepting "incremental-running" of preprocess for documents
-            # that were preprocessed with some older version of IEPY.
-
-            # "initial_steps" are the ones added up to version 0.9.1, which (at some point)
-            # were considered "all available steps".
-            initial_steps = steps[:4]
-            all_initials_done = set(initial_steps).issubset(steps_done)
-
-            if all_initials_done:
-                if PreProcessSteps.lemmatization not in steps_done:
-                    self.lemmatization_only(document)
-                if PreProcessSteps.syntactic_parsing not in steps_done:
-                    self.syntactic_parsing_only(document)
+            # that were preprocessed with some older version of IEPY, or with less
+            # CoreNLP annotators configured. Any step but tokenization and
+            # sentences can be added later.
+            segmentation_steps = [PreProcessSteps.tokenization, PreProcessSteps.sentencer]
+            if set(segmentation_steps).issubset(steps_done):
+                return [self.missing_steps_only]
             else:
                 # weird combination of steps done. We can't handle that right now
                 raise NotImplementedError(
@@ -178,8 +303,10 @@ class StanfordPreprocess(BasePreProcessStepRunner):
                     "must be 100% StanfordMultiStepRunner"
                 )
 
-    def run_everything(self, document):
-        analysis = StanfordAnalysis(self.corenlp.analyse(document.text))
+    def run_everything(self, document, analysis=None):
+        if analysis is None:
+            analysis = self.analyse(document)
+        steps = self.steps
 
         # Tokenization
         tokens = analysis.get_tokens()
@@ -187,32 +314,34 @@ class StanfordPreprocess(BasePreProcessStepRunner):
         document.set_tokenization_result(list(zip(offsets, tokens)))
 
         # Lemmatization
-        document.set_lemmatization_result(analysis.get_lemmas())
+        if PreProcessSteps.lemmatization in steps:
+            document.set_lemmatization_result(analysis.get_lemmas())
 
         # "Sentencing" (splitting in sentences)
         document.set_sentencer_result(analysis.get_sentence_boundaries())
 
         # POS tagging
-        document.set_tagging_result(analysis.get_pos())
+        if PreProcessSteps.tagging in steps:
+            document.set_tagging_result(analysis.get_pos())
 
         # Syntactic parsing
-        document.set_syntactic_parsing_result(analysis.get_parse_trees())
+        if PreProcessSteps.syntactic_parsing in steps:
+            document.set_syntactic_parsing_result(analysis.get_parse_trees())
 
         # NER
-        found_entities = analysis.get_found_entities(
-            document.human_identifier, self.gazette_manager
-        )
-        document.set_ner_result(found_entities)
+        if PreProcessSteps.ner in steps:
+            found_entities = analysis.get_found_entities(
+                document.human_identifier, self.gazette_manager
+            )
+            with timed(DATABASE):
+                document.set_ner_result(found_entities, lookups=self.entity_lookups)
 
         # Save progress so far, next step doesn't modify `document`
-        document.save()
+        with timed(DATABASE):
+            document.save()
 
         # Coreference resolution
-        for coref in analysis.get_coreferences():
-            try:
-                apply_coreferences(document, coref)
-            except CoreferenceError as e:
-                logger.warning(e)
+        self.apply_coreferences(document, analysis)
 
 
 def _dict_path(d, *steps):
@@ -363,6 +492,63 @@ class StanfordAnalysis:
         return coreferences
 
 
+class FlatStanfordAnalysis(StanfordAnalysis):
+    """Same as StanfordAnalysis, for the flat analysis data that CoreNLP json
+    output is parsed into"""
+
+    def __init__(self, data):
+        self._data = data
+
+    @property
+    def sentences(self):
+        return self.get_sentences()
+
+    def get_sentences(self):
+        # Only for compatibility, the flat data is used everywhere else
+        result = []
+        boundaries = self._data.sentence_boundaries
+        for start, end in zip(boundaries, boundaries[1:]):
+            result.append([
+                {"word": w, "lemma": l, "POS": p, "NER": n, "CharacterOffsetBegin": o}
+                for w, l, p, n, o in zip(
+                    self._data.tokens[start:end], self._data.lemmas[start:end],
+                    self._data.postags[start:end], self._data.ner[start:end],
+                    self._data.token_offsets[start:end])
+            ])
+        return result
+
+    def get_sentence_boundaries(self):
+        return list(self._data.sentence_boundaries)
+
+    def get_parse_trees(self):
+        return list(self._data.parse_trees)
+
+    def get_tokens(self):
+        return list(self._data.tokens)
+
+    def get_lemmas(self):
+        return list(self._data.lemmas)
+
+    def get_token_offsets(self):
+        return list(self._data.token_offsets)
+
+    def get_pos(self):
+        return list(self._data.postags)
+
+    def get_entity_occurrences(self):
+        return list(self._data.entity_occurrences)
+
+    def get_coreferences(self):
+        return [list(chain) for chain in self._data.coreferences]
+
+
+def make_analysis(data):
+    """Builds the StanfordAnalysis for the output of the CoreNLP analyser"""
+    if isinstance(data, FlatAnalysisData):
+        return FlatStanfordAnalysis(data)
+    return StanfordAnalysis(data)
+
+
 def issues_merging_entities(document, entities):
     # Checks is some general preconditions are met before proceeding to merge some
     # entities on a fiven document
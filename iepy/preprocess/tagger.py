@@ -2,11 +2,12 @@ import os
 import os.path
 import logging
 
-from nltk.tag.stanford import StanfordPOSTagger
 import wget
 
+from iepy.preprocess.java_tagger import JavaTaggerProcess, java_binary
 from iepy.preprocess.pipeline import BasePreProcessStepRunner, PreProcessSteps
-from iepy.utils import DIRS, unzip_file
+from iepy.preprocess.timing import ANALYSER, DATABASE, timed
+from iepy.utils import DIRS, batches, unzip_file
 
 
 logger = logging.getLogger(__name__)
@@ -19,44 +20,101 @@ class TaggerRunner(BasePreProcessStepRunner):
     In order to run, require documents with sentence splitting already done.
     """
     step = PreProcessSteps.tagging
-
-    def __init__(self, postagger, override=False):
-        """override:
+    reads = ("tokens", "lemmas", "postags", "sentences")
+    writes = ("postags", "tagging_done_at")
+
+    def __init__(self, postagger, override=False, batch_size=1):
+        """postagger is called with a list of sentences (each one a list of
+        tokens), and returns each of them as a list of (token, tag).
+        When processing many documents, the sentences of batch_size of them are
+        given to postagger at once.
         """
         self.postagger = postagger
         self.override = override
+        self.batch_size = batch_size
 
-    def __call__(self, doc):
+    def needs_tagging(self, doc):
         if not doc.was_preprocess_step_done(PreProcessSteps.sentencer):
             # cannot proceed if the document wasn't split in senteces
-            return
+            return False
         if not self.override and doc.was_preprocess_step_done(PreProcessSteps.tagging):
-            return
+            return False
+        return True
 
+    def __call__(self, doc):
+        if not self.needs_tagging(doc):
+            return
+        sentences = list(doc.get_sentences())
+        with timed(ANALYSER):
+            tagged_sentences = list(self.postagger(sentences))
+        for doc, doc_tagged in self.tagged_by_document([(doc, sentences)], tagged_sentences):
+            self.store_tags(doc, doc_tagged)
+
+    def tagged_by_document(self, to_tag, tagged_sentences):
+        """Splits the tagged sentences of several documents, given as a list of
+        (document, its sentences). Yields (document, its tagged sentences)."""
+        expected = sum(len(doc_sentences) for _, doc_sentences in to_tag)
+        if len(tagged_sentences) != expected:
+            raise ValueError(
+                "The POS tagger gave {} sentences instead of {}, for documents {}".format(
+                    len(tagged_sentences), expected,
+                    ", ".join(doc.human_identifier for doc, _ in to_tag)))
+        start = 0
+        for doc, doc_sentences in to_tag:
+            end = start + len(doc_sentences)
+            yield doc, tagged_sentences[start:end]
+            start = end
+
+    def store_tags(self, doc, tagged_sentences):
         tagged_doc = []
-        for ts in self.postagger(doc.get_sentences()):
+        for ts in tagged_sentences:
             tagged_doc.extend(tag for token, tag in ts)
 
         assert len(tagged_doc) == len(doc.tokens)
 
         doc.set_tagging_result(tagged_doc)
-        doc.save()
+        with timed(DATABASE):
+            doc.save()
         logger.debug("POS tagged a document")
 
+    def process_documents(self, docs):
+        """Same as calling the runner on each of the documents, but giving the
+        sentences of batch_size documents at once to the postagger.
+        Yields the documents (in the same order) as they are done.
+        """
+        for batch in batches(docs, self.batch_size):
+            to_tag = [(doc, list(doc.get_sentences())) for doc in batch
+                      if self.needs_tagging(doc)]
+            sentences = [sentence for _, doc_sentences in to_tag for sentence in doc_sentences]
+            tagged_sentences = []
+            if sentences:
+                with timed(ANALYSER):
+                    tagged_sentences = list(self.postagger(sentences))
+            for doc, doc_tagged in self.tagged_by_document(to_tag, tagged_sentences):
+                self.store_tags(doc, doc_tagged)
+            yield from batch
+
 
 class StanfordTaggerRunner(TaggerRunner):
+    """Tags with a single Stanford POS tagger process, kept running for all
+    the documents."""
 
-    def __init__(self, override=False):
+    def __init__(self, override=False, batch_size=50):
         tagger_path = os.path.join(DIRS.user_data_dir, stanford_postagger_name)
         if not os.path.exists(tagger_path):
             raise LookupError("Stanford POS tagger not found. Try running the "
                               "command download_third_party_data.py")
 
-        postagger = StanfordPOSTagger(
-            os.path.join(tagger_path, 'models', 'english-bidirectional-distsim.tagger'),
-            os.path.join(tagger_path, 'stanford-postagger.jar'),
-            encoding='utf8')
-        super(StanfordTaggerRunner, self).__init__(postagger.tag_sents, override)
+        self.tagger_process = JavaTaggerProcess([
+            java_binary(), '-mx1000m',
+            '-cp', os.path.join(tagger_path, 'stanford-postagger.jar'),
+            'edu.stanford.nlp.tagger.maxent.MaxentTagger',
+            '-model', os.path.join(tagger_path, 'models', 'english-bidirectional-distsim.tagger'),
+            '-tokenize', 'false', '-sentenceDelimiter', 'newline',
+            '-outputFormat', 'slashTags', '-tagSeparator', '_', '-encoding', 'utf8',
+        ], separator='_')
+        super(StanfordTaggerRunner, self).__init__(
+            self.tagger_process.tag_sents, override, batch_size)
 
 
 def download():
@@ -0,0 +1,122 @@
+"""
+Measuring where the preprocess time goes.
+
+While a PreProcessPipeline runs, the code of the steps marks the phases it goes
+through (waiting for the analyser, parsing its output, storing the results on
+the database) with the `timed` context manager. Times are accumulated for the
+document being processed, and summarized per runner at the end.
+Outside of a pipeline run, `timed` does nothing.
+"""
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ANALYSER = "analyser"
+PARSING = "parsing"
+DATABASE = "database"
+PHASES = (ANALYSER, PARSING, DATABASE)
+
+# The PreprocessTimings collecting the measures, if any
+_collector = None
+
+
+@contextmanager
+def timed(phase):
+    """Adds the time spent in the block to the given phase of the document
+    being preprocessed"""
+    collector = _collector
+    if collector is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        collector.add(phase, time.time() - start)
+
+
+def _tokens_count(document):
+    try:
+        return len(document.tokens or [])
+    except (AttributeError, TypeError):
+        # Not a document (runners may be given anything)
+        return 0
+
+
+class PreprocessTimings:
+    """Time spent by each runner on each document, split in phases.
+
+    When runners work on several documents at once (like sending them to
+    CoreNLP in batches), the time of the whole batch is counted on the
+    document that had to wait for it.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._phases = defaultdict(float)
+        # Phases may be timed from several threads (like an AnalyserPool)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def collecting(self):
+        global _collector
+        previous, _collector = _collector, self
+        try:
+            yield self
+        finally:
+            _collector = previous
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self._phases[phase] += seconds
+
+    def document_done(self, runner, document, seconds):
+        """Records the time spent by runner on document (including the phases
+        timed since the previous document)"""
+        with self._lock:
+            phases, self._phases = self._phases, defaultdict(float)
+        record = OrderedDict([
+            ("runner", runner),
+            ("document", getattr(document, "pk", None)),
+            ("total", seconds),
+            ("tokens", _tokens_count(document)),
+        ])
+        for phase in PHASES:
+            record[phase] = phases.get(phase, 0.0)
+        self.records.append(record)
+
+    def summary(self):
+        """Returns, for each runner, the documents processed, the tokens they
+        have, and the time spent on each phase (plus "other", outside of them)"""
+        result = OrderedDict()
+        for record in self.records:
+            runner = result.setdefault(record["runner"], OrderedDict(
+                [("documents", 0), ("tokens", 0), ("total", 0.0)] +
+                [(phase, 0.0) for phase in PHASES]))
+            runner["documents"] += 1
+            for key in ("tokens", "total") + PHASES:
+                runner[key] += record[key]
+        for runner in result.values():
+            runner["other"] = max(0.0, runner["total"] - sum(runner[p] for p in PHASES))
+            total = runner["total"]
+            runner["tokens_per_second"] = runner["tokens"] / total if total else 0.0
+        return result
+
+    def log_summary(self):
+        for runner, data in self.summary().items():
+            total = data["total"]
+            phases = ", ".join(
+                "{} {:.1f}s ({:.0%})".format(p, data[p], data[p] / total if total else 0)
+                for p in PHASES + ("other",))
+            logger.info("%s: %s documents in %.1fs, %.0f tokens/sec. %s",
+                        runner, data["documents"], total, data["tokens_per_second"], phases)
+
+    def export_json(self, filepath):
+        with open(filepath, "w") as json_file:
+            json.dump({"summary": self.summary(), "documents": self.records},
+                      json_file, indent=2)
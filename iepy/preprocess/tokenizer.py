@@ -5,6 +5,7 @@ import nltk.data
 from nltk.tokenize import RegexpTokenizer
 
 from iepy.preprocess.pipeline import BasePreProcessStepRunner, PreProcessSteps
+from iepy.preprocess.timing import DATABASE, timed
 from iepy.utils import DIRS
 
 
@@ -19,6 +20,9 @@ class TokenizeSentencerRunner(BasePreProcessStepRunner):
     do nothing.
     """
     step = PreProcessSteps.tokenization
+    reads = ("text",)
+    writes = ("tokens", "offsets_to_text", "sentences",
+              "tokenization_done_at", "sentencer_done_at")
 
     def __init__(self, override=False, increment=False, lang='en'):
         if lang != 'en':
@@ -42,7 +46,8 @@ class TokenizeSentencerRunner(BasePreProcessStepRunner):
             doc.set_tokenization_result(
                 list(zip(result['spans'], result['tokens'])))
             doc.set_sentencer_result(result['sentences'])
-            doc.save()
+            with timed(DATABASE):
+                doc.save()
 
 
 def en_tokenize_and_segment(text):
@@ -1,4 +1,5 @@
 from getpass import getuser
+from itertools import islice
 import csv
 import gzip
 import logging
@@ -35,6 +36,21 @@ def unzip(zipped_list, n):
         return zip(*zipped_list)
 
 
+def chunks(items, size):
+    """Splits the given list in consecutive lists of at most size items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def batches(items, size):
+    """Lazily splits the items iterable in lists of (at most) size items"""
+    items = iter(items)
+    batch = list(islice(items, size))
+    while batch:
+        yield batch
+        batch = list(islice(items, size))
+
+
 def unzip_from_url(zip_url, extraction_base_path):
     got_zipfile = None
     try:
@@ -89,7 +105,7 @@ def evaluate(predicted_knowledge, gold_knowledge):
     return result
 
 
-def csv_to_iepy(filepath):
+def csv_to_iepy(filepath, link_duplicates=False):
     print ('Importing Documents to IEPY from {}'.format(filepath))
     from iepy.data.db import DocumentManager
 
@@ -130,6 +146,7 @@ def csv_to_iepy(filepath):
             identifier=doc_id,
             text=d["document_text"],
             metadata={"input_filename": name},
-            update_mode=True
+            update_mode=True,
+            link_duplicates=link_duplicates
         )
         print ('Added {} documents'.format(i))
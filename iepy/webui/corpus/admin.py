@@ -31,6 +31,7 @@ class EntityAdmin(admin.ModelAdmin):
 
 @admin.register(IEDocumentMetadata)
 class IEDocumentMetadataAdmin(admin.ModelAdmin):
+    raw_id_fields = ['duplicate_of']
 
     def has_delete_permission(self, request, obj=None):
         return False
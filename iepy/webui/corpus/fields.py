@@ -1,6 +1,13 @@
 import ast
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from itertools import accumulate
 
 from nltk.tree import Tree
+from django import forms
 from django.db import models
 
 
@@ -30,26 +37,112 @@ class ListField(models.TextField, metaclass=models.SubfieldBase):
         return self.get_db_prep_value(value)
 
 
+class LazyTreeList(Sequence):
+    """Sequence of syntactic trees that keeps the bracketed strings as loaded
+    from the database, and parses each tree only when it's accessed.
+
+    If cache_size is None, every parsed tree is kept. Otherwise, only the
+    cache_size most recently accessed ones are.
+    """
+
+    def __init__(self, raw_trees, cache_size=None):
+        self.raw_trees = list(raw_trees)
+        self.cache_size = cache_size
+        self._parsed = OrderedDict()
+
+    def __len__(self):
+        return len(self.raw_trees)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        try:
+            tree = self._parsed[index]
+        except KeyError:
+            tree = self.raw_trees[index]
+            if isinstance(tree, str):
+                tree = Tree.fromstring(tree)
+            self._parsed[index] = tree
+            if self.cache_size is not None and len(self._parsed) > self.cache_size:
+                self._parsed.popitem(last=False)
+        else:
+            self._parsed.move_to_end(index)
+        return tree
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "<LazyTreeList of {} trees>".format(len(self))
+
+    def sublist(self, indices):
+        """Lazy view of the trees on the given indices"""
+        return LazyTreeSubList(self, indices)
+
+
+class LazyTreeSubList(Sequence):
+    """Lazy view of some of the trees of a LazyTreeList, sharing its cache"""
+
+    def __init__(self, parent, indices):
+        self.parent = parent
+        self.indices = list(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.parent[self.indices[index]]
+
+    def __eq__(self, other):
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+
+def select_trees(trees, indices):
+    """Picks the trees on the given indices, without parsing them if possible"""
+    if isinstance(trees, LazyTreeList):
+        return trees.sublist(indices)
+    return [trees[i] for i in indices]
+
+
 class ListSyntacticTreeField(models.TextField, metaclass=models.SubfieldBase):
     description = "List of Stanford syntactic tree"
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, tree_cache_size=None, **kwargs):
+        self.tree_cache_size = tree_cache_size
         super().__init__(*args, **kwargs)
 
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.tree_cache_size is not None:
+            kwargs['tree_cache_size'] = self.tree_cache_size
+        return name, path, args, kwargs
+
     def to_python(self, value):
         if not value:
             value = []
 
-        if isinstance(value, list):
+        if isinstance(value, (list, LazyTreeList)):
             return value
 
         xs = ast.literal_eval(value)
-        return [Tree.fromstring(x) for x in xs]
+        return LazyTreeList(xs, cache_size=self.tree_cache_size)
 
     def get_prep_value(self, value):
         if value is None:
             return value
 
+        if isinstance(value, LazyTreeList):
+            # No need to parse the trees just for storing them back
+            return str([str(x) for x in value.raw_trees])
+
         if isinstance(value, list):
             return str([str(x) for x in value])
 
@@ -58,3 +151,145 @@ class ListSyntacticTreeField(models.TextField, metaclass=models.SubfieldBase):
     def value_to_string(self, obj):
         value = self._get_val_from_obj(obj)
         return self.get_db_prep_value(value)
+
+
+# Compact binary storage for the per-token lists of documents.
+#
+# Ints are stored as a little-endian array of 32 bits integers.
+# Strings are stored as a table: the number of items, followed by an array
+# with the length (in characters) of each of them, followed by all of them
+# concatenated and utf8 encoded. That way, decoding is a single buffer decode
+# plus slicing, instead of running a python parser as ListField does.
+#
+# Values stored with the old text representation (the python literal of the
+# list) are still readable, which is what allows migrating existent databases.
+
+_INT_LIST_HEADER = b"IEPY:i1"
+_STR_LIST_HEADER = b"IEPY:s1"
+_COUNT = struct.Struct("<I")
+
+
+def _int_array(values=()):
+    arr = array("i", values)
+    assert arr.itemsize == 4, "Compact lists require 4 bytes C ints"
+    return arr
+
+
+def _array_to_bytes(arr):
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _array_from_bytes(data):
+    arr = _int_array()
+    arr.frombytes(data)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def encode_int_list(values):
+    return _INT_LIST_HEADER + _array_to_bytes(_int_array(values))
+
+
+def decode_int_list(data):
+    return _array_from_bytes(data[len(_INT_LIST_HEADER):]).tolist()
+
+
+def encode_str_list(values):
+    lengths = _int_array(len(x) for x in values)
+    return b"".join([
+        _STR_LIST_HEADER,
+        _COUNT.pack(len(lengths)),
+        _array_to_bytes(lengths),
+        "".join(values).encode("utf8"),
+    ])
+
+
+def decode_str_list(data):
+    start = len(_STR_LIST_HEADER)
+    count, = _COUNT.unpack_from(data, start)
+    start += _COUNT.size
+    end = start + count * 4
+    ends = list(accumulate(_array_from_bytes(data[start:end])))
+    text = data[end:].decode("utf8")
+    starts = [0] + ends[:-1]
+    return [text[i:j] for i, j in zip(starts, ends)]
+
+
+class _CompactListField(models.Field, metaclass=models.SubfieldBase):
+    """Base for list fields stored as binary blobs.
+    Subclasses must define header, encode and decode.
+    """
+    header = None
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def encode(self, value):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def to_python(self, value):
+        if not value:
+            return []
+
+        if isinstance(value, (list, tuple)):
+            return list(value)
+
+        if isinstance(value, memoryview):
+            value = value.tobytes()
+        if isinstance(value, (bytes, bytearray)):
+            if value.startswith(self.header):
+                return self.decode(bytes(value))
+            # Old text representation, stored on a binary column
+            value = value.decode("utf8")
+
+        return list(ast.literal_eval(value))
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+
+        return self.encode(self.to_python(value))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        if value is not None:
+            return connection.Database.Binary(value)
+        return value
+
+    def value_to_string(self, obj):
+        # Serialized with the same text representation than ListField, which is
+        # also accepted when loading.
+        return str(self._get_val_from_obj(obj))
+
+    def formfield(self, **kwargs):
+        defaults = {'widget': forms.Textarea}
+        defaults.update(kwargs)
+        return super().formfield(**defaults)
+
+
+class IntListField(_CompactListField):
+    description = "List of integers, stored as a binary array"
+    header = _INT_LIST_HEADER
+
+    def encode(self, value):
+        return encode_int_list(value)
+
+    def decode(self, data):
+        return decode_int_list(data)
+
+
+class StringListField(_CompactListField):
+    description = "List of strings, stored as a binary string table"
+    header = _STR_LIST_HEADER
+
+    def encode(self, value):
+        return encode_str_list(value)
+
+    def decode(self, data):
+        return decode_str_list(data)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import corpus.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corpus', '0017_auto_20150302_1916'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iedocument',
+            name='tokens_compact',
+            field=corpus.fields.StringListField(blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='iedocument',
+            name='lemmas_compact',
+            field=corpus.fields.StringListField(blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='iedocument',
+            name='postags_compact',
+            field=corpus.fields.StringListField(blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='iedocument',
+            name='offsets_to_text_compact',
+            field=corpus.fields.IntListField(blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='iedocument',
+            name='sentences_compact',
+            field=corpus.fields.IntListField(blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import logging
+
+from django.db import models, migrations
+
+
+logging.basicConfig(format="%(asctime)-15s  %(message)s")
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.INFO)
+
+BULK_SIZE = 2500
+LIST_FIELDS = ['tokens', 'lemmas', 'postags', 'offsets_to_text', 'sentences']
+
+
+def move_lists_to_compact_fields(apps, schema_editor):
+    IEDocument = apps.get_model('corpus', 'IEDocument')
+
+    documents = IEDocument.objects.all()
+    total = documents.count()
+    compact_fields = ['{}_compact'.format(fname) for fname in LIST_FIELDS]
+    logger.info("Converting documents lists to compact storage")
+    for i, document in enumerate(documents.iterator()):
+        if i % BULK_SIZE == 0:
+            logger.info("Converted {} out of {}".format(i, total))
+        for fname, compact_fname in zip(LIST_FIELDS, compact_fields):
+            setattr(document, compact_fname, getattr(document, fname))
+        document.save(update_fields=compact_fields)
+    logger.info("Converted {} out of {}".format(total, total))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corpus', '0018_add_compact_list_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_lists_to_compact_fields),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corpus', '0019_data_migration_compact_lists'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='iedocument',
+            name='tokens',
+        ),
+        migrations.RemoveField(
+            model_name='iedocument',
+            name='lemmas',
+        ),
+        migrations.RemoveField(
+            model_name='iedocument',
+            name='postags',
+        ),
+        migrations.RemoveField(
+            model_name='iedocument',
+            name='offsets_to_text',
+        ),
+        migrations.RemoveField(
+            model_name='iedocument',
+            name='sentences',
+        ),
+        migrations.RenameField(
+            model_name='iedocument',
+            old_name='tokens_compact',
+            new_name='tokens',
+        ),
+        migrations.RenameField(
+            model_name='iedocument',
+            old_name='lemmas_compact',
+            new_name='lemmas',
+        ),
+        migrations.RenameField(
+            model_name='iedocument',
+            old_name='postags_compact',
+            new_name='postags',
+        ),
+        migrations.RenameField(
+            model_name='iedocument',
+            old_name='offsets_to_text_compact',
+            new_name='offsets_to_text',
+        ),
+        migrations.RenameField(
+            model_name='iedocument',
+            old_name='sentences_compact',
+            new_name='sentences',
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+import corpus.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('corpus', '0020_replace_text_lists_with_compact_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iedocumentmetadata',
+            name='minhash',
+            field=corpus.fields.IntListField(blank=True, editable=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='iedocumentmetadata',
+            name='duplicate_of',
+            field=models.ForeignKey(related_name='near_duplicates', on_delete=django.db.models.deletion.SET_NULL, blank=True, null=True, to='corpus.IEDocument'),
+            preserve_default=True,
+        ),
+        migrations.CreateModel(
+            name='MinHashBand',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('band', models.IntegerField()),
+                ('bucket', models.BigIntegerField()),
+                ('document', models.ForeignKey(related_name='minhash_bands', to='corpus.IEDocument')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='minhashband',
+            index_together=set([('band', 'bucket')]),
+        ),
+    ]
@@ -0,0 +1,62 @@
+"""
+Compares the time spent splitting the CoreNLP shell output by prompts, with the
+previous reader (growing a bytes buffer, searching all of it on each read) and
+the current one (iepy.preprocess.corenlp_output.iter_segments), on synthetic
+big outputs.
+
+Usage:
+    benchmark_corenlp_framing.py [options]
+    benchmark_corenlp_framing.py -h | --help
+
+Options:
+  --megabytes=<n>     Size of each output [default: 2]
+  --outputs=<n>       Number of outputs [default: 2]
+  -h --help           Show this screen
+"""
+import io
+import time
+
+from docopt import docopt
+
+from iepy.preprocess.corenlp_output import iter_segments
+
+PROMPT = b"\nNLP> "
+
+
+def previous_iter_segments(read):
+    # How outputs were split before, reading 1kb at a time
+    while True:
+        buf = b""
+        while PROMPT not in buf:
+            chunk = read(1024)
+            if not chunk:
+                return
+            buf += chunk
+        segment, _, buf = buf.partition(PROMPT)
+        yield segment.decode("utf8")
+
+
+def timed(split, data, outputs):
+    stream = io.BytesIO(data)
+    start = time.time()
+    segments = split(stream.read1)
+    for _ in range(outputs):
+        next(segments, None)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    opts = docopt(__doc__)
+    outputs = int(opts["--outputs"])
+    size = int(float(opts["--megabytes"]) * 1024 * 1024)
+    line = b"<token><word>word</word><NER>O</NER></token>\n"
+    output = line * (size // len(line))
+    data = (output + PROMPT) * outputs
+
+    read_size = 64 * 1024
+    current = timed(lambda read: iter_segments(lambda: read(read_size), PROMPT),
+                    data, outputs)
+    previous = timed(previous_iter_segments, data, outputs)
+    print("{} outputs of {:.1f}MB".format(outputs, len(output) / 1024 / 1024))
+    print("previous: {:8.3f} secs".format(previous))
+    print(" current: {:8.3f} secs ({:.0f}x faster)".format(current, previous / current))
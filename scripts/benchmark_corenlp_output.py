@@ -0,0 +1,99 @@
+"""
+Compares the time spent reading CoreNLP xml and json outputs (parsing them and
+extracting tokens, lemmas, POS, offsets, entities and sentences as the
+preprocess does), on synthetic outputs of big documents.
+
+Usage:
+    benchmark_corenlp_output.py [options]
+    benchmark_corenlp_output.py -h | --help
+
+Options:
+  --sentences=<n>     Sentences of the document [default: 2000]
+  --tokens=<n>        Tokens per sentence [default: 25]
+  --repeat=<n>        Times each parser is run [default: 3]
+  -h --help           Show this screen
+"""
+import json
+import time
+
+from docopt import docopt
+
+import iepy
+iepy.setup()
+
+from iepy.preprocess.corenlp_output import parse_json_output, parse_xml_output
+from iepy.preprocess.stanford_preprocess import make_analysis
+
+
+def synthetic_tokens(sentences, tokens):
+    offset = 0
+    for i in range(sentences):
+        sentence = []
+        for j in range(tokens):
+            word = "word{}".format(j)
+            ner = "PERSON" if j % 10 < 2 else "O"
+            sentence.append((word, ner, offset))
+            offset += len(word) + 1
+        yield sentence
+
+
+def xml_output(sentences, tokens):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<root><document><sentences>']
+    for i, sentence in enumerate(synthetic_tokens(sentences, tokens)):
+        parts.append('<sentence id="{}"><tokens>'.format(i + 1))
+        for j, (word, ner, offset) in enumerate(sentence):
+            parts.append(
+                '<token id="{}"><word>{w}</word><lemma>{w}</lemma>'
+                '<CharacterOffsetBegin>{o}</CharacterOffsetBegin>'
+                '<CharacterOffsetEnd>{e}</CharacterOffsetEnd>'
+                '<POS>NN</POS><NER>{n}</NER></token>'.format(
+                    j + 1, w=word, o=offset, e=offset + len(word), n=ner))
+        parts.append('</tokens><parse>(ROOT (NN x))</parse></sentence>')
+    parts.append('</sentences></document></root>')
+    return "".join(parts)
+
+
+def json_output(sentences, tokens):
+    data = {"sentences": [{
+        "index": i,
+        "parse": "(ROOT (NN x))",
+        "tokens": [{
+            "index": j + 1, "word": word, "lemma": word,
+            "characterOffsetBegin": offset, "characterOffsetEnd": offset + len(word),
+            "pos": "NN", "ner": ner,
+        } for j, (word, ner, offset) in enumerate(sentence)]
+    } for i, sentence in enumerate(synthetic_tokens(sentences, tokens))]}
+    return json.dumps(data, indent=2)
+
+
+def read_analysis(parser, output):
+    analysis = make_analysis(parser(output))
+    analysis.get_tokens()
+    analysis.get_lemmas()
+    analysis.get_pos()
+    analysis.get_token_offsets()
+    analysis.get_sentence_boundaries()
+    analysis.get_parse_trees()
+    analysis.get_found_entities("doc")
+    analysis.get_coreferences()
+
+
+def best_time(parser, output, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        read_analysis(parser, output)
+        times.append(time.time() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    opts = docopt(__doc__)
+    sentences = int(opts["--sentences"])
+    tokens = int(opts["--tokens"])
+    repeat = int(opts["--repeat"])
+    print("Document of {} tokens".format(sentences * tokens))
+    xml_time = best_time(parse_xml_output, xml_output(sentences, tokens), repeat)
+    json_time = best_time(parse_json_output, json_output(sentences, tokens), repeat)
+    print(" xml: {:8.3f} secs".format(xml_time))
+    print("json: {:8.3f} secs ({:.1f}x faster)".format(json_time, xml_time / json_time))
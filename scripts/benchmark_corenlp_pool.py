@@ -0,0 +1,46 @@
+"""
+Measures the throughput of the CoreNLP analysers pool for different amounts
+of workers, using stub analysers (no Java needed) that take a fixed time per
+call (one document, or one batch of them).
+
+Usage:
+    benchmark_corenlp_pool.py [options]
+    benchmark_corenlp_pool.py -h | --help
+
+Options:
+  --documents=<n>      Number of documents to analyse [default: 200]
+  --delay=<seconds>    Time spent by each analysis [default: 0.02]
+  --max-workers=<n>    Benchmark from 1 up to this many workers [default: 8]
+  --batch-size=<n>     Documents sent together to each analyser [default: 1]
+  -h --help            Show this screen
+"""
+import time
+
+from docopt import docopt
+
+from iepy.preprocess.corenlp_pool import AnalyserPool, StubAnalyser
+
+
+def benchmark(workers, documents, delay, batch_size):
+    pool = AnalyserPool((StubAnalyser(delay=delay) for _ in range(workers)),
+                        batch_size=batch_size)
+    texts = ["Document number {}. It has two sentences.".format(i)
+             for i in range(documents)]
+    start = time.time()
+    for _ in pool.analyse_many(texts):
+        pass
+    elapsed = time.time() - start
+    pool.quit()
+    return elapsed
+
+
+if __name__ == "__main__":
+    opts = docopt(__doc__)
+    documents = int(opts["--documents"])
+    delay = float(opts["--delay"])
+    batch_size = int(opts["--batch-size"])
+    workers = 1
+    while workers <= int(opts["--max-workers"]):
+        elapsed = benchmark(workers, documents, delay, batch_size)
+        print("{:>3} workers: {:8.2f} docs/sec".format(workers, documents / elapsed))
+        workers *= 2
@@ -0,0 +1,68 @@
+"""Builders of (simplified) Stanford CoreNLP outputs, in xml and json formats"""
+import json
+from xml.sax.saxutils import escape
+
+
+def _sentences_tokens(sentences):
+    # sentences: list of lists of (word, ner). Returns the same with char offsets
+    offset = 0
+    result = []
+    for sentence in sentences:
+        tokens = []
+        for word, ner in sentence:
+            tokens.append((word, ner, offset))
+            offset += len(word) + 1
+        result.append(tokens)
+    return result
+
+
+def xml_output(sentences, corefs=()):
+    """corefs: list of chains, each a list of (sentence, start, end, head), as
+    numbered by CoreNLP (from 1)"""
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<root><document><sentences>']
+    for i, tokens in enumerate(_sentences_tokens(sentences)):
+        parts.append('<sentence id="{}"><tokens>'.format(i + 1))
+        for j, (word, ner, offset) in enumerate(tokens):
+            parts.append(
+                '<token id="{}"><word>{w}</word><lemma>{l}</lemma>'
+                '<CharacterOffsetBegin>{o}</CharacterOffsetBegin>'
+                '<CharacterOffsetEnd>{e}</CharacterOffsetEnd>'
+                '<POS>NN</POS><NER>{n}</NER></token>'.format(
+                    j + 1, w=escape(word), l=escape(word.lower()), o=offset,
+                    e=offset + len(word), n=ner))
+        parts.append('</tokens><parse>(ROOT (NN x{}))</parse></sentence>'.format(i))
+    parts.append('</sentences>')
+    if corefs:
+        parts.append('<coreference>')
+        for chain in corefs:
+            parts.append('<coreference>')
+            for k, (sentence, start, end, head) in enumerate(chain):
+                parts.append(
+                    '<mention{}><sentence>{}</sentence><start>{}</start><end>{}</end>'
+                    '<head>{}</head></mention>'.format(
+                        ' representative="true"' if k == 0 else '',
+                        sentence, start, end, head))
+            parts.append('</coreference>')
+        parts.append('</coreference>')
+    parts.append('</document></root>')
+    return "".join(parts)
+
+
+def json_output(sentences, corefs=()):
+    data = {"sentences": [], "corefs": {}}
+    for i, tokens in enumerate(_sentences_tokens(sentences)):
+        data["sentences"].append({
+            "index": i,
+            "parse": "(ROOT (NN x{}))".format(i),
+            "tokens": [{
+                "index": j + 1, "word": word, "lemma": word.lower(),
+                "characterOffsetBegin": offset, "characterOffsetEnd": offset + len(word),
+                "pos": "NN", "ner": ner,
+            } for j, (word, ner, offset) in enumerate(tokens)]
+        })
+    for c, chain in enumerate(corefs):
+        data["corefs"][str(c + 1)] = [{
+            "sentNum": sentence, "startIndex": start, "endIndex": end,
+            "headIndex": head, "isRepresentativeMention": k == 0,
+        } for k, (sentence, start, end, head) in enumerate(chain)]
+    return json.dumps(data, indent=2)
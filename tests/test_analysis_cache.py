@@ -0,0 +1,73 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+from iepy.preprocess.analysis_cache import AnalysisCache, CachedAnalyser
+from iepy.preprocess.corenlp_pool import AnalyserPool, StubAnalyser
+
+
+class TestAnalysisCache(TestCase):
+
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.filepath = os.path.join(folder, "cache.sqlite3")
+
+    def test_stored_analysis_is_returned(self):
+        cache = AnalysisCache(self.filepath, 10 ** 6)
+        key = cache.key("Some text.", "v1")
+        self.assertIsNone(cache.get(key))
+        cache.put(key, {"tokens": ["Some", "text", "."]})
+        self.assertEqual(AnalysisCache(self.filepath, 10 ** 6).get(key),
+                         {"tokens": ["Some", "text", "."]})
+
+    def test_key_depends_on_text_and_fingerprint(self):
+        keys = {AnalysisCache.key("Some text.", "v1"), AnalysisCache.key("Some text.", "v2"),
+                AnalysisCache.key("Other text.", "v1")}
+        self.assertEqual(len(keys), 3)
+
+    def test_least_recently_used_are_evicted_when_full(self):
+        analysis = list(range(100))
+        cache = AnalysisCache(self.filepath, 10 ** 6)
+        cache.put("probe", analysis)
+        item_size = cache.size()
+        cache = AnalysisCache(self.filepath, item_size * 3)
+        cache.put("a", analysis)
+        cache.put("b", analysis)
+        cache.get("probe")
+        cache.get("a")
+        cache.put("c", analysis)  # over the limit: "b" is the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertLessEqual(cache.size(), item_size * 3)
+        self.assertIsNotNone(cache.get("c"))
+
+
+class TestCachedAnalyser(TestCase):
+
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.cache = AnalysisCache(os.path.join(folder, "cache.sqlite3"), 10 ** 7)
+        self.stub = StubAnalyser()
+
+    def test_texts_are_analysed_once(self):
+        analyser = CachedAnalyser(self.stub, self.cache, "v1")
+        first = analyser.analyse("Some text.")
+        self.assertEqual(analyser.analyse("Some text."), first)
+        self.assertEqual(self.stub.analysed, 1)
+        CachedAnalyser(self.stub, self.cache, "v2").analyse("Some text.")
+        self.assertEqual(self.stub.analysed, 2)
+
+    def test_only_missing_texts_are_sent_in_analyse_many(self):
+        analyser = CachedAnalyser(AnalyserPool([self.stub], batch_size=2), self.cache, "v1")
+        analyser.analyse("Text 2.")
+        texts = ["Text {}.".format(i) for i in range(5)] + ["Text 0."]
+        result = list(analyser.analyse_many(texts))
+        self.assertEqual([item for item, _ in result], texts)
+        self.assertEqual(result[0][1], result[-1][1])
+        # "Text 2." was cached before, and "Text 0." is sent once
+        self.assertEqual(self.stub.analysed, 1 + 4)
+        self.assertEqual(result[3][1], StubAnalyser().analyse("Text 3."))
+        list(analyser.analyse_many(texts))
+        self.assertEqual(self.stub.analysed, 1 + 4)
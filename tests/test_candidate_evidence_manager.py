@@ -0,0 +1,233 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from iepy.data.db import CandidateEvidenceManager
+from iepy.data.models import EvidenceCandidate, EvidenceLabel
+from .factories import (
+    EntityKindFactory, EntityOccurrenceFactory, IEDocFactory,
+    RelationFactory, TextSegmentFactory,
+)
+from .manager_case import ManagerTestCase
+
+
+class BaseCandidatesTestCase(ManagerTestCase):
+
+    def setUp(self):
+        self.k_person = EntityKindFactory(name='person')
+        self.k_location = EntityKindFactory(name='location')
+        self.relation = RelationFactory(
+            left_entity_kind=self.k_person,
+            right_entity_kind=self.k_location
+        )
+
+    def create_segment(self, kinds):
+        # Creates a document with a single segment, having one entity occurrence
+        # (one token long) of each of the given kinds
+        tokens = ["tkn{}".format(i) for i in range(len(kinds) + 2)]
+        doc = IEDocFactory(text=" ".join(tokens))
+        doc.set_tokenization_result(list(enumerate(tokens)))
+        doc.set_sentencer_result([0, len(tokens)])
+        doc.save()
+        segment = TextSegmentFactory(document=doc, offset=0, offset_end=len(tokens))
+        for i, kind in enumerate(kinds):
+            eo = EntityOccurrenceFactory(
+                document=doc, entity__kind=kind, offset=i, offset_end=i + 1)
+            eo.segments.add(segment)
+        return segment
+
+
+class TestCandidatesForRelation(BaseCandidatesTestCase):
+
+    def test_documents_are_fetched_in_batches(self):
+        docs = [self.create_segment([self.k_person]).document for i in range(5)]
+        doc_ids = [d.id for d in docs]
+        with self.assertNumQueries(3):
+            batches = list(CandidateEvidenceManager.documents_in_batches(
+                doc_ids, batch_size=2))
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+        self.assertEqual(sorted(d.id for b in batches for d in b), doc_ids)
+
+    def test_all_candidates_are_loaded_no_matter_batch_size(self):
+        for i in range(5):
+            self.create_segment([self.k_person, self.k_location])
+        for batch_size in [1, 2, 100]:
+            candidates = list(CandidateEvidenceManager.candidates_for_relation(
+                self.relation, documents_batch_size=batch_size))
+            self.assertEqual(len(candidates), 5)
+            self.assertEqual(EvidenceCandidate.objects.count(), 5)
+
+    def test_deferred_syntactic_trees_are_not_hydrated(self):
+        self.create_segment([self.k_person, self.k_location])
+        candidates = list(CandidateEvidenceManager.candidates_for_relation(
+            self.relation, defer_document_fields=['syntactic_sentences']))
+        self.assertEqual(len(candidates), 1)
+        segment = candidates[0].segment
+        self.assertIsNone(segment.syntactic_sentences)
+        self.assertEqual(segment.tokens, ["tkn0", "tkn1", "tkn2", "tkn3"])
+
+
+class TestConstructMissingCandidates(BaseCandidatesTestCase):
+
+    def test_missing_candidates_are_created_once(self):
+        for i in range(5):
+            self.create_segment([self.k_person, self.k_location, self.k_location])
+        candidates = list(CandidateEvidenceManager.candidates_for_relation(self.relation))
+        self.assertEqual(len(candidates), 10)
+        self.assertEqual(EvidenceCandidate.objects.count(), 10)
+        self.assertEqual(len(set(c.pk for c in candidates)), 10)
+        again = list(CandidateEvidenceManager.candidates_for_relation(self.relation))
+        self.assertEqual(EvidenceCandidate.objects.count(), 10)
+        self.assertEqual([c.pk for c in candidates], [c.pk for c in again])
+
+    def test_existent_candidates_are_preserved(self):
+        segment = self.create_segment([self.k_person, self.k_location, self.k_location])
+        existent = next(segment.get_evidences_for_relation(self.relation))
+        candidates = list(CandidateEvidenceManager.candidates_for_relation(self.relation))
+        self.assertEqual(len(candidates), 2)
+        self.assertIn(existent.pk, [c.pk for c in candidates])
+
+    def test_same_candidates_than_one_by_one_creation(self):
+        segments = [self.create_segment([self.k_person, self.k_location, self.k_person])
+                    for i in range(3)]
+        candidates = list(CandidateEvidenceManager.candidates_for_relation(self.relation))
+        expected = []
+        for segment in segments:
+            expected.extend(segment.get_evidences_for_relation(self.relation))
+        self.assertEqual(EvidenceCandidate.objects.count(), len(expected))
+        self.assertEqual(sorted(c.pk for c in candidates), sorted(e.pk for e in expected))
+
+    def test_queries_do_not_grow_with_the_number_of_candidates(self):
+        for i in range(10):
+            self.create_segment([self.k_person, self.k_location, self.k_location])
+        segments = list(self.relation._matching_text_segments())
+        with self.assertNumQueries(3):
+            # entity occurrences, bulk insert, and reading back the candidates
+            result = CandidateEvidenceManager.construct_missing_candidates(
+                self.relation, segments, defaultdict(list))
+        self.assertEqual(sum(len(ecs) for ecs in result.values()), 20)
+
+
+class TestCandidatePagesForRelation(BaseCandidatesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.segments = [
+            self.create_segment([self.k_person, self.k_location]) for i in range(5)]
+
+    def test_pages_walk_segments_in_id_order(self):
+        pages = list(CandidateEvidenceManager.candidate_pages_for_relation(
+            self.relation, page_size=2))
+        self.assertEqual([len(evidences) for evidences, cursor in pages], [2, 2, 1])
+        segment_ids = [ev.segment.id for evidences, cursor in pages for ev in evidences]
+        self.assertEqual(segment_ids, sorted(s.id for s in self.segments))
+        self.assertEqual([cursor for evidences, cursor in pages],
+                         [segment_ids[1], segment_ids[3], segment_ids[4]])
+
+    def test_same_candidates_than_non_streaming_version(self):
+        streamed = [ev.pk for evidences, cursor in
+                    CandidateEvidenceManager.candidate_pages_for_relation(
+                        self.relation, page_size=3)
+                    for ev in evidences]
+        loaded = [ev.pk for ev in CandidateEvidenceManager.candidates_for_relation(
+            self.relation)]
+        self.assertEqual(sorted(streamed), sorted(loaded))
+
+    def test_walk_can_be_resumed_from_cursor(self):
+        pages = CandidateEvidenceManager.candidate_pages_for_relation(
+            self.relation, page_size=2)
+        first_evidences, cursor = next(pages)
+        resumed = list(CandidateEvidenceManager.candidate_pages_for_relation(
+            self.relation, page_size=2, start_after_segment=cursor))
+        resumed_ids = [ev.segment.id for evidences, c in resumed for ev in evidences]
+        self.assertEqual(len(resumed_ids), 3)
+        self.assertTrue(all(segment_id > cursor for segment_id in resumed_ids))
+
+    def test_evidences_are_hydrated(self):
+        evidences, cursor = next(CandidateEvidenceManager.candidate_pages_for_relation(
+            self.relation))
+        for evidence in evidences:
+            self.assertEqual(evidence.segment.tokens, ["tkn0", "tkn1", "tkn2", "tkn3"])
+            self.assertEqual(len(evidence.all_eos), 2)
+
+
+class TestLabelsFor(BaseCandidatesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for i in range(3):
+            self.create_segment([self.k_person, self.k_location])
+        self.evidences = list(CandidateEvidenceManager.candidates_for_relation(
+            self.relation))
+        self.base_date = datetime(2015, 1, 1)
+
+    def label(self, evidence, label, judge, days=0, by_machine=False):
+        el = EvidenceLabel.objects.create(
+            evidence_candidate=evidence, label=label, judge=judge,
+            relation=self.relation, labeled_by_machine=by_machine)
+        # auto_now can only be skipped with an update
+        EvidenceLabel.objects.filter(pk=el.pk).update(
+            modification_date=self.base_date + timedelta(days=days))
+
+    def test_labels_without_conflicts(self):
+        e1, e2, e3 = self.evidences
+        self.label(e1, EvidenceLabel.YESRELATION, "alice")
+        self.label(e2, EvidenceLabel.NORELATION, "alice")
+        self.label(e2, EvidenceLabel.NORELATION, "bob")
+        self.label(e3, EvidenceLabel.NONSENSE, "alice")
+        labels = CandidateEvidenceManager.labels_for(self.relation, self.evidences)
+        self.assertEqual(labels, {e1: True, e2: False, e3: None})
+
+    def test_machine_labels_are_ignored(self):
+        e1 = self.evidences[0]
+        self.label(e1, EvidenceLabel.YESRELATION, "iepy", by_machine=True)
+        labels = CandidateEvidenceManager.labels_by_evidence_id(self.relation)
+        self.assertEqual(labels, {})
+
+    def test_conflicts_are_unsolved_without_solver(self):
+        e1 = self.evidences[0]
+        self.label(e1, EvidenceLabel.YESRELATION, "alice")
+        self.label(e1, EvidenceLabel.NORELATION, "bob")
+        labels = CandidateEvidenceManager.labels_for(self.relation, self.evidences)
+        self.assertIsNone(labels[e1])
+
+    def test_newest_wins(self):
+        e1, e2, e3 = self.evidences
+        self.label(e1, EvidenceLabel.YESRELATION, "alice", days=2)
+        self.label(e1, EvidenceLabel.NORELATION, "bob", days=1)
+        self.label(e2, EvidenceLabel.YESRELATION, "alice", days=1)
+        self.label(e2, EvidenceLabel.NORELATION, "bob", days=2)
+        solver = CandidateEvidenceManager.conflict_resolution_newest_wins
+        labels = CandidateEvidenceManager.labels_by_evidence_id(self.relation, solver)
+        self.assertEqual(labels, {e1.pk: True, e2.pk: False})
+
+    def test_judge_priority(self):
+        e1, e2, e3 = self.evidences
+        self.label(e1, EvidenceLabel.YESRELATION, "alice", days=1)
+        self.label(e1, EvidenceLabel.NORELATION, "bob", days=2)
+        self.label(e2, EvidenceLabel.YESRELATION, "carol")
+        self.label(e2, EvidenceLabel.NORELATION, "dave")
+        solver = CandidateEvidenceManager.conflict_resolution_by_judge_name(
+            ["alice", "bob"])
+        labels = CandidateEvidenceManager.labels_by_evidence_id(self.relation, solver)
+        self.assertEqual(labels, {e1.pk: True})
+
+    def test_labels_are_loaded_in_a_single_query(self):
+        for evidence in self.evidences:
+            self.label(evidence, EvidenceLabel.YESRELATION, "alice", days=1)
+            self.label(evidence, EvidenceLabel.NORELATION, "bob", days=2)
+        solver = CandidateEvidenceManager.conflict_resolution_newest_wins
+        with self.assertNumQueries(1):
+            labels = CandidateEvidenceManager.labels_for(
+                self.relation, self.evidences, solver)
+        self.assertEqual(set(labels.values()), {False})
+
+    def test_only_labeled_evidences_are_loaded(self):
+        e1, e2, e3 = self.evidences
+        self.label(e1, EvidenceLabel.YESRELATION, "alice")
+        self.label(e3, EvidenceLabel.NORELATION, "alice")
+        labels = CandidateEvidenceManager.labels_by_evidence_id(self.relation)
+        evidences = CandidateEvidenceManager.labeled_evidences(self.relation, labels)
+        self.assertEqual(evidences, {e1: True, e3: False})
+        for evidence in evidences:
+            self.assertEqual(evidence.segment.tokens, ["tkn0", "tkn1", "tkn2", "tkn3"])
+            self.assertEqual(len(evidence.all_eos), 2)
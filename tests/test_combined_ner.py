@@ -61,7 +61,8 @@ class TestCombinedNERRunner(BaseTestCombined):
 
         runner = CombinedNERRunner([runner1, runner2])
         runner(doc)
-        doc.set_ner_result.assert_called_once_with([e1, e2])
+        doc.set_ner_result.assert_called_once_with(
+            [e1, e2], lookups=runner.entity_lookups)
 
     def test_can_define_combiner_for_only_one_ner(self):
         runner = CombinedNERRunner([self.runner1])
@@ -85,7 +86,8 @@ class TestCombinedNERRunner(BaseTestCombined):
 
         runner = CombinedNERRunner(runners)
         runner(doc)
-        doc.set_ner_result.assert_called_once_with(ents)
+        doc.set_ner_result.assert_called_once_with(
+            ents, lookups=runner.entity_lookups)
 
 
 class TestNEROverlappingHandling(BaseTestCombined):
@@ -117,39 +119,45 @@ class TestNEROverlappingHandling(BaseTestCombined):
         runner(self.doc)
         self.doc.set_ner_result.assert_called_once_with(
             sorted(self.result1 + self.result2,
-                   key=attrgetter('offset', 'offset_end', 'kind_name'))
+                   key=attrgetter('offset', 'offset_end', 'kind_name')),
+            lookups=runner.entity_lookups
         )
 
     def test_simple_overlap_solver_prefers_from_former_subners(self):
         NER = NoOverlapCombinedNERRunner([self.runner1, self.runner2])
         NER(self.doc)
-        self.doc.set_ner_result.assert_called_once_with(self.result1)
+        self.doc.set_ner_result.assert_called_once_with(
+            self.result1, lookups=NER.entity_lookups)
         # again, the other way around
         NER = NoOverlapCombinedNERRunner([self.runner2, self.runner1])
         self.doc.reset_mock()
         NER(self.doc)
-        self.doc.set_ner_result.assert_called_once_with(self.result2)
+        self.doc.set_ner_result.assert_called_once_with(
+            self.result2, lookups=NER.entity_lookups)
 
     def test_overlaps_is_solved_prefering_some_kind_over_other(self):
-        combiner = lambda rank: KindPreferenceCombinedNERRunner(
+        make_combiner = lambda rank: KindPreferenceCombinedNERRunner(
             [self.runner1, self.runner2],
             rank=rank
         )
-        combiner([u'X', u'W', u'Y', u'Z'])(self.doc)
+        combiner = make_combiner([u'X', u'W', u'Y', u'Z'])
+        combiner(self.doc)
         self.assertEqual(
             self.doc.set_ner_result.call_args_list[-1],
-            mock.call(self.result1))
+            mock.call(self.result1, lookups=combiner.entity_lookups))
 
         # Not ranked kinds rank bad
-        combiner([u'X', u'W'])(self.doc)
+        combiner = make_combiner([u'X', u'W'])
+        combiner(self.doc)
         self.assertEqual(
             self.doc.set_ner_result.call_args_list[-1],
-            mock.call(self.result1))
+            mock.call(self.result1, lookups=combiner.entity_lookups))
 
-        combiner([u'Z', u'Y'])(self.doc)
+        combiner = make_combiner([u'Z', u'Y'])
+        combiner(self.doc)
         self.assertEqual(
             self.doc.set_ner_result.call_args_list[-1],
-            mock.call(self.result2))
+            mock.call(self.result2, lookups=combiner.entity_lookups))
 
     def test_kindpreference_must_be_instantiated_with_tuple_or_list(self):
         combiner = lambda rank: KindPreferenceCombinedNERRunner(
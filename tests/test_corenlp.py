@@ -0,0 +1,112 @@
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+from iepy.preprocess import corenlp
+
+
+# Emulates the CoreNLP interactive shell: answers each line with an xml document
+# containing the line, followed by the prompt.
+FAKE_SHELL = r"""
+import sys
+from xml.sax.saxutils import escape
+out = sys.stdout.buffer
+out.write(b"Starting\nNLP> ")
+out.flush()
+for line in sys.stdin.buffer:
+    line = line.decode("utf8").strip()
+    if line == "q":
+        break
+    xml = '<?xml version="1.0"?><root><document><text>{}</text></document></root>'
+    out.write(xml.format(escape(line)).encode("utf8") + b"\nNLP> ")
+    out.flush()
+"""
+
+
+class FakeShellCoreNLP(corenlp.StanfordCoreNLP):
+
+    def __init__(self, batch_size=1):
+        self.batch_size = batch_size
+        self.parse_output = corenlp.parse_xml_output
+        self.corenlp_cmd = [sys.executable, "-c", FAKE_SHELL]
+        self._start_proc()
+
+
+class TestStanfordCoreNLPShell(TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        patcher = mock.patch.object(corenlp, "_FOLDER_PATH", tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.analyser = FakeShellCoreNLP(batch_size=7)
+        self.addCleanup(self.analyser.quit)
+
+    def test_analyse(self):
+        self.assertEqual(self.analyser.analyse("Hello world"), {"text": "Hello world"})
+        self.assertEqual(self.analyser.analyse("Bye\nworld"), {"text": "Bye world"})
+
+    def test_analyse_batch_answers_in_order(self):
+        texts = ["Text number {}".format(i) for i in range(50)]
+        results = self.analyser.analyse_batch(texts)
+        self.assertEqual([r["text"] for r in results], texts)
+
+    def test_analyse_batch_with_big_texts(self):
+        texts = ["word{} ".format(i) * 20000 for i in range(5)]
+        results = self.analyser.analyse_batch(texts)
+        self.assertEqual([r["text"] for r in results], [t.strip() for t in texts])
+
+    def test_analyse_many_demultiplexes_items(self):
+        items = [("doc{}".format(i), "text {}".format(i)) for i in range(20)]
+        results = list(self.analyser.analyse_many(items, text_of=lambda x: x[1]))
+        self.assertEqual([item for item, analysis in results], items)
+        self.assertEqual([a["text"] for item, a in results], [t for _, t in items])
+
+
+class TestCheckAnnotators(TestCase):
+
+    def test_annotators_are_sorted_in_running_order(self):
+        self.assertEqual(
+            corenlp.StanfordCoreNLP.check_annotators(["ner", "ssplit", "lemma", "pos", "tokenize"]),
+            ("tokenize", "ssplit", "pos", "lemma", "ner"))
+
+    def test_unknown_annotator_fails(self):
+        with self.assertRaises(ValueError):
+            corenlp.StanfordCoreNLP.check_annotators(["tokenize", "ssplit", "sentiment"])
+
+    def test_annotator_without_its_requirements_fails(self):
+        with self.assertRaises(ValueError):
+            corenlp.StanfordCoreNLP.check_annotators(["tokenize", "ssplit", "pos", "dcoref"])
+
+
+class TestGetAnalizer(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(corenlp.iepy, "instance",
+                                    mock.Mock(settings=mock.Mock(spec=[])))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(corenlp, "StanfordCoreNLP")
+        self.corenlp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.corenlp_class.return_value.fingerprint.return_value = "v1"
+
+    def get_analizer(self, cache):
+        with mock.patch.object(corenlp, "analysis_cache", return_value=cache):
+            with mock.patch("iepy.preprocess.corenlp_gazettes.read_regexner_mapping"):
+                return corenlp.start_analizer(
+                    gazettes_filepath="gazettes.tsv",
+                    annotators=("tokenize", "ssplit", "pos", "lemma", "ner"))
+
+    def test_gazettes_are_run_by_corenlp_without_cache(self):
+        analyser = self.get_analizer(None)
+        self.assertIs(analyser, self.corenlp_class.return_value)
+        self.assertEqual(self.corenlp_class.call_args[1]["gazettes_filepath"], "gazettes.tsv")
+
+    def test_gazettes_are_kept_out_of_cached_analyses(self):
+        analyser = self.get_analizer(mock.Mock())
+        self.assertIsInstance(analyser, corenlp.GazettedAnalyser)
+        self.assertEqual(analyser.gazettes_filepath, "gazettes.tsv")
+        self.assertIsInstance(analyser.analyser, corenlp.CachedAnalyser)
+        self.assertNotIn("gazettes_filepath", self.corenlp_class.call_args[1])
@@ -0,0 +1,58 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+
+from iepy.preprocess.analysis_cache import AnalysisCache, CachedAnalyser
+from iepy.preprocess.corenlp_gazettes import GazettedAnalyser, read_regexner_mapping
+from iepy.preprocess.corenlp_pool import AnalyserPool, StubAnalyser
+
+
+class TestGazettedAnalyser(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.stub = StubAnalyser()
+
+    def write_mapping(self, name, lines):
+        filepath = os.path.join(self.folder, name)
+        with open(filepath, "w", encoding="utf8") as mapping:
+            for line in lines:
+                mapping.write(line + "\tLOCATION,PERSON\n")
+        return filepath
+
+    def test_longest_names_are_tagged(self):
+        filepath = self.write_mapping("a.tsv", [
+            r"\QNew\E \QYork\E" + "\tLOCATION",
+            r"\QNew\E \QYork\E \QTimes\E" + "\t__GAZETTE_NEWSPAPER",
+            r"\QJohn\E" + "\tPERSON",
+        ])
+        analyser = GazettedAnalyser(self.stub, filepath)
+        data = analyser.analyse("John reads the New York Times . New York is big .")
+        self.assertEqual(data.ner[:7], ["PERSON", "O", "O", "__GAZETTE_NEWSPAPER",
+                                        "__GAZETTE_NEWSPAPER", "__GAZETTE_NEWSPAPER", "O"])
+        self.assertEqual(data.entity_occurrences, [
+            (0, 1, "PERSON"), (3, 6, "__GAZETTE_NEWSPAPER"), (7, 9, "LOCATION")])
+
+    def test_names_dont_cross_sentences(self):
+        filepath = self.write_mapping("a.tsv", [r"\QYork.\E \QTimes\E" + "\tLOCATION"])
+        data = GazettedAnalyser(self.stub, filepath).analyse("New York. Times are hard.")
+        self.assertEqual(data.entity_occurrences, [])
+
+    def test_cached_analyses_are_tagged_with_current_gazettes(self):
+        cache = AnalysisCache(os.path.join(self.folder, "cache.sqlite3"), 10 ** 7)
+        cached = CachedAnalyser(AnalyserPool([self.stub]), cache, "v1")
+        text = "Mary met Bob ."
+        first = self.write_mapping("first.tsv", [r"\QMary\E" + "\tPERSON"])
+        second = self.write_mapping("second.tsv", [r"\QBob\E" + "\tPERSON"])
+        data = GazettedAnalyser(cached, first).analyse(text)
+        self.assertEqual(data.entity_occurrences, [(0, 1, "PERSON")])
+        (_, data), = GazettedAnalyser(cached, second).analyse_many([text])
+        self.assertEqual(data.entity_occurrences, [(2, 3, "PERSON")])
+        self.assertEqual(self.stub.analysed, 1)
+
+    def test_mapping_is_read_once(self):
+        filepath = self.write_mapping("a.tsv", [r"\QMary\E" + "\tPERSON"])
+        self.assertIs(read_regexner_mapping(filepath), read_regexner_mapping(filepath))
+        self.assertEqual(len(read_regexner_mapping(filepath)), 1)
@@ -0,0 +1,102 @@
+import io
+from unittest import TestCase
+
+from iepy.preprocess.corenlp_output import (
+    flatten_xml_output, iter_segments, parse_json_output, parse_xml_output
+)
+
+from .corenlp_samples import json_output, xml_output
+
+
+SENTENCES = [
+    [("Lionel", "PERSON"), ("Messi", "PERSON"), ("plays", "O"), ("in", "O"),
+     ("Barcelona", "LOCATION"), (".", "O")],
+    [("He", "O"), ("is", "O"), ("from", "O"), ("Rosario", "LOCATION"),
+     ("Argentina", "LOCATION")],
+]
+COREFS = [[(1, 1, 3, 2), (2, 1, 2, 1)]]
+
+
+class TestJsonOutputParser(TestCase):
+
+    def setUp(self):
+        self.data = parse_json_output(json_output(SENTENCES, COREFS))
+
+    def test_token_lists(self):
+        self.assertEqual(self.data.tokens, [w for s in SENTENCES for w, n in s])
+        self.assertEqual(self.data.lemmas, [w.lower() for s in SENTENCES for w, n in s])
+        self.assertEqual(self.data.postags, ["NN"] * 11)
+        self.assertEqual(self.data.token_offsets[:3], [0, 7, 13])
+
+    def test_sentences(self):
+        self.assertEqual(self.data.sentence_boundaries, [0, 6, 11])
+        self.assertEqual(self.data.parse_trees, ["(ROOT (NN x0))", "(ROOT (NN x1))"])
+
+    def test_entity_occurrences_are_grouped_by_sentence(self):
+        self.assertEqual(self.data.entity_occurrences, [
+            (0, 2, "PERSON"), (4, 5, "LOCATION"), (9, 11, "LOCATION")])
+
+    def test_coreferences_in_document_offsets(self):
+        self.assertEqual(self.data.coreferences, [[(0, 2, 1), (6, 7, 6)]])
+
+    def test_text_before_json_is_ignored(self):
+        data = parse_json_output("Some logging\n" + json_output(SENTENCES))
+        self.assertEqual(data.tokens, self.data.tokens)
+        self.assertEqual(data.coreferences, [])
+
+    def test_empty_document(self):
+        data = parse_json_output(json_output([]))
+        self.assertEqual(data.tokens, [])
+        self.assertEqual(data.sentence_boundaries, [0])
+
+
+class TestXmlOutputParser(TestCase):
+
+    def test_document_is_returned(self):
+        data = parse_xml_output("Some logging\n" + xml_output(SENTENCES, COREFS))
+        sentences = data["sentences"]["sentence"]
+        self.assertEqual(len(sentences), 2)
+        self.assertEqual(sentences[0]["tokens"]["token"][0]["word"], "Lionel")
+
+    def test_flattened_like_json_output(self):
+        data = flatten_xml_output(parse_xml_output(xml_output(SENTENCES, COREFS)))
+        expected = parse_json_output(json_output(SENTENCES, COREFS))
+        self.assertEqual(vars(data), vars(expected))
+
+    def test_flattened_single_sentence_and_token(self):
+        data = flatten_xml_output(parse_xml_output(xml_output([[("Hi", "O")]])))
+        self.assertEqual(data.tokens, ["Hi"])
+        self.assertEqual(data.sentence_boundaries, [0, 1])
+        self.assertEqual(data.coreferences, [])
+
+
+class TestIterSegments(TestCase):
+    prompt = b"\nNLP> "
+
+    def segments(self, data, chunk_size):
+        stream = io.BytesIO(data)
+        return list(iter_segments(lambda: stream.read(chunk_size), self.prompt))
+
+    def test_segments_no_matter_chunk_boundaries(self):
+        pieces = ["", "first", "ñandú " * 10, "a\nNLP", "last one"]
+        data = b"".join(p.encode("utf8") + self.prompt for p in pieces)
+        for chunk_size in [1, 2, 3, 5, 6, 7, 64, len(data)]:
+            self.assertEqual(self.segments(data, chunk_size), pieces, chunk_size)
+
+    def test_incomplete_segment_at_the_end_is_not_yielded(self):
+        data = b"one" + self.prompt + b"two\nNL"
+        self.assertEqual(self.segments(data, 4), ["one"])
+
+    def test_reading_is_lazy(self):
+        chunks = [b"one" + self.prompt + b"tw", b"o" + self.prompt, b"three"]
+        read = []
+
+        def reader():
+            read.append(chunks[len(read)])
+            return read[-1]
+
+        segments = iter_segments(reader, self.prompt)
+        self.assertEqual(next(segments), "one")
+        self.assertEqual(len(read), 1)
+        self.assertEqual(next(segments), "two")
+        self.assertEqual(len(read), 2)
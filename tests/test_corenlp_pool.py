@@ -0,0 +1,119 @@
+from threading import Lock
+from unittest import TestCase, mock
+import time
+
+from iepy.preprocess.corenlp_pool import (
+    AnalyserPool, StubAnalyser, analyse_many, batches
+)
+
+
+class CountingAnalyser(StubAnalyser):
+    # Keeps track of how many analysis are running at the same time
+
+    running = 0
+    max_running = 0
+    lock = Lock()
+
+    def analyse_batch(self, texts):
+        cls = CountingAnalyser
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        try:
+            return super().analyse_batch(texts)
+        finally:
+            with cls.lock:
+                cls.running -= 1
+
+
+class TestAnalyserPool(TestCase):
+
+    def setUp(self):
+        CountingAnalyser.running = CountingAnalyser.max_running = 0
+
+    def test_needs_analysers(self):
+        with self.assertRaises(ValueError):
+            AnalyserPool([])
+
+    def test_results_keep_items_order(self):
+        pool = AnalyserPool([StubAnalyser(delay=0.01) for i in range(3)])
+        texts = ["text number {}".format(i) for i in range(10)]
+        results = list(pool.analyse_many(texts))
+        self.assertEqual([item for item, analysis in results], texts)
+        for text, analysis in results:
+            tokens = analysis["sentences"]["sentence"][0]["tokens"]["token"]
+            self.assertEqual(" ".join(t["word"] for t in tokens), text)
+
+    def test_work_is_shared_between_analysers(self):
+        analysers = [CountingAnalyser(delay=0.02) for i in range(3)]
+        pool = AnalyserPool(analysers)
+        list(pool.analyse_many(range(9), text_of=str))
+        self.assertEqual(sum(a.analysed for a in analysers), 9)
+        self.assertEqual(CountingAnalyser.max_running, 3)
+
+    def test_items_are_consumed_lazily(self):
+        pool = AnalyserPool([StubAnalyser(), StubAnalyser()])
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        results = pool.analyse_many(items(), text_of=str, max_in_flight=3)
+        next(results)
+        self.assertLessEqual(len(consumed), 4)
+
+    def test_items_are_sent_in_batches(self):
+        batch_sizes = []
+
+        class BatchRecorder(StubAnalyser):
+            def analyse_batch(self, texts):
+                batch_sizes.append(len(texts))
+                return super().analyse_batch(texts)
+
+        pool = AnalyserPool([BatchRecorder(), BatchRecorder()], batch_size=4)
+        results = list(pool.analyse_many(range(10), text_of=str))
+        self.assertEqual([item for item, analysis in results], list(range(10)))
+        self.assertEqual(sorted(batch_sizes), [2, 4, 4])
+
+    def test_throughput_grows_with_workers(self):
+        def elapsed(workers):
+            pool = AnalyserPool([StubAnalyser(delay=0.02) for i in range(workers)])
+            start = time.time()
+            list(pool.analyse_many(range(12), text_of=str))
+            return time.time() - start
+        self.assertLess(elapsed(4), elapsed(1) / 2)
+
+
+class TestStubAnalyser(TestCase):
+
+    def test_sentences_and_offsets(self):
+        analysis = StubAnalyser().analyse("Hello world. Bye")
+        sentences = analysis["sentences"]["sentence"]
+        self.assertEqual(len(sentences), 2)
+        words = [[t["word"] for t in s["tokens"]["token"]] for s in sentences]
+        self.assertEqual(words, [["Hello", "world."], ["Bye"]])
+        offsets = [t["CharacterOffsetBegin"] for s in sentences for t in s["tokens"]["token"]]
+        self.assertEqual(offsets, ["0", "6", "13"])
+
+
+class TestAnalyseMany(TestCase):
+
+    def test_uses_batch_api_when_available(self):
+        analyser = StubAnalyser()
+        with mock.patch.object(analyser, "analyse_batch",
+                               wraps=analyser.analyse_batch) as m:
+            results = list(analyse_many(analyser, ["a", "b", "c"], batch_size=2))
+        self.assertEqual([item for item, analysis in results], ["a", "b", "c"])
+        self.assertEqual(m.call_count, 2)
+
+    def test_works_with_analysers_without_batch_api(self):
+        analyser = mock.Mock(spec=["analyse"])
+        analyser.analyse.side_effect = lambda text: text.upper()
+        results = list(analyse_many(analyser, ["a", "b", "c"], batch_size=2))
+        self.assertEqual(results, [("a", "A"), ("b", "B"), ("c", "C")])
+
+    def test_batches(self):
+        self.assertEqual(list(batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batches([], 2)), [])
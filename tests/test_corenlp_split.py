@@ -0,0 +1,139 @@
+import re
+from unittest import TestCase
+
+from iepy.preprocess.corenlp_output import (
+    FlatAnalysisData, parse_xml_output
+)
+from iepy.preprocess.corenlp_pool import AnalyserPool
+from iepy.preprocess.corenlp_split import (
+    SplittingAnalyser, merge_analyses, split_text
+)
+
+from .corenlp_samples import xml_output
+
+
+class FakeAnalyser:
+    """Tokenizes on whitespace, with sentences ending on a dot, and capitalized
+    words tagged as PERSON"""
+
+    def __init__(self):
+        self.texts = []
+
+    def analyse(self, text):
+        self.texts.append(text)
+        data = FlatAnalysisData()
+        for match in re.finditer(r"\S+", text):
+            word = match.group()
+            data.tokens.append(word)
+            data.lemmas.append(word.lower())
+            data.postags.append("NN")
+            data.ner.append("PERSON" if word[0].isupper() else "O")
+            data.token_offsets.append(match.start())
+            if word.endswith("."):
+                data.sentence_boundaries.append(len(data.tokens))
+                data.parse_trees.append("(ROOT)")
+        if data.sentence_boundaries[-1] != len(data.tokens):
+            data.sentence_boundaries.append(len(data.tokens))
+            data.parse_trees.append("(ROOT)")
+        start = 0
+        for end in data.sentence_boundaries[1:]:
+            upper = [i for i in range(start, end) if data.ner[i] == "PERSON"]
+            data.entity_occurrences.extend((i, i + 1, "PERSON") for i in upper)
+            if len(upper) > 1:
+                data.coreferences.append([(i, i + 1, i) for i in upper])
+            start = end
+        return data
+
+    def analyse_many(self, items, text_of=str):
+        for item in items:
+            yield item, self.analyse(text_of(item))
+
+
+TEXT = ("John met Mary in the park. It was sunny.\n\n"
+        "Later, Peter called Anna.\nThey talked for hours about the weather.")
+
+
+class TestSplitText(TestCase):
+
+    def test_short_text_is_not_split(self):
+        self.assertEqual(split_text("Some text.", 100), [(0, 10)])
+
+    def test_pieces_cover_the_text(self):
+        pieces = split_text(TEXT, 30)
+        self.assertEqual(pieces[0][0], 0)
+        self.assertEqual(pieces[-1][1], len(TEXT))
+        for (_, end), (start, _) in zip(pieces, pieces[1:]):
+            self.assertEqual(end, start)
+        for start, end in pieces:
+            self.assertLessEqual(end - start, 30)
+
+    def test_paragraphs_are_preferred(self):
+        start, end = split_text(TEXT, 60)[0]
+        self.assertTrue(TEXT[:end].endswith("sunny.\n\n"))
+
+    def test_sentence_ends_before_spaces(self):
+        text = "One two three. Four five six seven eight"
+        self.assertEqual(split_text(text, 25)[0], (0, 15))
+
+    def test_words_are_not_cut(self):
+        text = "aaaa bbbb cccc dddd"
+        for start, end in split_text(text, 7):
+            self.assertNotIn(" ", text[start:end].strip())
+
+    def test_text_without_spaces_is_cut(self):
+        self.assertEqual(split_text("x" * 10, 4), [(0, 4), (4, 8), (8, 10)])
+
+
+class TestMergeAnalyses(TestCase):
+
+    def test_merged_like_analysed_at_once(self):
+        analyser = FakeAnalyser()
+        whole = analyser.analyse(TEXT)
+        pieces = split_text(TEXT, 45)
+        self.assertGreater(len(pieces), 1)
+        merged = merge_analyses([(start, analyser.analyse(TEXT[start:end]))
+                                 for start, end in pieces])
+        self.assertEqual(vars(merged), vars(whole))
+
+    def test_coreferences_and_entities_are_shifted(self):
+        analyser = FakeAnalyser()
+        merged = merge_analyses([(0, analyser.analyse("Ann met Bob. ")),
+                                 (13, analyser.analyse("Carl saw Dan."))])
+        self.assertEqual(merged.entity_occurrences, [
+            (0, 1, "PERSON"), (2, 3, "PERSON"), (3, 4, "PERSON"), (5, 6, "PERSON")])
+        self.assertEqual(merged.coreferences, [
+            [(0, 1, 0), (2, 3, 2)], [(3, 4, 3), (5, 6, 5)]])
+        self.assertEqual(merged.token_offsets, [0, 4, 8, 13, 18, 22])
+        self.assertEqual(merged.sentence_boundaries, [0, 3, 6])
+
+    def test_xml_results_are_merged(self):
+        part = parse_xml_output(xml_output([[("Hi", "O"), ("Bob", "PERSON")]]))
+        merged = merge_analyses([(0, part), (7, part)])
+        self.assertEqual(merged.tokens, ["Hi", "Bob", "Hi", "Bob"])
+        self.assertEqual(merged.token_offsets, [0, 3, 7, 10])
+        self.assertEqual(merged.entity_occurrences, [(1, 2, "PERSON"), (3, 4, "PERSON")])
+
+
+class TestSplittingAnalyser(TestCase):
+
+    def test_short_texts_go_as_they_are(self):
+        fake = FakeAnalyser()
+        analyser = SplittingAnalyser(fake, 1000)
+        analyser.analyse(TEXT)
+        self.assertEqual(fake.texts, [TEXT])
+
+    def test_long_texts_go_in_pieces(self):
+        fake = FakeAnalyser()
+        analyser = SplittingAnalyser(fake, 45)
+        result = analyser.analyse(TEXT)
+        self.assertGreater(len(fake.texts), 1)
+        self.assertLessEqual(max(len(t) for t in fake.texts), 45)
+        self.assertEqual(vars(result), vars(FakeAnalyser().analyse(TEXT)))
+
+    def test_analyse_many_keeps_items_order(self):
+        texts = ["Short one.", TEXT, "Another short.", TEXT]
+        analyser = SplittingAnalyser(AnalyserPool([FakeAnalyser(), FakeAnalyser()]), 45)
+        results = list(analyser.analyse_many(texts))
+        self.assertEqual([item for item, _ in results], texts)
+        for text, result in results:
+            self.assertEqual(vars(result), vars(FakeAnalyser().analyse(text)))
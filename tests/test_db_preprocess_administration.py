@@ -50,6 +50,53 @@ class TestDocumentCreationThruManager(ManagerTestCase):
         self.assertEqual(doc.metadata.items, new_metadata)
 
 
+class TestNearDuplicateDocuments(ManagerTestCase):
+    text = ('The quick brown fox jumps over the lazy dog while the farmer '
+            'sleeps under the old oak tree near the river bank, dreaming of '
+            'a good harvest and warm bread for the long winter ahead of them.')
+    docmanager = DocumentManager()
+
+    def create(self, identifier, text, **kwargs):
+        return self.docmanager.create_document(identifier, text,
+                                               link_duplicates=True, **kwargs)
+
+    def test_near_duplicate_is_linked_to_first_document(self):
+        doc1 = self.create('doc1', self.text)
+        doc2 = self.create('doc2', self.text + ' Read more.')
+        self.assertIsNone(doc1.metadata.duplicate_of)
+        self.assertEqual(doc2.metadata.duplicate_of, doc1)
+        self.assertEqual(len(doc2.metadata.minhash), 128)
+
+    def test_different_documents_are_not_linked(self):
+        self.create('doc1', self.text)
+        doc2 = self.create('doc2', 'A completely different story about cats, '
+                                   'written by someone else on another day.')
+        self.assertIsNone(doc2.metadata.duplicate_of)
+
+    def test_not_linked_unless_enabled(self):
+        self.create('doc1', self.text)
+        doc2 = self.docmanager.create_document('doc2', self.text)
+        self.assertIsNone(doc2.metadata.duplicate_of)
+
+    def test_updated_text_is_compared_again(self):
+        doc1 = self.create('doc1', self.text)
+        doc2 = self.create('doc2', 'Something else entirely.')
+        self.assertIsNone(doc2.metadata.duplicate_of)
+        doc2 = self.create('doc2', self.text, update_mode=True)
+        self.assertEqual(doc2.metadata.duplicate_of, doc1)
+
+    def test_duplicates_can_be_skipped_on_preprocess(self):
+        doc1 = self.create('doc1', self.text)
+        self.create('doc2', self.text)
+        step = PreProcessSteps.tokenization
+        self.assertEqual(
+            list(self.docmanager.get_documents_lacking_preprocess(
+                step, skip_duplicates=True)),
+            [doc1])
+        self.assertEqual(
+            len(self.docmanager.get_documents_lacking_preprocess(step)), 2)
+
+
 class TestDocumentsPreprocessMetadata(ManagerTestCase):
 
     def test_preprocess_steps(self):
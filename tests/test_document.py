@@ -1,3 +1,7 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from iepy.data.models import Entity, EntityLookupCache
 from iepy.preprocess.ner.base import FoundEntity
 
 from .factories import SentencedIEDocFactory, GazetteItemFactory
@@ -77,3 +81,54 @@ class TestSetNERResults(ManagerTestCase):
         eo = self.doc.entity_occurrences.first()
         # the one that is saved is the first one
         self.assertEqual(eo.entity.key, f_eo.key)
+
+    def test_existent_entities_are_reused(self):
+        f_eo = self._f_eo()
+        self.doc.set_ner_result([f_eo])
+        other_doc = SentencedIEDocFactory(text="The dog is dead. Long live the dog.")
+        other_doc.set_ner_result([f_eo])
+        self.assertEqual(Entity.objects.count(), 1)
+        self.assertEqual(other_doc.entity_occurrences.first().entity,
+                         self.doc.entity_occurrences.first().entity)
+
+    def test_queries_do_not_grow_with_the_number_of_entities(self):
+        lookups = EntityLookupCache()
+
+        def queries_for(doc, count):
+            found = [self._f_eo(key='key %d %d' % (doc.pk, i), offset=i, offset_end=i + 1)
+                     for i in range(count)]
+            with CaptureQueriesContext(connection) as context:
+                doc.set_ner_result(found, lookups=lookups)
+            keys = [eo.entity.key for eo in doc.entity_occurrences.order_by('offset')]
+            self.assertEqual(keys, [f.key for f in found])
+            return len(context.captured_queries)
+
+        other_doc = SentencedIEDocFactory(text="The dog is dead. Long live the dog.")
+        lookups.get_kind('ABC')
+        self.assertEqual(queries_for(self.doc, 2),
+                         queries_for(other_doc, len(other_doc.tokens)))
+
+    def test_gazette_items_are_found_with_other_spacing(self):
+        f_eo = self._f_eo(key="The dog", from_gazette=True)
+        GazetteItemFactory(kind__name=f_eo.kind_name, text=" The  dog ")
+        self.doc.set_ner_result([f_eo])
+        entity = self.doc.entity_occurrences.get().entity
+        self.assertIsNotNone(entity.gazette)
+        self.assertEqual(entity.key, f_eo.key)
+
+    def test_missing_gazette_items_are_stored_as_plain_entities(self):
+        f_eo = self._f_eo(from_gazette=True)
+        self.doc.set_ner_result([f_eo])
+        entity = self.doc.entity_occurrences.get().entity
+        self.assertIsNone(entity.gazette)
+        self.assertEqual(entity.key, f_eo.key)
+
+    def test_lookups_cache_kinds_and_gazette_items(self):
+        f_eo = self._f_eo(from_gazette=True)
+        GazetteItemFactory(kind__name=f_eo.kind_name, text=f_eo.key)
+        lookups = EntityLookupCache()
+        kind = lookups.get_kind(f_eo.kind_name)
+        item = lookups.get_gazette_item(f_eo.key, kind)
+        with self.assertNumQueries(0):
+            self.assertIs(lookups.get_kind(f_eo.kind_name), kind)
+            self.assertIs(lookups.get_gazette_item(f_eo.key, kind), item)
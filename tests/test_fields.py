@@ -0,0 +1,100 @@
+from unittest import TestCase, mock
+
+from corpus.fields import (
+    IntListField, StringListField, ListSyntacticTreeField, LazyTreeList, select_trees
+)
+
+from .factories import IEDocFactory
+from .manager_case import ManagerTestCase
+from iepy.data.models import IEDocument
+
+
+class TestCompactListFields(TestCase):
+
+    def test_strings_roundtrip(self):
+        field = StringListField()
+        values = ["Hello", "", "ñandú", "it's", "[", "']", "\\", "日本"]
+        stored = field.get_prep_value(values)
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(field.to_python(stored), values)
+
+    def test_ints_roundtrip(self):
+        field = IntListField()
+        values = [0, 3, 1000, 2 ** 31 - 1]
+        stored = field.get_prep_value(values)
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(field.to_python(stored), values)
+
+    def test_empty_values(self):
+        for field in [IntListField(), StringListField()]:
+            self.assertEqual(field.to_python(None), [])
+            self.assertEqual(field.to_python(b""), [])
+            self.assertEqual(field.to_python(""), [])
+            self.assertEqual(field.to_python(field.get_prep_value([])), [])
+
+    def test_old_text_representation_is_readable(self):
+        self.assertEqual(StringListField().to_python("['a', 'b c']"), ["a", "b c"])
+        self.assertEqual(StringListField().to_python(b"['a', 'b c']"), ["a", "b c"])
+        self.assertEqual(IntListField().to_python(memoryview(b"[1, 2]")), [1, 2])
+
+    def test_tuples_are_taken_as_lists(self):
+        self.assertEqual(StringListField().to_python(("a", "b")), ["a", "b"])
+        field = IntListField()
+        self.assertEqual(field.to_python(field.get_prep_value((1, 2))), [1, 2])
+
+    def test_binary_data_is_readable_as_memoryview(self):
+        field = StringListField()
+        stored = field.get_prep_value(["x", "yz"])
+        self.assertEqual(field.to_python(memoryview(stored)), ["x", "yz"])
+
+
+class TestCompactListFieldsStorage(ManagerTestCase):
+
+    def test_document_lists_survive_db_roundtrip(self):
+        doc = IEDocFactory(text="Hello there , María .")
+        doc.set_tokenization_result([(0, "Hello"), (6, "there"), (12, ","),
+                                     (14, "María"), (20, ".")])
+        doc.set_sentencer_result([0, 5])
+        doc.set_tagging_result(["UH", "RB", ",", "NNP", "."])
+        doc.save()
+        loaded = IEDocument.objects.get(pk=doc.pk)
+        self.assertEqual(loaded.tokens, ["Hello", "there", ",", "María", "."])
+        self.assertEqual(loaded.offsets_to_text, [0, 6, 12, 14, 20])
+        self.assertEqual(loaded.sentences, [0, 5])
+        self.assertEqual(loaded.postags, ["UH", "RB", ",", "NNP", "."])
+        self.assertEqual(loaded.lemmas, [])
+
+
+class TestLazySyntacticTrees(TestCase):
+    raw_trees = ["(ROOT (NP (NN one)))", "(ROOT (NP (NN two)))", "(ROOT (NP (NN three)))"]
+
+    def test_loaded_value_is_lazy_and_preserves_raw_strings(self):
+        field = ListSyntacticTreeField()
+        with mock.patch("corpus.fields.Tree.fromstring") as mock_fromstring:
+            value = field.to_python(str(self.raw_trees))
+            self.assertEqual(len(value), 3)
+            self.assertEqual(field.get_prep_value(value), str(self.raw_trees))
+            self.assertFalse(mock_fromstring.called)
+
+    def test_trees_are_parsed_only_when_accessed(self):
+        trees = LazyTreeList(self.raw_trees)
+        self.assertEqual(trees[1].leaves(), ["two"])
+        self.assertEqual(list(trees._parsed), [1])
+        self.assertIs(trees[1], trees[1])
+        self.assertEqual([t.leaves() for t in trees], [["one"], ["two"], ["three"]])
+
+    def test_cache_size_bounds_the_parsed_trees_kept(self):
+        trees = LazyTreeList(self.raw_trees, cache_size=2)
+        trees[0]
+        trees[1]
+        trees[0]
+        trees[2]
+        self.assertEqual(list(trees._parsed), [0, 2])
+
+    def test_select_trees_is_lazy_for_lazy_lists(self):
+        trees = LazyTreeList(self.raw_trees)
+        selected = select_trees(trees, [2, 0])
+        self.assertEqual(list(trees._parsed), [])
+        self.assertEqual(selected[0].leaves(), ["three"])
+        self.assertEqual(list(trees._parsed), [2])
+        self.assertEqual(select_trees(["a", "b"], [1]), ["b"])
@@ -0,0 +1,40 @@
+import shutil
+import tempfile
+
+from iepy.preprocess.gazettes import GazetteManager
+from iepy.preprocess.ner.gazette import GazetteNERRunner
+
+from .factories import SentencedIEDocFactory, GazetteItemFactory
+from .manager_case import ManagerTestCase
+from .test_ner import NERTestMixin
+
+
+class TestGazetteNERRunner(ManagerTestCase, NERTestMixin):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test(self):
+        hiv = GazetteItemFactory(text="HIV", kind__name="DISEASE")
+        GazetteItemFactory(text="Hepatitis C", kind__name="DISEASE")
+        doc = SentencedIEDocFactory(
+            text="Chase notes she's negative for HIV and Hepatitis C")
+
+        runner = GazetteNERRunner(gazette_manager=GazetteManager(self.folder))
+        runner(doc)
+
+        # (the tokenizer splits she's in two parts)
+        self.check_ner_result(doc, [(6, 7, 'DISEASE'), (8, 10, 'DISEASE')])
+        occurrence = self.get_ner_result(doc)[0]
+        self.assertEqual(occurrence.entity.gazette, hiv)
+
+    def test_items_with_other_spacing(self):
+        item = GazetteItemFactory(text="Hepatitis  C ", kind__name="DISEASE")
+        doc = SentencedIEDocFactory(text="Chase notes she's negative for Hepatitis C")
+
+        runner = GazetteNERRunner(gazette_manager=GazetteManager(self.folder))
+        runner(doc)
+
+        self.check_ner_result(doc, [(6, 8, 'DISEASE')])
+        self.assertEqual(self.get_ner_result(doc)[0].entity.gazette, item)
@@ -0,0 +1,85 @@
+from unittest import TestCase
+import os
+import sys
+import tempfile
+
+from iepy.preprocess.java_tagger import JavaTaggerProcess, TaggerOutputError, TaggerProcessError
+
+
+# Stands for a tagger process: tags each token with its length, and splits
+# sentences with more than 3 tokens in two lines
+FAKE_TAGGER = """
+import sys
+for line in sys.stdin:
+    tagged = ["{}_{}".format(t, len(t)) for t in line.split()]
+    print(" ".join(tagged[:3]))
+    if tagged[3:]:
+        print(" ".join(tagged[3:]))
+    sys.stdout.flush()
+"""
+
+# Joins the first two tokens of each sentence, counting the sentences it tagged
+# on the given file
+JOINING_TAGGER = """
+import sys
+for line in sys.stdin:
+    with open(sys.argv[1], "a") as count:
+        count.write("x")
+    tokens = line.split()
+    print(" ".join("{}_X".format(t) for t in ["".join(tokens[:2])] + tokens[2:]))
+    sys.stdout.flush()
+"""
+
+# Dies on its first sentence if the given file exists (removing it)
+DYING_TAGGER = """
+import os, sys
+if os.path.exists(sys.argv[1]):
+    os.remove(sys.argv[1])
+    sys.exit(1)
+""" + FAKE_TAGGER
+
+
+class TestJavaTaggerProcess(TestCase):
+
+    def tagger(self, script, *args):
+        process = JavaTaggerProcess([sys.executable, "-c", script] + list(args), separator="_")
+        self.addCleanup(process.close)
+        return process
+
+    def test_sentences_are_tagged(self):
+        tagger = self.tagger(FAKE_TAGGER)
+        sentences = [["a", "bb"], [], ["a", "bb", "ccc", "dddd", "e_e"]]
+        self.assertEqual(tagger.tag_sents(sentences), [
+            [("a", "1"), ("bb", "2")],
+            [],
+            [("a", "1"), ("bb", "2"), ("ccc", "3"), ("dddd", "4"), ("e_e", "3")],
+        ])
+
+    def test_many_sentences_at_once(self):
+        tagger = self.tagger(FAKE_TAGGER)
+        sentences = [["word"] * 20] * 2000
+        result = tagger.tag_sents(sentences)
+        self.assertEqual(len(result), 2000)
+        self.assertEqual(result[-1], [("word", "4")] * 20)
+
+    def test_process_is_restarted_if_it_dies(self):
+        _, flag = tempfile.mkstemp()
+        tagger = self.tagger(DYING_TAGGER, flag)
+        self.assertEqual(tagger.tag_sents([["a"]]), [[("a", "1")]])
+        self.assertFalse(os.path.exists(flag))
+
+    def test_gives_up_if_it_keeps_dying(self):
+        tagger = self.tagger("import sys; sys.exit(1)")
+        with self.assertRaises(TaggerProcessError):
+            tagger.tag_sents([["a"]])
+
+    def test_other_tokens_are_not_sent_again(self):
+        _, counter = tempfile.mkstemp()
+        self.addCleanup(os.remove, counter)
+        tagger = self.tagger(JOINING_TAGGER, counter)
+        with self.assertRaises(TaggerOutputError):
+            tagger.tag_sents([["a", "b", "c"]])
+        with open(counter) as count:
+            self.assertEqual(count.read(), "x")
+        # Once started again, the tagger keeps working
+        self.assertEqual(tagger.tag_sents([["a"]]), [[("a", "X")]])
@@ -1,7 +1,9 @@
 from unittest import TestCase
+import os
+import tempfile
 
 from iepy.data.models import IEDocument
-from iepy.preprocess.ner.literal import LiteralNER, LiteralNERRunner
+from iepy.preprocess.ner.literal import LiteralNER, LiteralNERRunner, TokenTrie
 from iepy.preprocess.pipeline import PreProcessSteps
 
 from .factories import SentencedIEDocFactory, NamedTemporaryFile23
@@ -66,6 +68,53 @@ class TestLiteralNER(TestCase):
                              ((4, 5), 'MEDICAL_TEST'), ((5, 7), 'DISEASE')]
         self.assertEqual(result, expected_entities)
 
+    def test_save_and_load(self):
+        tagger = LiteralNER(NEW_ENTITIES,
+                            [self.tmp_file1.name, self.tmp_file2.name])
+        tmpdir = tempfile.mkdtemp()
+        filepath = os.path.join(tmpdir, "tagger.pickle")
+        self.addCleanup(os.rmdir, tmpdir)
+        self.addCleanup(os.remove, filepath)
+        tagger.save(filepath)
+        self.assertRaises(ValueError, tagger.save, filepath)
+        loaded = LiteralNER.load(filepath)
+        s = "CT scan said HIV MRI Hepatitis C".split()
+        self.assertEqual(loaded.entities(s), tagger.entities(s))
+
+    def test_cached_is_built_again_when_the_sources_change(self):
+        tmpdir = tempfile.mkdtemp()
+        filepath = os.path.join(tmpdir, "tagger.pickle")
+        self.addCleanup(os.rmdir, tmpdir)
+        self.addCleanup(os.remove, filepath)
+        tagger = LiteralNER.cached(['DISEASE'], [self.tmp_file1.name], filepath)
+        self.assertEqual(tagger.entities(["HIV", "MRI"]), [((0, 1), 'DISEASE')])
+        tagger = LiteralNER.cached(['MEDICAL_TEST'], [self.tmp_file2.name], filepath)
+        self.assertEqual(tagger.entities(["HIV", "MRI"]), [((1, 2), 'MEDICAL_TEST')])
+
+
+class TestTokenTrie(TestCase):
+
+    def setUp(self):
+        self.trie = TokenTrie()
+        self.trie.add("New York".split(), "LOCATION")
+        self.trie.add("New York City Hall".split(), "BUILDING")
+        self.trie.add("York".split(), "LOCATION")
+
+    def test_longest_match(self):
+        tokens = "at New York City Hall today".split()
+        self.assertEqual(self.trie.longest_match(tokens, 1), (5, "BUILDING"))
+        self.assertEqual(self.trie.longest_match(tokens, 2), (3, "LOCATION"))
+        self.assertIsNone(self.trie.longest_match(tokens, 0))
+
+    def test_shorter_name_is_found_when_a_longer_one_is_incomplete(self):
+        tokens = "New York City".split()
+        self.assertEqual(self.trie.matches(tokens), [((0, 2), "LOCATION")])
+
+    def test_last_label_added_wins(self):
+        self.trie.add(["York"], "PERSON")
+        self.assertEqual(self.trie.matches(["York"]), [((0, 1), "PERSON")])
+        self.assertEqual(len(self.trie), 3)
+
 
 class TestLiteralNERRunner(ManagerTestCase, NERTestMixin):
 
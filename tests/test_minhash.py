@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+from iepy.data import minhash
+
+
+class TestMinHash(TestCase):
+    text = ('The quick brown fox jumps over the lazy dog while the farmer '
+            'sleeps under the old oak tree near the river bank.')
+
+    def test_signature_is_deterministic(self):
+        signature = minhash.signature(self.text)
+        self.assertEqual(len(signature), minhash.PERMUTATIONS)
+        self.assertEqual(signature, minhash.signature(self.text))
+
+    def test_signature_fits_in_4_bytes_ints(self):
+        for value in minhash.signature(self.text):
+            self.assertTrue(0 <= value < 2 ** 31)
+
+    def test_similar_texts(self):
+        a = minhash.signature(self.text)
+        b = minhash.signature(self.text.upper() + " And then it rained.")
+        self.assertGreater(minhash.similarity(a, b), 0.6)
+        self.assertEqual(minhash.similarity(a, a), 1)
+
+    def test_different_texts(self):
+        a = minhash.signature(self.text)
+        b = minhash.signature("Stock markets fell sharply on Monday after the "
+                              "central bank raised interest rates again.")
+        self.assertLess(minhash.similarity(a, b), 0.1)
+
+    def test_band_hashes(self):
+        a = minhash.band_hashes(minhash.signature(self.text))
+        b = minhash.band_hashes(minhash.signature(self.text + " The end."))
+        self.assertEqual([band for band, _ in a], list(range(minhash.BANDS)))
+        # Nearly the same texts share some band
+        self.assertTrue(set(a) & set(b))
+
+    def test_short_text(self):
+        signature = minhash.signature("Hi there")
+        self.assertEqual(len(signature), minhash.PERMUTATIONS)
+        self.assertEqual(minhash.similarity(signature, minhash.signature("hi, there!")), 1)
@@ -50,3 +50,18 @@ class TestNERRunner(ManagerTestCase, NERTestMixin):
             text='The student Rami Eid Stony Brook University in NY')
         self.check_ner(doc, [(2, 4, 'PERSON'), (4, 7, 'ORGANIZATION')])
 
+
+    def test_sentences_of_several_documents_are_tagged_at_once(self):
+        docs = [SentencedIEDocFactory(text='Rami Eid is studying . At Stony Brook University'),
+                SentencedIEDocFactory(text='The student Rami Eid')]
+        calls = []
+
+        def ner(sents):
+            calls.append(len(sents))
+            return [[(t, self.entity_map.get(t, 'O')) for t in sent] for sent in sents]
+        runner = NERRunner(ner, batch_size=10)
+        done = list(runner.process_documents(docs))
+        self.assertEqual(done, docs)
+        self.assertEqual(calls, [3])
+        self.check_ner_result(docs[0], [(0, 2, 'PERSON'), (6, 9, 'ORGANIZATION')])
+        self.check_ner_result(docs[1], [(2, 4, 'PERSON')])
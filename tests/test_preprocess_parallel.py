@@ -0,0 +1,60 @@
+from multiprocessing import Manager
+from unittest import TestCase, mock
+import os
+
+from iepy.preprocess.parallel import ParallelPreprocess
+
+
+# Chunk processors run on the worker processes. Instead of the step runners
+# builder, they get a shared list where the processed ids are recorded.
+
+def record_chunk(processed, ids):
+    processed.extend(ids)
+    return len(ids), 0.01
+
+
+def fail_on_13(processed, ids):
+    if 13 in ids:
+        raise ValueError("Unprocessable document")
+    return record_chunk(processed, ids)
+
+
+def die_on_7(processed, ids):
+    if 7 in ids:
+        os._exit(1)
+    return record_chunk(processed, ids)
+
+
+class TestParallelPreprocess(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("iepy.preprocess.parallel._close_db_connections")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = Manager()
+        self.addCleanup(self.manager.shutdown)
+        self.processed = self.manager.list()
+
+    def run_parallel(self, process_chunk, ids):
+        parallel = ParallelPreprocess(self.processed, workers=3, chunk_size=4,
+                                      process_chunk=process_chunk)
+        return parallel.run(ids)
+
+    def test_all_documents_are_processed_once(self):
+        failed = self.run_parallel(record_chunk, range(50))
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(self.processed), list(range(50)))
+
+    def test_failing_document_is_reported_and_the_rest_processed(self):
+        failed = self.run_parallel(fail_on_13, range(30))
+        self.assertEqual(failed, [13])
+        self.assertEqual(sorted(self.processed), [i for i in range(30) if i != 13])
+
+    def test_documents_are_not_lost_when_a_worker_dies(self):
+        failed = self.run_parallel(die_on_7, range(30))
+        self.assertEqual(failed, [7])
+        self.assertEqual(set(self.processed), set(range(30)) - {7})
+
+    def test_no_documents(self):
+        self.assertEqual(self.run_parallel(record_chunk, []), [])
+        self.assertEqual(list(self.processed), [])
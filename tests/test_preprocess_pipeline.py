@@ -4,9 +4,15 @@ except ImportError:
     import mock
 
 from unittest import TestCase
+import time
 
 from iepy.preprocess.pipeline import PreProcessPipeline, PreProcessSteps
+from iepy.preprocess.timing import ANALYSER, timed
 from iepy.data.db import DocumentManager
+from iepy.data.models import EntityKind, EntityOccurrence, IEDocument
+from iepy.preprocess.ner.base import BaseNERRunner
+from .factories import IEDocFactory, SentencedIEDocFactory
+from .manager_case import ManagerTestCase
 
 
 class TestPreProcessPipeline(TestCase):
@@ -101,3 +107,135 @@ class TestPreProcessPipeline(TestCase):
             self.assertEqual(mock_batch.call_args_list,
                              [mock.call(runner1), mock.call(runner2)])
         self.assertEqual(p.call_order, [runner1, runner2])
+
+    def test_time_spent_by_each_runner_on_each_document_is_recorded(self):
+        def runner(doc):
+            with timed(ANALYSER):
+                time.sleep(0.001)
+        docs = [mock.MagicMock(pk=i, tokens=["a", "b"]) for i in range(3)]
+        p = PreProcessPipeline([runner], docs)
+        p.process_everything()
+        self.assertEqual([r["document"] for r in p.timings.records], [0, 1, 2])
+        summary = p.timings.summary()["runner"]
+        self.assertEqual(summary["documents"], 3)
+        self.assertEqual(summary["tokens"], 6)
+        self.assertGreater(summary[ANALYSER], 0)
+
+
+class TestPreProcessPipelineTransactions(ManagerTestCase):
+
+    def test_only_the_changes_of_the_failed_document_are_lost(self):
+        docs = [IEDocFactory(text="doc {}".format(i)) for i in range(7)]
+        calls = []
+
+        def runner(doc):
+            calls.append(doc.pk)
+            doc.text = doc.text.upper()
+            doc.save()
+            if doc.pk == docs[3].pk:
+                raise ValueError("Broken document")
+
+        p = PreProcessPipeline([runner], IEDocument.objects.order_by('id'), commit_every=5)
+        p.process_everything()
+        texts = [d.text for d in IEDocument.objects.order_by('id')]
+        self.assertEqual(texts, ["DOC 0", "DOC 1", "DOC 2", "doc 3", "DOC 4", "DOC 5", "DOC 6"])
+        # The failed document is retried, and the rest of its batch run one by one
+        pks = [d.pk for d in docs]
+        self.assertEqual(calls, pks[:4] + pks[3:])
+        self.assertEqual(len(p.timings.records), 6)
+
+    def test_kinds_created_by_a_failed_document_are_not_reused(self):
+        docs = [SentencedIEDocFactory(text="Hello world . Bye .") for i in range(3)]
+
+        class FailingNERRunner(BaseNERRunner):
+            def run_ner(self, doc):
+                if doc.pk == docs[0].pk:
+                    return []
+                return [self.build_occurrence("gun", "weapon", "Hello", 0, 1)]
+
+            def store_ner_result(self, doc, entities):
+                super().store_ner_result(doc, entities)
+                if doc.pk == docs[1].pk:
+                    # After the new kind was created
+                    raise ValueError("Broken document")
+
+        runner = FailingNERRunner()
+        p = PreProcessPipeline([runner], IEDocument.objects.order_by('id'), commit_every=5)
+        p.process_everything()
+        self.assertFalse(EntityOccurrence.objects.filter(document=docs[1]).exists())
+        occurrence = EntityOccurrence.objects.get(document=docs[2])
+        self.assertTrue(EntityKind.objects.filter(pk=occurrence.entity.kind_id).exists())
+        self.assertEqual(occurrence.entity.kind.name, "WEAPON")
+
+
+
+class FakeDocument(object):
+    """Stands for an IEDocument, recording the saves"""
+
+    def __init__(self, pk):
+        self.pk = pk
+        self.tokens = []
+        self.call_order = []
+        self.saves = []
+
+    def save(self, **kwargs):
+        self.saves.append(kwargs)
+
+
+class TestWalkEverything(TestCase):
+
+    def runner(self, name, reads=None, writes=None):
+        def run(doc):
+            doc.call_order.append(name)
+            doc.save()
+        runner = mock.Mock(wraps=run, spec=["__call__", "reads", "writes"])
+        runner.reads, runner.writes = reads, writes
+        return runner
+
+    def test_walk_document_with_save_saves_once_the_fields_written(self):
+        runner1 = self.runner(1, reads=("text",), writes=("tokens", "tokenization_done_at"))
+        runner2 = self.runner(2, reads=("tokens",), writes=("ner_done_at",))
+        doc = FakeDocument(1)
+        p = PreProcessPipeline([runner1, runner2], [])
+        with p.timings.collecting():
+            p.walk_document(doc, save=True)
+        self.assertEqual(doc.call_order, [1, 2])
+        self.assertEqual(doc.saves, [
+            {"update_fields": ["ner_done_at", "tokenization_done_at", "tokens"]}])
+        # Saving works as usual afterwards
+        doc.save()
+        self.assertEqual(len(doc.saves), 2)
+
+    def test_all_fields_are_saved_if_some_runner_does_not_declare_them(self):
+        runner1 = self.runner(1, writes=("tokens",))
+        runner2 = self.runner(2)
+        doc = FakeDocument(1)
+        PreProcessPipeline([runner1, runner2], []).walk_document(doc, save=True)
+        self.assertEqual(doc.saves, [{"update_fields": None}])
+
+    def test_walk_document_does_not_save_if_runners_did_not(self):
+        runner = mock.Mock(spec=["__call__"])
+        doc = FakeDocument(1)
+        PreProcessPipeline([runner], []).walk_document(doc, save=True)
+        self.assertEqual(doc.saves, [])
+
+    def test_walk_everything_loads_only_the_fields_used(self):
+        runner = self.runner(1, reads=("text",), writes=("tokens",))
+        runner.step = PreProcessSteps.tokenization
+        runner.override = runner.increment = False
+        docs = [FakeDocument(i) for i in range(3)]
+        dm_get_docs = mock.patch.object(DocumentManager, 'get_documents_lacking_preprocess',
+                                        return_value=docs)
+        with dm_get_docs as get_docs:
+            p = PreProcessPipeline([runner], DocumentManager())
+            p.walk_everything()
+        steps, = get_docs.call_args[0]
+        self.assertEqual(steps, [PreProcessSteps.tokenization])
+        fields = get_docs.call_args[1]["fields"]
+        self.assertTrue({"text", "tokens", "ner_done_at"}.issubset(fields))
+        for doc in docs:
+            self.assertEqual(doc.call_order, [1])
+            self.assertEqual(doc.saves, [{"update_fields": ["tokens"]}])
+        runners = [r["runner"] for r in p.timings.records]
+        self.assertEqual(len(runners), 6)
+        self.assertEqual(runners.count("Save"), 3)
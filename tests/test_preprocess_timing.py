@@ -0,0 +1,69 @@
+from unittest import TestCase, mock
+import json
+import tempfile
+
+from iepy.preprocess import timing
+from iepy.preprocess.timing import PreprocessTimings, timed
+
+
+class Doc:
+    def __init__(self, pk, tokens):
+        self.pk = pk
+        self.tokens = tokens
+
+
+class TestPreprocessTimings(TestCase):
+
+    def setUp(self):
+        self.timings = PreprocessTimings()
+        patcher = mock.patch("iepy.preprocess.timing.time.time")
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def time_phase(self, phase, seconds):
+        self.clock.side_effect = [0.0, seconds]
+        with timed(phase):
+            pass
+
+    def test_timed_does_nothing_when_not_collecting(self):
+        self.time_phase(timing.ANALYSER, 2)
+        self.timings.document_done("runner", Doc(1, []), 2)
+        self.assertEqual(self.timings.records[0][timing.ANALYSER], 0)
+
+    def test_phases_are_recorded_for_the_next_document_done(self):
+        with self.timings.collecting():
+            self.time_phase(timing.ANALYSER, 2)
+            self.time_phase(timing.DATABASE, 0.5)
+            self.time_phase(timing.ANALYSER, 1)
+            self.timings.document_done("runner", Doc(1, ["a", "b"]), 4)
+            self.timings.document_done("runner", Doc(2, ["c"]), 1)
+        first, second = self.timings.records
+        self.assertEqual((first["document"], first["tokens"], first["total"]), (1, 2, 4))
+        self.assertEqual(first[timing.ANALYSER], 3)
+        self.assertEqual(first[timing.DATABASE], 0.5)
+        self.assertEqual(second[timing.ANALYSER], 0)
+        self.assertIsNone(timing._collector)
+
+    def test_summary_per_runner(self):
+        with self.timings.collecting():
+            self.time_phase(timing.PARSING, 1)
+            self.timings.document_done("first", Doc(1, ["a", "b"]), 2)
+            self.timings.document_done("first", Doc(2, ["c", "d"]), 2)
+            self.timings.document_done("second", Doc(1, ["a", "b"]), 1)
+        summary = self.timings.summary()
+        self.assertEqual(list(summary), ["first", "second"])
+        first = summary["first"]
+        self.assertEqual(first["documents"], 2)
+        self.assertEqual(first["tokens"], 4)
+        self.assertEqual(first[timing.PARSING], 1)
+        self.assertEqual(first["other"], 3)
+        self.assertEqual(first["tokens_per_second"], 1)
+        self.assertEqual(summary["second"]["tokens_per_second"], 2)
+
+    def test_export_json(self):
+        self.timings.document_done("runner", Doc(1, ["a"]), 1)
+        with tempfile.NamedTemporaryFile(mode="r", suffix=".json") as json_file:
+            self.timings.export_json(json_file.name)
+            exported = json.load(json_file)
+        self.assertEqual(exported["summary"]["runner"]["documents"], 1)
+        self.assertEqual(exported["documents"][0]["document"], 1)
@@ -1,6 +1,7 @@
 import unittest
+from collections import namedtuple
 
-from iepy.data.models import TextSegment, EntityOccurrence
+from iepy.data.models import TextSegment, EntityOccurrence, occurrences_by_token
 from iepy.preprocess.segmenter import RawSegment, SyntacticSegmenterRunner
 
 from .factories import IEDocFactory, EntityFactory, EntityOccurrenceFactory, TextSegmentFactory
@@ -240,3 +241,32 @@ class TestDocumentSegmenter(ManagerTestCase):
         self.assertEqual(s.offset, 0)
         self.assertEqual(s.offset_end, 20)
         self.assertEqual(len(s.entity_occurrences), 2)
+
+
+FakeEO = namedtuple("FakeEO", "name offset offset_end")
+
+
+class TestOccurrencesByToken(unittest.TestCase):
+
+    def naive(self, eos, tokens_count):
+        return [[eo for eo in eos if eo.offset <= i < eo.offset_end]
+                for i in range(tokens_count)]
+
+    def test_no_occurrences(self):
+        self.assertEqual(occurrences_by_token([], 3), [[], [], []])
+
+    def test_overlapping_and_nested_occurrences(self):
+        eos = [FakeEO("a", 0, 2), FakeEO("b", 1, 5), FakeEO("c", 2, 3),
+               FakeEO("d", 2, 4), FakeEO("e", 6, 7)]
+        self.assertEqual(occurrences_by_token(eos, 8), self.naive(eos, 8))
+
+    def test_unsorted_occurrences_give_sorted_results(self):
+        eos = [FakeEO("b", 3, 4), FakeEO("a", 1, 4)]
+        result = occurrences_by_token(eos, 5)
+        self.assertEqual([eo.name for eo in result[3]], ["a", "b"])
+
+    def test_custom_span(self):
+        eos = [FakeEO("a", 10, 12)]
+        result = occurrences_by_token(
+            eos, 3, span=lambda eo: (eo.offset - 10, eo.offset_end - 10))
+        self.assertEqual(result, [[eos[0]], [eos[0]], []])
@@ -1,13 +1,23 @@
 from unittest import TestCase, mock
 from datetime import datetime
+import os
+import re
+import shutil
+import tempfile
 
 from .factories import (IEDocFactory, SentencedIEDocFactory, GazetteItemFactory,
                         EntityOccurrenceFactory, EntityKindFactory)
 from .manager_case import ManagerTestCase
+import iepy
+from iepy.preprocess.corenlp import StanfordCoreNLP
+from iepy.preprocess.gazettes import gazettes_folder
+from iepy.preprocess.corenlp_pool import AnalyserPool, StubAnalyser
 from iepy.preprocess.pipeline import PreProcessSteps
+from iepy.preprocess.corenlp_output import parse_json_output, parse_xml_output
 from iepy.preprocess.stanford_preprocess import (
     StanfordPreprocess, GazetteManager, apply_coreferences, CoreferenceError,
-    StanfordAnalysis)
+    StanfordAnalysis, FlatStanfordAnalysis, make_analysis)
+from .corenlp_samples import json_output, xml_output
 
 
 class TestableStanfordAnalysis(StanfordAnalysis):
@@ -162,6 +172,45 @@ class TestSentenceFunctions(TestCase):
         self.assertEqual(len(tokens), len(lemmas))
 
 
+
+class TestFlatStanfordAnalysis(TestCase):
+    sentences = [
+        [("Lionel", "PERSON"), ("Messi", "PERSON"), ("plays", "O"), ("in", "O"),
+         ("Barcelona", "LOCATION"), (".", "O")],
+        [("He", "O"), ("is", "O"), ("from", "O"), ("Rosario", "LOCATION")],
+        [("Hi", "O")],
+    ]
+    corefs = [[(1, 1, 3, 2), (2, 1, 2, 1)]]
+
+    def test_json_and_xml_outputs_give_same_analysis(self):
+        xml_analysis = make_analysis(
+            parse_xml_output(xml_output(self.sentences, self.corefs)))
+        json_analysis = make_analysis(
+            parse_json_output(json_output(self.sentences, self.corefs)))
+        self.assertIsInstance(xml_analysis, StanfordAnalysis)
+        self.assertIsInstance(json_analysis, FlatStanfordAnalysis)
+        for getter in ["get_tokens", "get_lemmas", "get_token_offsets", "get_pos",
+                       "get_sentence_boundaries", "get_parse_trees",
+                       "get_entity_occurrences", "get_coreferences"]:
+            self.assertEqual(getattr(json_analysis, getter)(),
+                             getattr(xml_analysis, getter)(), getter)
+        self.assertEqual(json_analysis.get_found_entities("doc"),
+                         xml_analysis.get_found_entities("doc"))
+        self.assertEqual(
+            [[t["word"] for t in s] for s in json_analysis.get_sentences()],
+            [[t["word"] for t in s] for s in xml_analysis.get_sentences()])
+
+
+def patch_gazettes_folder(test_case):
+    # Gazettes are built on a temporary folder, instead of iepy's data folder
+    folder = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, folder)
+    patcher = mock.patch("iepy.preprocess.gazettes.gazettes_folder", return_value=folder)
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    return folder
+
+
 class TestPreProcessCall(ManagerTestCase):
 
     def _doc_creator(self, mark_as_done):
@@ -182,10 +231,19 @@ class TestPreProcessCall(ManagerTestCase):
             pps.syntactic_parsing
         ]
 
+        patch_gazettes_folder(self)
         patcher = mock.patch("iepy.preprocess.corenlp.get_analizer")
         self.mock_get_analizer = patcher.start()
         self.mock_analizer = self.mock_get_analizer.return_value
         self.addCleanup(patcher.stop)
+        # Analysers for partial runs are started on their own, but mocked alike
+        patcher = mock.patch("iepy.preprocess.corenlp.start_analizer", self.mock_get_analizer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("iepy.preprocess.corenlp.configured_annotators",
+                             return_value=StanfordCoreNLP.ANNOTATORS)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.stanfordpp = StanfordPreprocess()
 
     def test_if_all_steps_are_done_then_no_step_is_run(self):
@@ -207,25 +265,104 @@ class TestPreProcessCall(ManagerTestCase):
         for step in self._all_steps:
             self.assertTrue(doc.was_preprocess_step_done(step))
 
+    def _old_doc_creator(self, missing, text="Some text. More text"):
+        # A document preprocessed by an older version of IEPY, tokenized and
+        # split in sentences as the StubAnalyser does
+        doc = IEDocFactory(text=text)
+        tokens = [(m.start(), m.group()) for m in re.finditer(r"\S+", text)]
+        doc.set_tokenization_result(tokens)
+        sentences = [i + 1 for i, (_, token) in enumerate(tokens) if token.endswith(".")]
+        if not sentences or sentences[-1] != len(tokens):
+            sentences.append(len(tokens))
+        doc.set_sentencer_result([0] + sentences)
+        for step in self._all_steps:
+            if step not in missing:
+                setattr(doc, "{}_done_at".format(step.name), datetime.now())
+        doc.save()
+        return doc
+
     def test_lemmatization_is_run_even_all_others_already_did(self):
         # On release 0.9.1 lemmatization was added. This checks it's possible to
         # increment older preprocessed docs
-        doc_no_lemmas = self._doc_creator(
-            [s for s in self._all_steps if s is not PreProcessSteps.lemmatization])
-        with mock.patch.object(self.stanfordpp, "lemmatization_only") as mock_lemmatization:
-            mock_lemmatization.side_effect = lambda x: None
-            self.stanfordpp(doc_no_lemmas)
-            self.assertTrue(mock_lemmatization.called)
+        doc_no_lemmas = self._old_doc_creator([PreProcessSteps.lemmatization])
+        self.mock_analizer.analyse.side_effect = StubAnalyser().analyse
+        self.stanfordpp(doc_no_lemmas)
+        self.mock_get_analizer.assert_called_with(
+            workers=None, annotators=("tokenize", "ssplit", "pos", "lemma"))
+        self.assertEqual(doc_no_lemmas.lemmas, ["some", "text.", "more", "text"])
+        self.assertTrue(doc_no_lemmas.was_preprocess_step_done(PreProcessSteps.lemmatization))
 
     def test_syntactic_parsing_is_run_even_all_others_already_did(self):
         # On release 0.9.2 syntac parsing was added. This checks it's possible to
         # increment older preprocessed docs
-        doc_no_synparse = self._doc_creator(
-            [s for s in self._all_steps if s is not PreProcessSteps.syntactic_parsing])
-        with mock.patch.object(self.stanfordpp, "syntactic_parsing_only") as mock_synparse:
-            mock_synparse.side_effect = lambda x: None
-            self.stanfordpp(doc_no_synparse)
-            self.assertTrue(mock_synparse.called)
+        doc_no_synparse = self._old_doc_creator([PreProcessSteps.syntactic_parsing])
+        self.mock_analizer.analyse.side_effect = StubAnalyser().analyse
+        self.stanfordpp(doc_no_synparse)
+        self.mock_get_analizer.assert_called_with(
+            workers=None, annotators=("tokenize", "ssplit", "pos", "parse"))
+        self.assertEqual(len(doc_no_synparse.syntactic_sentences), 2)
+        self.assertTrue(
+            doc_no_synparse.was_preprocess_step_done(PreProcessSteps.syntactic_parsing))
+        self.assertFalse(doc_no_synparse.lemmas)
+
+    def test_syntactic_parsing_needs_the_same_sentences(self):
+        doc = self._old_doc_creator([PreProcessSteps.syntactic_parsing])
+        doc.set_sentencer_result([0, 4]).save()
+        self.mock_analizer.analyse.side_effect = StubAnalyser().analyse
+        with self.assertRaisesRegex(ValueError, "sentences differ"):
+            self.stanfordpp(doc)
+        self.assertFalse(doc.was_preprocess_step_done(PreProcessSteps.syntactic_parsing))
+
+    def test_missing_steps_are_added_with_a_single_analysis_and_save(self):
+        missing = [PreProcessSteps.lemmatization, PreProcessSteps.syntactic_parsing]
+        doc = self._old_doc_creator(missing)
+        self.mock_analizer.analyse.side_effect = StubAnalyser().analyse
+        with mock.patch.object(doc, "save", wraps=doc.save) as mock_save:
+            self.stanfordpp(doc)
+        self.assertEqual(self.mock_analizer.analyse.call_count, 1)
+        self.assertEqual(mock_save.call_count, 1)
+        self.mock_get_analizer.assert_called_with(
+            workers=None, annotators=("tokenize", "ssplit", "pos", "lemma", "parse"))
+        for step in missing:
+            self.assertTrue(doc.was_preprocess_step_done(step))
+
+    def test_documents_missing_some_steps_are_processed_in_batch(self):
+        analysers = {}
+
+        def get_analizer(workers=None, annotators=None):
+            return analysers.setdefault(annotators, AnalyserPool([StubAnalyser()]))
+        self.mock_get_analizer.side_effect = get_analizer
+        self.stanfordpp.corenlp = get_analizer()
+        no_lemmas = [self._old_doc_creator([PreProcessSteps.lemmatization])
+                     for _ in range(2)]
+        fresh = IEDocFactory(text="Some text. More text")
+        processed = list(self.stanfordpp.process_documents(no_lemmas + [fresh]))
+        self.assertEqual(processed, no_lemmas + [fresh])
+        lemma_annotators = ("tokenize", "ssplit", "pos", "lemma")
+        self.assertEqual(analysers[lemma_annotators].analysers[0].analysed, 2)
+        self.assertEqual(analysers[None].analysers[0].analysed, 1)
+        for doc in processed:
+            self.assertEqual(doc.lemmas, ["some", "text.", "more", "text"])
+
+    def test_partial_run_analysers_are_quit(self):
+        analysers = {}
+
+        def start_analizer(workers=None, annotators=None):
+            return analysers.setdefault(annotators, mock.MagicMock())
+        self.mock_get_analizer.side_effect = start_analizer
+        lemma_annotators = ("tokenize", "ssplit", "pos", "lemma")
+        parse_annotators = ("tokenize", "ssplit", "pos", "parse")
+        self.assertIs(self.stanfordpp.analyser_for(lemma_annotators),
+                      self.stanfordpp.analyser_for(lemma_annotators))
+        self.assertFalse(analysers[lemma_annotators].quit.called)
+        # Only the last one is kept running
+        self.stanfordpp.analyser_for(parse_annotators)
+        self.assertEqual(analysers[lemma_annotators].quit.call_count, 1)
+        self.assertFalse(analysers[parse_annotators].quit.called)
+        # And it's quit once the documents are processed
+        list(self.stanfordpp.process_documents([]))
+        self.assertEqual(analysers[parse_annotators].quit.call_count, 1)
+        self.assertFalse(self.stanfordpp.corenlp.quit.called)
 
     def test_can_add_ner_on_incremental_mode_over_already_preprocessed_documents(self):
         doc_done = self._doc_creator(mark_as_done=self._all_steps)
@@ -242,8 +379,68 @@ class TestPreProcessCall(ManagerTestCase):
                 self.assertEqual(mock_run_everything.call_count, 1)
 
 
+    def test_documents_can_be_processed_in_batch_with_a_pool(self):
+        analysers = [StubAnalyser(), StubAnalyser()]
+        self.stanfordpp.corenlp = AnalyserPool(analysers, batch_size=3)
+        done = self._doc_creator(mark_as_done=self._all_steps)
+        fresh = [IEDocFactory(text="Some text. More text {}".format(i)) for i in range(4)]
+        processed = list(self.stanfordpp.process_documents(fresh[:2] + [done] + fresh[2:]))
+        self.assertEqual(processed, fresh)
+        self.assertEqual(sum(a.analysed for a in analysers), 4)
+        for doc in fresh:
+            self.assertEqual(doc.tokens, ["Some", "text.", "More", "text", doc.text[-1]])
+            self.assertEqual(doc.sentences, [0, 2, 5])
+            for step in self._all_steps:
+                self.assertTrue(doc.was_preprocess_step_done(step))
+
+    def test_only_the_steps_of_the_chosen_annotators_are_done(self):
+        stanfordpp = StanfordPreprocess(annotators=["tokenize", "ssplit", "pos", "lemma", "ner"])
+        self.mock_get_analizer.assert_called_with(
+            gazettes_filepath=None, workers=None,
+            annotators=("tokenize", "ssplit", "pos", "lemma", "ner"))
+        self.mock_analizer.analyse.side_effect = StubAnalyser().analyse
+        doc = IEDocFactory(text="Some text. More text")
+        stanfordpp(doc)
+        for step in self._all_steps:
+            done = step is not PreProcessSteps.syntactic_parsing
+            self.assertEqual(doc.was_preprocess_step_done(step), done)
+        self.assertEqual(stanfordpp.tasks_for(doc), [])
+        # Enabling the parser later, only that is added
+        self.assertEqual(self.stanfordpp.tasks_for(doc), [self.stanfordpp.missing_steps_only])
+        self.assertEqual(self.stanfordpp.missing_steps(doc), [PreProcessSteps.syntactic_parsing])
+
+    def test_steps_of_annotators_enabled_later_are_added(self):
+        stanfordpp = StanfordPreprocess(annotators=["tokenize", "ssplit"])
+        self.mock_analizer.analyse.side_effect = StubAnalyser().analyse
+        doc = IEDocFactory(text="Some text. More text")
+        stanfordpp(doc)
+        self.assertFalse(doc.was_preprocess_step_done(PreProcessSteps.tagging))
+        # Enabling all the annotators later, the missing steps are added
+        self.assertEqual(self.stanfordpp.missing_steps(doc), [
+            PreProcessSteps.tagging, PreProcessSteps.lemmatization,
+            PreProcessSteps.ner, PreProcessSteps.syntactic_parsing])
+        self.stanfordpp(doc)
+        self.mock_get_analizer.assert_called_with(
+            workers=None, gazettes_filepath=None,
+            annotators=("tokenize", "ssplit", "pos", "lemma", "ner", "parse"))
+        for step in self._all_steps:
+            self.assertTrue(doc.was_preprocess_step_done(step))
+        self.assertEqual(doc.postags, ["NN"] * 4)
+
+    def test_tokenization_and_sentences_are_always_needed(self):
+        with self.assertRaises(ValueError):
+            StanfordPreprocess(annotators=["tokenize"])
+
+    def test_increment_ner_needs_the_ner_annotator(self):
+        with self.assertRaises(ValueError):
+            StanfordPreprocess(increment_ner=True, annotators=["tokenize", "ssplit", "pos"])
+
+
 class TestGazetteer(ManagerTestCase):
 
+    def setUp(self):
+        patch_gazettes_folder(self)
+
     def test_generate_gazettes_file_empty(self):
         self.assertEqual(GazetteManager().generate_stanford_gazettes_file(), None)
 
@@ -303,6 +500,49 @@ class TestGazetteer(ManagerTestCase):
             # But ofcourse, if have different aliases, not
             self.assertNotEqual(found_entities[0].key, found_entities[1].key)
 
+    def test_gazettes_are_reused_until_items_change(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        GazetteItemFactory(text="Stuart Little")
+        first = GazetteManager(folder).generate_stanford_gazettes_file()
+        with mock.patch.object(GazetteManager, "_build") as mock_build:
+            again = GazetteManager(folder)
+        self.assertFalse(mock_build.called)
+        self.assertEqual(again.generate_stanford_gazettes_file(), first)
+        self.assertEqual(again.find_entities("I saw Stuart Little".split())[0][0], (2, 4))
+        GazetteItemFactory(text="Memento")
+        self.assertNotEqual(GazetteManager(folder).generate_stanford_gazettes_file(), first)
+
+    def test_files_of_older_gazettes_are_removed(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        other_file = os.path.join(folder, "notes.tsv")
+        open(other_file, "w").close()
+        GazetteItemFactory(text="Stuart Little")
+        first = GazetteManager(folder)
+        GazetteItemFactory(text="Memento")
+        second = GazetteManager(folder)
+        self.assertEqual(sorted(os.listdir(folder)), sorted([
+            "notes.tsv", second.fingerprint + ".tsv", second.fingerprint + ".pickle"]))
+        self.assertNotEqual(first.fingerprint, second.fingerprint)
+
+    def test_folder_is_taken_from_the_instance(self):
+        instance = mock.Mock(__file__="/some/instance/__init__.py", settings=mock.Mock(spec=[]))
+        with mock.patch.object(iepy, "instance", instance):
+            self.assertEqual(gazettes_folder(), "/some/instance/gazettes")
+            instance.settings = mock.Mock(GAZETTES_FOLDER="/elsewhere")
+            self.assertEqual(gazettes_folder(), "/elsewhere")
+
+    def test_native_kinds_aliases_are_looked_up(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        GazetteItemFactory(text="Diego Maradona", kind__name="PERSON")
+        gm = GazetteManager(folder)
+        self.assertTrue(gm.was_entry_created_by_gazette("Diego Maradona", "PERSON"))
+        self.assertFalse(gm.was_entry_created_by_gazette("Diego", "PERSON"))
+        self.assertFalse(gm.was_entry_created_by_gazette("Diego Maradona", "LOCATION"))
+        self.assertTrue(gm.was_entry_created_by_gazette("x", gm._PREFIX + "MOVIE"))
+
     def test_escaping(self):
         texts = [
             "Maradona",
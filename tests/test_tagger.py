@@ -42,3 +42,31 @@ class TestTaggerRunner(ManagerTestCase):
         tag(doc)
         self.assertTrue(all(x == 'B' for x in doc.postags))
 
+
+    def test_sentences_of_several_documents_are_tagged_at_once(self):
+        docs = [SentencedIEDocFactory(text='Some sentence. And some other.'),
+                SentencedIEDocFactory(text='Indeed!')]
+        calls = []
+
+        def postagger(sents):
+            calls.append(len(sents))
+            return [[(x, 'A') for x in sent] for sent in sents]
+        tag = TaggerRunner(postagger, batch_size=10)
+        done = list(tag.process_documents(docs))
+        self.assertEqual(done, docs)
+        self.assertEqual(calls, [3])
+        for doc in docs:
+            self.assertTrue(doc.was_preprocess_step_done(PreProcessSteps.tagging))
+            self.assertEqual(doc.postags, ['A'] * len(doc.tokens))
+
+    def test_missing_tagged_sentences_are_reported(self):
+        docs = [SentencedIEDocFactory(text='Some sentence. And some other.'),
+                SentencedIEDocFactory(text='Indeed!')]
+        tag = TaggerRunner(lambda sents: [[(x, 'A') for x in sent] for sent in sents[1:]],
+                           batch_size=10)
+        with self.assertRaisesRegex(ValueError, "2 sentences instead of 3"):
+            list(tag.process_documents(docs))
+        with self.assertRaisesRegex(ValueError, docs[0].human_identifier):
+            tag(docs[0])
+        for doc in docs:
+            self.assertFalse(doc.was_preprocess_step_done(PreProcessSteps.tagging))